@@ -1,16 +1,59 @@
 from fastapi import FastAPI, Header, HTTPException, Request
 from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from typing import Optional, Dict, Any
 import httpx
 from verification import verify_supabase_jwt
+from sse_relay import StreamSlots, relay, STREAM_HEADERS, STREAM_IDLE_TIMEOUT
 import os, logging
 from dotenv import load_dotenv
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
 
 #load_dotenv()
 logging.basicConfig(level=logging.INFO)
 
-app = FastAPI(title="Lucas Backend Server")
+# ------- UPSTREAM CLIENT -------
+# One pooled client for every call to the agent service, so requests reuse warm connections
+AGENT_MAX_CONNECTIONS = int(os.getenv("AGENT_MAX_CONNECTIONS", "200"))
+AGENT_MAX_KEEPALIVE = int(os.getenv("AGENT_MAX_KEEPALIVE", "50"))
+AGENT_KEEPALIVE_EXPIRY = float(os.getenv("AGENT_KEEPALIVE_EXPIRY", "30"))
+AGENT_HTTP2 = os.getenv("AGENT_HTTP2", "1") == "1"
+# Per-route timeouts: session calls are short, chat and progress streams stay quiet while agents work
+# and are closed once the upstream has been silent for STREAM_IDLE_TIMEOUT
+SESSION_TIMEOUT = httpx.Timeout(float(os.getenv("SESSION_TIMEOUT", "15")), connect=5.0)
+STREAM_TIMEOUT = httpx.Timeout(connect=5.0, read=STREAM_IDLE_TIMEOUT, write=15.0, pool=10.0)
+stream_slots = StreamSlots()
+
+def http2_available():
+    """HTTP/2 needs the optional h2 package (httpx[http2])."""
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def build_agent_client():
+    """Pooled client shared by all requests; HTTP/2 is negotiated with TLS upstreams when h2 is installed."""
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=AGENT_MAX_CONNECTIONS,
+            max_keepalive_connections=AGENT_MAX_KEEPALIVE,
+            keepalive_expiry=AGENT_KEEPALIVE_EXPIRY,
+        ),
+        http2=AGENT_HTTP2 and http2_available(),
+        timeout=SESSION_TIMEOUT,
+    )
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.agent = build_agent_client()
+    try:
+        yield
+    finally:
+        await app.state.agent.aclose()
+
+app = FastAPI(title="Lucas Backend Server", lifespan=lifespan)
 
 origins = [
     "https://lucas-frontend-215805715498.us-central1.run.app",
@@ -28,6 +71,7 @@ app.add_middleware(
 )
 
 website = os.getenv("website")
+mcp_website = os.getenv("MCP")  # MCP tool server, streams sandbox progress
 
 #  VERIFY JWT TOKEN
 
@@ -112,28 +156,62 @@ async def send_message(
         "streaming": True
     }
     logging.info("Calling Lucas Agents")
-    # 5 Forward request to Lucas ADK Agent
-    async def event_stream():
-        try:
-            async with httpx.AsyncClient(timeout=None) as client:
-                async with client.stream(
-                    "POST",
-                    f"{website}/run_sse",
-                    json=run_payload,
-                ) as response:
-                    response.raise_for_status()
-
-                    async for line in response.aiter_lines():
-                        if line.startswith("data:"):
-                            yield f"{line}\n\n"  # forward as-is
-        except httpx.RequestError as e:
-            yield f"data: {{\"error\": \"Agent unreachable: {str(e)}\"}}\n\n"
-        except httpx.HTTPStatusError as e:
-            yield f"data: {{\"error\": \"Agent error: {e.response.text}\"}}\n\n"
-        except Exception as e:
-            yield f"data: {{\"error\": \"Internal error: {str(e)}\"}}\n\n"
-
-    return StreamingResponse(event_stream(), media_type="text/event-stream")
+    # 5 Forward request to Lucas ADK Agent, events are relayed as the agent emits them
+    release = stream_slots.acquire(run_payload["user_id"])
+    event_stream = relay(
+        request,
+        request.app.state.agent,
+        "POST",
+        f"{website}/run_sse",
+        release,
+        name="Agent",
+        json=run_payload,
+        timeout=STREAM_TIMEOUT,
+    )
+    return StreamingResponse(event_stream, media_type="text/event-stream", headers=STREAM_HEADERS,
+                             background=BackgroundTask(release))
+
+#------- SANDBOX PROGRESS -------
+
+@app.get("/progress/{session_id}")
+async def sandbox_progress(session_id: str, request: Request, authorization: Optional[str] = Header(None)):
+    '''
+    Streams live progress of the session's sandbox runs (phases, bars processed, partial metrics, logs)
+    from the MCP server as server-sent events. session_id is the chat session, which must be the caller's.
+    '''
+    if not authorization or not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Missing or invalid Authorization header")
+
+    token = authorization.split(" ")[1]
+    logging.info("Verifying Progress Tokens")
+    user_claims = verify_supabase_jwt(token)
+    if not user_claims:
+        raise HTTPException(status_code=401, detail="Invalid or expired token")
+
+    user_id = user_claims.get("sub", "anonymous_user")
+    # Agent sessions are stored per user, so only the owner finds this one
+    try:
+        response = await request.app.state.agent.get(
+            f"{website}/apps/Lucas-agent-app/users/{user_id}/sessions/{session_id}",
+            timeout=SESSION_TIMEOUT
+        )
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=503, detail=f"Session service unreachable: {str(e)}")
+    if response.status_code != 200:
+        raise HTTPException(status_code=404, detail="Session not found")
+
+    release = stream_slots.acquire(user_id)
+    event_stream = relay(
+        request,
+        request.app.state.agent,
+        "GET",
+        f"{mcp_website}/progress/{session_id}",
+        release,
+        name="Progress",
+        timeout=STREAM_TIMEOUT,
+    )
+    return StreamingResponse(event_stream, media_type="text/event-stream", headers=STREAM_HEADERS,
+                             background=BackgroundTask(release))
 
 # --------SESSION MANAGEMENT-----------
 
@@ -166,14 +244,13 @@ async def create_or_update_session(
     user_id = user_claims.get("sub", "anonymous_user")
 
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{website}/apps/Lucas-agent-app/users/{user_id}/sessions/{session_id}",
-                json=payload,
-                timeout=60.0
-            )
-            response.raise_for_status()
-            return response.json()
+        response = await request.app.state.agent.post(
+            f"{website}/apps/Lucas-agent-app/users/{user_id}/sessions/{session_id}",
+            json=payload,
+            timeout=SESSION_TIMEOUT
+        )
+        response.raise_for_status()
+        return response.json()
     except httpx.RequestError as e:
         raise HTTPException(status_code=503, detail=f"Session service unreachable: {str(e)}")
     except httpx.HTTPStatusError as e:
@@ -181,7 +258,7 @@ async def create_or_update_session(
 
 
 @app.get("/session/{session_id}")
-async def get_session(session_id: str, authorization: Optional[str] = Header(None)):
+async def get_session(session_id: str, request: Request, authorization: Optional[str] = Header(None)):
     """Fetch a specific session state and events."""
     if not authorization or not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Missing or invalid Authorization header")
@@ -194,13 +271,12 @@ async def get_session(session_id: str, authorization: Optional[str] = Header(Non
     user_id = user_claims.get("sub", "anonymous_user")
 
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                f"{website}/apps/Lucas-agent-app/users/{user_id}/sessions/{session_id}",
-                timeout=60.0
-            )
-            response.raise_for_status()
-            return response.json()
+        response = await request.app.state.agent.get(
+            f"{website}/apps/Lucas-agent-app/users/{user_id}/sessions/{session_id}",
+            timeout=SESSION_TIMEOUT
+        )
+        response.raise_for_status()
+        return response.json()
     except httpx.RequestError as e:
         raise HTTPException(status_code=503, detail=f"Session service unreachable: {str(e)}")
     except httpx.HTTPStatusError as e:
@@ -208,7 +284,7 @@ async def get_session(session_id: str, authorization: Optional[str] = Header(Non
 
 
 @app.delete("/session/{session_id}")
-async def delete_session(session_id: str, authorization: Optional[str] = Header(None)):
+async def delete_session(session_id: str, request: Request, authorization: Optional[str] = Header(None)):
     """Delete a session for the user."""
     if not authorization or not authorization.startswith("Bearer "):
         raise HTTPException(status_code=401, detail="Missing or invalid Authorization header")
@@ -222,15 +298,14 @@ async def delete_session(session_id: str, authorization: Optional[str] = Header(
     user_id = user_claims.get("sub", "anonymous_user")
 
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.delete(
-                f"{website}/apps/Lucas-agent-app/users/{user_id}/sessions/{session_id}",
-                timeout=60.0
-            )
-            if response.status_code == 204:
-                return {"message": f"Session {session_id} deleted successfully"}
-            response.raise_for_status()
-            return response.json()
+        response = await request.app.state.agent.delete(
+            f"{website}/apps/Lucas-agent-app/users/{user_id}/sessions/{session_id}",
+            timeout=SESSION_TIMEOUT
+        )
+        if response.status_code == 204:
+            return {"message": f"Session {session_id} deleted successfully"}
+        response.raise_for_status()
+        return response.json()
     except httpx.RequestError as e:
         raise HTTPException(status_code=503, detail=f"Session service unreachable: {str(e)}")
     except httpx.HTTPStatusError as e:
@@ -0,0 +1,250 @@
+'''
+Load benchmark of the gateway against a stub agent service (a script, not part of the test suite).
+
+Starts a stub of the Lucas agent (session routes and /run_sse) and the gateway on local ports.
+
+requests: drives authenticated session reads and /message streams at a fixed concurrency, once with
+a fresh httpx client per upstream call (the old behaviour) and once with the shared pooled client.
+streams: opens many concurrent /message streams of multi-line events, some clients hanging up early,
+and reports time to first event, event integrity, upstream requests left open and the per-user cap.
+
+    python bench_gateway.py requests --requests 2000 --concurrency 50
+    python bench_gateway.py streams --clients 500
+'''
+
+import os
+import sys
+import time
+import socket
+import asyncio
+import argparse
+import threading
+
+SECRET = "load-test-secret"
+os.environ["SUPABASE_JWT_SECRET"] = SECRET
+
+import httpx
+import uvicorn
+from jose import jwt
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+STUB_STREAMS = {"open": 0, "cancelled": 0}
+
+def stub_agent(latency=0.005, events=5):
+    ''' Agent service stand-in: fixed latency session routes and a short SSE run of multi-line events '''
+    app = FastAPI()
+
+    @app.post("/apps/{app_name}/users/{user_id}/sessions/{session_id}")
+    async def create(app_name: str, user_id: str, session_id: str):
+        await asyncio.sleep(latency)
+        return {"id": session_id, "userId": user_id, "state": {}}
+
+    @app.get("/apps/{app_name}/users/{user_id}/sessions/{session_id}")
+    async def get(app_name: str, user_id: str, session_id: str):
+        await asyncio.sleep(latency)
+        return {"id": session_id, "userId": user_id, "events": []}
+
+    @app.post("/run_sse")
+    async def run_sse():
+        async def stream():
+            STUB_STREAMS["open"] += 1
+            try:
+                for i in range(events):
+                    await asyncio.sleep(latency)
+                    yield f'id: {i}\ndata: {{"part": {i},\ndata:  "text": "line one"}}\n\n'
+            except asyncio.CancelledError:
+                STUB_STREAMS["cancelled"] += 1
+                raise
+            finally:
+                STUB_STREAMS["open"] -= 1
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
+
+def serve(app, port):
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+class PerRequestClient:
+    ''' The previous behaviour: a new client, and so a new connection, for every upstream call '''
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+
+    async def _call(self, method, *args, **kwargs):
+        async with httpx.AsyncClient(**self.kwargs) as client:
+            return await getattr(client, method)(*args, **kwargs)
+
+    async def get(self, *args, **kwargs):
+        return await self._call("get", *args, **kwargs)
+
+    async def post(self, *args, **kwargs):
+        return await self._call("post", *args, **kwargs)
+
+    async def delete(self, *args, **kwargs):
+        return await self._call("delete", *args, **kwargs)
+
+    def stream(self, *args, **kwargs):
+        outer = self
+
+        class _Stream:
+            async def __aenter__(self):
+                self.client = httpx.AsyncClient(**outer.kwargs)
+                self.context = self.client.stream(*args, **kwargs)
+                return await self.context.__aenter__()
+
+            async def __aexit__(self, *exc):
+                await self.context.__aexit__(*exc)
+                await self.client.aclose()
+
+        return _Stream()
+
+    async def aclose(self):
+        pass
+
+def _percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] * 1000
+
+async def _drive(gateway, token, total, concurrency, stream_every):
+    latencies, errors = [], 0
+    headers = {"Authorization": f"Bearer {token}"}
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=gateway, headers=headers, limits=limits, timeout=30) as client:
+        async def one(i):
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    if stream_every and i % stream_every == 0:
+                        body = {"session_id": f"s{i}", "message": "hi"}
+                        async with client.stream("POST", "/message", json=body) as response:
+                            async for _ in response.aiter_bytes():
+                                pass
+                    else:
+                        response = await client.get(f"/session/s{i}")
+                        response.raise_for_status()
+                    latencies.append(time.perf_counter() - start)
+                except Exception:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        elapsed = time.perf_counter() - start
+    return latencies, errors, elapsed
+
+def _token(user="load-test-user"):
+    return jwt.encode({"sub": user, "exp": int(time.time()) + 3600}, SECRET, algorithm="HS256")
+
+async def _stream_clients(gateway, clients, events, drop_every):
+    first_event, totals, stats = [], [], {"complete": 0, "dropped": 0, "broken": 0, "errors": 0}
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=gateway, limits=limits, timeout=60) as client:
+        async def one(i):
+            headers = {"Authorization": f"Bearer {_token(f'user-{i}')}"}
+            start = time.perf_counter()
+            received = b""
+            try:
+                async with client.stream("POST", "/message", headers=headers,
+                                         json={"session_id": f"s{i}", "message": "hi"}) as response:
+                    async for chunk in response.aiter_bytes():
+                        if not received:
+                            first_event.append(time.perf_counter() - start)
+                        received += chunk
+                        if drop_every and i % drop_every == 0:
+                            stats["dropped"] += 1
+                            return
+            except Exception:
+                stats["errors"] += 1
+                return
+            totals.append(time.perf_counter() - start)
+            parsed = [e for e in received.split(b"\n\n") if e and not e.startswith(b":")]
+            intact = len(parsed) == events and all(e.count(b"data:") == 2 for e in parsed)
+            stats["complete" if intact else "broken"] += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(clients)))
+        elapsed = time.perf_counter() - start
+    return first_event, totals, stats, elapsed
+
+async def _cap_check(gateway, limit):
+    ''' One user opening one stream more than allowed: the extra one is refused with 429 '''
+    headers = {"Authorization": f"Bearer {_token('capped-user')}"}
+    async with httpx.AsyncClient(base_url=gateway, headers=headers, timeout=60) as client:
+        async def status(i):
+            async with client.stream("POST", "/message", json={"session_id": f"c{i}", "message": "hi"}) as response:
+                await response.aread()
+                return response.status_code
+        return await asyncio.gather(*(status(i) for i in range(limit + 1)))
+
+def run_streams(api_server, gateway, args):
+    import sse_relay
+    first_event, totals, stats, elapsed = asyncio.run(
+        _stream_clients(gateway, args.clients, args.events, args.drop_every))
+    time.sleep(1)
+    print(f"{args.clients} concurrent streams of {args.events} events, 1 in {args.drop_every or 'no'} clients hang up")
+    print(f"  first event p50 {_percentile(first_event, 0.5):7.1f}ms  p99 {_percentile(first_event, 0.99):7.1f}ms")
+    print(f"  full stream p50 {_percentile(totals, 0.5):7.1f}ms  p99 {_percentile(totals, 0.99):7.1f}ms  "
+          f"{stats['complete'] * args.events / elapsed:8.1f} events/s")
+    print(f"  complete {stats['complete']}  broken {stats['broken']}  hung up {stats['dropped']}  errors {stats['errors']}")
+    print(f"  upstream streams still open {STUB_STREAMS['open']}  cancelled {STUB_STREAMS['cancelled']}")
+    codes = asyncio.run(_cap_check(gateway, sse_relay.STREAMS_PER_USER))
+    print(f"  {len(codes)} streams for one user (cap {sse_relay.STREAMS_PER_USER}): status {sorted(codes)}")
+    print(f"  relay metrics {sse_relay.STREAM_METRICS}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", nargs="?", choices=("requests", "streams"), default="requests")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--stream-every", type=int, default=10, help="every Nth request is a /message stream, 0 for none")
+    parser.add_argument("--clients", type=int, default=500, help="concurrent streams in streams mode")
+    parser.add_argument("--events", type=int, default=20, help="events per stream in streams mode")
+    parser.add_argument("--drop-every", type=int, default=5, help="every Nth stream client hangs up after its first chunk")
+    parser.add_argument("--latency", type=float, default=0.005, help="stub agent latency per call/event, seconds")
+    args = parser.parse_args()
+
+    agent_port, gateway_port = _free_port(), _free_port()
+    os.environ["website"] = f"http://127.0.0.1:{agent_port}"
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import api_server
+
+    logging_level = api_server.logging.getLogger().level
+    api_server.logging.getLogger().setLevel(api_server.logging.WARNING)
+    serve(stub_agent(args.latency, args.events), agent_port)
+    serve(api_server.app, gateway_port)
+    token = _token()
+    gateway = f"http://127.0.0.1:{gateway_port}"
+
+    if args.mode == "streams":
+        run_streams(api_server, gateway, args)
+        return
+
+    shared = api_server.app.state.agent
+    modes = [
+        ("per-request client", PerRequestClient(timeout=api_server.SESSION_TIMEOUT)),
+        ("shared client", shared),
+    ]
+    print(f"{args.requests} requests, concurrency {args.concurrency}, "
+          f"1 in {args.stream_every or 'no'} streamed, http2 available={api_server.http2_available()}")
+    for name, client in modes:
+        api_server.app.state.agent = client
+        latencies, errors, elapsed = asyncio.run(
+            _drive(gateway, token, args.requests, args.concurrency, args.stream_every))
+        print(f"{name:>20}: p50 {_percentile(latencies, 0.5):7.1f}ms  p99 {_percentile(latencies, 0.99):7.1f}ms  "
+              f"{len(latencies) / elapsed:8.1f} req/s  errors {errors}")
+    api_server.app.state.agent = shared
+    api_server.logging.getLogger().setLevel(logging_level)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+'''
+Server-sent events relay between the gateway's clients and an upstream SSE endpoint.
+
+Upstream bytes are forwarded as they arrive, cut only at event boundaries (a blank line), so
+multi-line events, comments and `event:`/`id:` fields reach the client intact. A small queue
+between the upstream reader and the client gives backpressure: a slow client stops the reads,
+and the upstream's TCP window fills instead of gateway memory.
+'''
+
+import os
+import json
+import asyncio
+import logging
+import threading
+import httpx
+from fastapi import HTTPException, Request, status
+
+STREAM_HEARTBEAT = float(os.getenv("STREAM_HEARTBEAT", "15"))  # comment sent to the client when upstream is quiet
+# Upstream silence before the stream is closed. The agent sends nothing while a tool runs, so this
+# stays above the longest tool timeout of the agent (SANDBOX_BATCH_TOOL_TIMEOUT, 1800s) plus a margin
+STREAM_IDLE_TIMEOUT = float(os.getenv("STREAM_IDLE_TIMEOUT", "1900"))
+STREAMS_PER_USER = int(os.getenv("STREAMS_PER_USER", "4"))
+STREAM_BUFFER = int(os.getenv("STREAM_BUFFER", "16"))  # chunks held between the upstream and a slow client
+STREAM_MAX_EVENT = int(os.getenv("STREAM_MAX_EVENT", str(1024 * 1024)))  # flushed even without a boundary
+
+HEARTBEAT = b": keep-alive\n\n"
+STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+_BOUNDARIES = (b"\n\n", b"\r\n\r\n", b"\r\r")
+_END = object()
+
+STREAM_METRICS = {"active": 0, "opened": 0, "rejected": 0, "disconnected": 0, "idle_timeouts": 0, "bytes": 0}
+
+class StreamSlots:
+    ''' Caps the concurrent streams of each user '''
+    def __init__(self, limit=STREAMS_PER_USER):
+        self.limit = limit
+        self._open = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, user_id):
+        '''
+        Returns:
+            release callable, safe to call more than once
+        Raises:
+            HTTPException 429 when the user already has `limit` streams open
+        '''
+        with self._lock:
+            if self.limit and self._open.get(user_id, 0) >= self.limit:
+                STREAM_METRICS["rejected"] += 1
+                raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                                    detail=f"Too many open streams, at most {self.limit} per user")
+            self._open[user_id] = self._open.get(user_id, 0) + 1
+            STREAM_METRICS["active"] += 1
+            STREAM_METRICS["opened"] += 1
+        released = False
+
+        def release():
+            nonlocal released
+            with self._lock:
+                if released:
+                    return
+                released = True
+                STREAM_METRICS["active"] -= 1
+                if self._open[user_id] <= 1:
+                    del self._open[user_id]
+                else:
+                    self._open[user_id] -= 1
+        return release
+
+    def open_streams(self, user_id):
+        with self._lock:
+            return self._open.get(user_id, 0)
+
+def split_events(buffer: bytearray):
+    '''
+    Takes the complete events off the front of the buffer
+    Returns:
+        bytes up to and including the last event boundary (b"" if none), the rest stays in buffer
+    '''
+    end = 0
+    for boundary in _BOUNDARIES:
+        found = buffer.rfind(boundary)
+        if found >= 0:
+            end = max(end, found + len(boundary))
+    if not end and len(buffer) > STREAM_MAX_EVENT:
+        end = len(buffer)
+    events = bytes(buffer[:end])
+    del buffer[:end]
+    return events
+
+def error_event(message):
+    return b"data: " + json.dumps({"error": message}).encode() + b"\n\n"
+
+async def relay(request: Request, client: httpx.AsyncClient, method, url, release, name="Agent", **kwargs):
+    '''
+    Streams an upstream SSE response to the client
+    Args:
+        request: the client's request, polled for disconnects while upstream is quiet
+        client: shared httpx client; kwargs go to client.stream (json, timeout, ...)
+        release: frees the user's stream slot when the relay ends
+        name: upstream name used in the error events
+    Yields:
+        raw SSE bytes, heartbeat comments, and a final {"error": ...} event when upstream fails
+    '''
+    queue = asyncio.Queue(maxsize=STREAM_BUFFER)
+
+    async def pump():
+        try:
+            async with client.stream(method, url, **kwargs) as response:
+                if response.is_error:
+                    await response.aread()
+                    response.raise_for_status()
+                buffer = bytearray()
+                async for chunk in response.aiter_bytes():
+                    buffer += chunk
+                    events = split_events(buffer)
+                    if events:
+                        await queue.put(events)
+                if buffer.strip():
+                    await queue.put(bytes(buffer) + b"\n\n")
+            await queue.put(_END)
+        except Exception as e:
+            await queue.put(e)
+
+    task = asyncio.create_task(pump())
+    try:
+        while True:
+            try:
+                item = await asyncio.wait_for(queue.get(), STREAM_HEARTBEAT)
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    STREAM_METRICS["disconnected"] += 1
+                    return
+                yield HEARTBEAT
+                continue
+            if item is _END:
+                return
+            if isinstance(item, httpx.ReadTimeout):
+                STREAM_METRICS["idle_timeouts"] += 1
+                yield error_event(f"{name} sent nothing for {STREAM_IDLE_TIMEOUT:.0f}s")
+                return
+            if isinstance(item, httpx.HTTPStatusError):
+                yield error_event(f"{name} error: {item.response.text}")
+                return
+            if isinstance(item, httpx.RequestError):
+                yield error_event(f"{name} unreachable: {str(item)}")
+                return
+            if isinstance(item, Exception):
+                logging.error(f"{name} stream failed: {item}")
+                yield error_event(f"Internal error: {str(item)}")
+                return
+            STREAM_METRICS["bytes"] += len(item)
+            yield item
+    finally:
+        # Runs on completion and when the client goes away (the response task is cancelled):
+        # cancelling the reader leaves client.stream(), which closes the upstream request
+        task.cancel()
+        release()
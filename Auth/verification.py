@@ -1,6 +1,10 @@
 from jose import jwt, JWTError
 import os
+import time
+import hashlib
 import logging
+import threading
+from collections import OrderedDict
 from dotenv import load_dotenv
 from fastapi import HTTPException, status
 
@@ -9,6 +13,65 @@ from fastapi import HTTPException, status
 logging.basicConfig(level=logging.INFO)
 
 SUPABASE_JWT_SECRET = os.getenv("SUPABASE_JWT_SECRET")
+# "pyjwt" decodes with PyJWT when installed (faster than python-jose), otherwise python-jose is used
+JWT_BACKEND = os.getenv("JWT_BACKEND", "jose")
+# Verified tokens kept in memory; a chat session presents the same token on every request
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "4096"))
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", "300"))  # upper bound, tokens leave the cache at exp
+
+_verified = OrderedDict()  # sha256(token) -> (claims, cached until)
+_verified_lock = threading.Lock()
+TOKEN_CACHE_METRICS = {"hits": 0, "misses": 0, "expired": 0}
+
+def _jose_decode(token):
+    try:
+        return jwt.decode(token, SUPABASE_JWT_SECRET, algorithms = ["HS256"], options = {"verify_aud": False})
+    except JWTError as e:
+        raise HTTPException(status_code = status.HTTP_401_UNAUTHORIZED, detail = f"Invalid token: {e}")
+
+def _pyjwt_decoder():
+    try:
+        import jwt as pyjwt
+    except ImportError:
+        logging.warning("PyJWT is not installed, verifying tokens with python-jose")
+        return None
+
+    def decode(token):
+        try:
+            return pyjwt.decode(token, SUPABASE_JWT_SECRET, algorithms = ["HS256"], options = {"verify_aud": False})
+        except pyjwt.PyJWTError as e:
+            raise HTTPException(status_code = status.HTTP_401_UNAUTHORIZED, detail = f"Invalid token: {e}")
+    return decode
+
+_decode = (JWT_BACKEND == "pyjwt" and _pyjwt_decoder()) or _jose_decode
+
+def _cached(key, now):
+    with _verified_lock:
+        entry = _verified.get(key)
+        if entry is None:
+            TOKEN_CACHE_METRICS["misses"] += 1
+            return None
+        claims, until = entry
+        if until <= now:
+            # Expired since it was cached: drop it and let the decoder reject it
+            del _verified[key]
+            TOKEN_CACHE_METRICS["expired"] += 1
+            return None
+        _verified.move_to_end(key)
+        TOKEN_CACHE_METRICS["hits"] += 1
+        return claims
+
+def _remember(key, claims, now):
+    until = now + TOKEN_CACHE_TTL
+    if isinstance(claims.get("exp"), (int, float)):
+        until = min(until, claims["exp"])
+    if until <= now:
+        return
+    with _verified_lock:
+        _verified[key] = (claims, until)
+        _verified.move_to_end(key)
+        while len(_verified) > TOKEN_CACHE_SIZE:
+            _verified.popitem(last = False)
 
 def verify_supabase_jwt(token:str):
     ''' Function to verify jwt token
@@ -16,21 +79,57 @@ def verify_supabase_jwt(token:str):
         token: jwt token
     Return:
         decoded token if valid else None
+    Raises:
+        HTTPException 401 for tampered, expired or malformed tokens
     '''
+    # Keyed by the hash of the full token: any change to header, claims or signature is a miss and is verified
+    key = hashlib.sha256(token.encode()).digest()
+    now = time.time()
+    claims = _cached(key, now)
+    if claims is not None:
+        return dict(claims)
     try:
-      decoded = jwt.decode(
-          token,
-          SUPABASE_JWT_SECRET,
-          algorithms = ["HS256"],
-          options = {"verify_aud": False}
-          )
-      logging.info(f" Decode String {decoded}")
-      return decoded
-    except JWTError as e:
-      raise HTTPException(
-            status_code = status.HTTP_401_UNAUTHORIZED,
-            detail = f"Invalid token: {e}"
-            )
+      decoded = _decode(token)
+      _remember(key, decoded, now)
+      logging.debug(f" Verified token for {decoded.get('sub')}")
+      return dict(decoded)
+    except HTTPException:
+      raise
     except Exception as e:
       logging.error(f"An error occurred while decoding token {e}")
       return None
+
+def clear_token_cache():
+    with _verified_lock:
+        _verified.clear()
+
+def benchmark(tokens=50, rounds=20000):
+    ''' Verifications per second: uncached decode against the cache, for each available backend '''
+    global _decode
+    if not SUPABASE_JWT_SECRET:
+        raise SystemExit("Set SUPABASE_JWT_SECRET to run the benchmark")
+    exp = int(time.time()) + 3600
+    issued = [jwt.encode({"sub": f"user-{i}", "exp": exp}, SUPABASE_JWT_SECRET, algorithm = "HS256") for i in range(tokens)]
+    backends = [("jose", _jose_decode)]
+    if _pyjwt_decoder():
+        backends.append(("pyjwt", _pyjwt_decoder()))
+    original = _decode
+    try:
+        for name, decoder in backends:
+            _decode = decoder
+            start = time.perf_counter()
+            for i in range(rounds // 10):
+                decoder(issued[i % tokens])
+            uncached = rounds // 10 / (time.perf_counter() - start)
+            clear_token_cache()
+            start = time.perf_counter()
+            for i in range(rounds):
+                verify_supabase_jwt(issued[i % tokens])
+            cached = rounds / (time.perf_counter() - start)
+            print(f"{name:>6}: uncached {uncached:10.0f}/s  cached {cached:10.0f}/s  x{cached / uncached:6.1f}")
+    finally:
+        _decode = original
+        clear_token_cache()
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,106 @@
+
+import os
+import sys
+import pstats
+import logging
+
+logger = logging.getLogger("runner")
+
+# Limits applied to every script process, 0 disables a limit
+SCRIPT_CPU_SECONDS = int(os.environ.get("SCRIPT_CPU_SECONDS", os.environ.get("SCRIPT_TIMEOUT", "120")))
+SCRIPT_MEMORY_MB = int(os.environ.get("SCRIPT_MEMORY_MB", "2048"))
+SCRIPT_FILE_MB = int(os.environ.get("SCRIPT_FILE_MB", "512"))  # largest file a script may write
+SCRIPT_MAX_FILES = int(os.environ.get("SCRIPT_MAX_FILES", "256"))
+# "1" runs scripts under cProfile and attaches the hottest functions to the result
+SCRIPT_PROFILE = os.environ.get("SCRIPT_PROFILE", "0") == "1"
+PROFILE_TOP = int(os.environ.get("PROFILE_TOP", "15"))
+
+def _limits(cpu_seconds, memory_mb, file_mb, max_files):
+    import resource
+    limits = []
+    if cpu_seconds:
+        limits.append((resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 5)))
+    if memory_mb:
+        # RLIMIT_DATA rather than RLIMIT_AS: numpy/OpenBLAS thread buffers, pyarrow's allocator and
+        # numba (vectorbt) reserve far more address space than they use, and the shared dataset's
+        # read-only file mapping would count against RLIMIT_AS in every script
+        limits.append((resource.RLIMIT_DATA, (memory_mb * 1024 * 1024,) * 2))
+    if file_mb:
+        limits.append((resource.RLIMIT_FSIZE, (file_mb * 1024 * 1024,) * 2))
+    if max_files:
+        limits.append((resource.RLIMIT_NOFILE, (max_files, max_files)))
+    return limits
+
+def apply_limits(pid=0, cpu_seconds=SCRIPT_CPU_SECONDS, memory_mb=SCRIPT_MEMORY_MB,
+                 file_mb=SCRIPT_FILE_MB, max_files=SCRIPT_MAX_FILES):
+    '''
+    Sets the rlimits of a script process
+    Args:
+        pid: process to limit, 0 for the current one (a warm worker limiting itself)
+    '''
+    import resource
+    for limit, values in _limits(cpu_seconds, memory_mb, file_mb, max_files):
+        resource.prlimit(pid, limit, values)
+
+def limits_preexec(cpu_seconds=SCRIPT_CPU_SECONDS, memory_mb=SCRIPT_MEMORY_MB,
+                   file_mb=SCRIPT_FILE_MB, max_files=SCRIPT_MAX_FILES):
+    '''
+    Popen preexec_fn that sets the rlimits in the child between fork and exec, so the script never
+    runs without them. The limits are computed here in the parent; the child only calls setrlimit,
+    which takes no locks another spawning thread could be holding.
+    '''
+    import resource
+    limits = _limits(cpu_seconds, memory_mb, file_mb, max_files)
+    setrlimit = resource.setrlimit
+
+    def preexec():
+        for limit, values in limits:
+            setrlimit(limit, values)
+    return preexec
+
+def usage_from_rusage(rusage, wall_seconds):
+    '''
+    Resource usage of a finished script
+    Args:
+        rusage: resource.struct_rusage of the script process
+        wall_seconds: elapsed time from start to exit
+    Returns:
+        dict attached to the result JSON as "usage"
+    '''
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak_rss = rusage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    return {
+        "wall_seconds": round(wall_seconds, 3),
+        "cpu_user_seconds": round(rusage.ru_utime, 3),
+        "cpu_system_seconds": round(rusage.ru_stime, 3),
+        "cpu_seconds": round(rusage.ru_utime + rusage.ru_stime, 3),
+        "peak_rss_mb": round(peak_rss / (1024 * 1024), 1),
+        # block I/O in 512-byte units; reads served from the page cache do not count
+        "read_bytes": rusage.ru_inblock * 512,
+        "write_bytes": rusage.ru_oublock * 512,
+        "limits": {"cpu_seconds": SCRIPT_CPU_SECONDS, "memory_mb": SCRIPT_MEMORY_MB, "file_mb": SCRIPT_FILE_MB},
+    }
+
+def profile_summary(path, limit=PROFILE_TOP):
+    '''
+    The functions the script spent most of its own time in, from a cProfile dump
+    Returns:
+        list of {"function", "calls", "own_seconds", "cumulative_seconds"}, None if there is no dump
+    '''
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return None
+    try:
+        stats = pstats.Stats(path).stats
+    except Exception as e:
+        logger.error(f"Could not read profile {path}: {e}")
+        return None
+    rows = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:limit]
+    return [
+        {
+            "function": f"{os.path.basename(filename)}:{line}({name})",
+            "calls": calls,
+            "own_seconds": round(own, 4),
+            "cumulative_seconds": round(cumulative, 4),
+        }
+        for (filename, line, name), (_, calls, own, cumulative, _) in rows
+    ]
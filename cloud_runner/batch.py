@@ -0,0 +1,132 @@
+
+import os
+import re
+import json
+import shutil
+import logging
+import itertools
+import tempfile
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from main import download_gs, upload_gs, notify_done, build_result, run_subprocess
+from shared_data import SHARED_DIR, shared_dataset, stage_helper
+from progress import ProgressReporter
+
+logger = logging.getLogger("runner")
+
+BATCH_WORKERS = int(os.environ.get("BATCH_WORKERS", str(os.cpu_count() or 2)))
+MAX_VARIANTS = int(os.environ.get("BATCH_MAX_VARIANTS", "64"))
+
+def expand_params(params):
+    '''
+    Parameter sets of a manifest
+    Args:
+        params: list of dicts, or a dict of lists expanded to their cartesian product
+    Returns:
+        list of parameter dicts (at least one, possibly empty)
+    '''
+    if not params:
+        return [{}]
+    if isinstance(params, dict):
+        keys = list(params)
+        values = [v if isinstance(v, list) else [v] for v in params.values()]
+        return [dict(zip(keys, combo)) for combo in itertools.product(*values)]
+    return list(params)
+
+def _normalize(name):
+    return re.sub(r"[^a-z0-9]", "", str(name).lower())
+
+def find_metric(metrics, name):
+    ''' Looks a metric up anywhere in the (possibly nested) metrics output, ignoring case and punctuation '''
+    target = _normalize(name)
+    stack = [metrics]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            for key, value in node.items():
+                if _normalize(key) == target and isinstance(value, (int, float)) and not isinstance(value, bool):
+                    return float(value)
+                stack.append(value)
+        elif isinstance(node, list):
+            stack.extend(node)
+    return None
+
+def run_batch(batch_gs, result_gs, execute=run_subprocess):
+    '''
+    Runs every (script, parameter set) variant of a batch manifest against one dataset and
+    uploads a ranked metrics table.
+
+    Manifest:
+        {"data": "gs://...parquet", "scripts": ["gs://...py", ...],
+         "params": [{...}, ...] or {"name": [values], ...},
+         "rank_by": "Sharpe Ratio", "ascending": false}
+    Each variant gets its parameter set as JSON in the STRATEGY_PARAMS environment variable.
+    '''
+    tmpdir = tempfile.mkdtemp()
+    shared_dir = tempfile.mkdtemp(dir=SHARED_DIR)
+    local_result = os.path.join(tmpdir, "result.json")
+    progress = ProgressReporter(result_gs)
+    try:
+        progress.phase("downloading")
+        manifest_path = os.path.join(tmpdir, "manifest.json")
+        download_gs(batch_gs, manifest_path)
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+
+        # One copy of the data for every variant
+        local_data = os.path.join(shared_dir, "data.parquet")
+        download_gs(manifest["data"], local_data)
+
+        scripts = manifest.get("scripts") or [manifest["script"]]
+        local_scripts = {}
+        for i, script_gs in enumerate(scripts):
+            local_scripts[script_gs] = os.path.join(tmpdir, f"script_{i}.py")
+            download_gs(script_gs, local_scripts[script_gs])
+        stage_helper(tmpdir)
+
+        variants = [(s, p) for s in scripts for p in expand_params(manifest.get("params"))]
+        if len(variants) > MAX_VARIANTS:
+            raise ValueError(f"Batch has {len(variants)} variants, the limit is {MAX_VARIANTS}")
+        rank_by = manifest.get("rank_by", "Sharpe Ratio")
+        ascending = bool(manifest.get("ascending", False))
+
+        def run_variant(indexed):
+            index, (script_gs, params) = indexed
+            env = {**shared_env, "STRATEGY_PARAMS": json.dumps(params)}
+            scoped = progress.scoped(variant=index)
+            try:
+                result = build_result(*execute(local_scripts[script_gs], local_data, env=env, progress=scoped))
+            except subprocess.TimeoutExpired:
+                result = {"status": "error", "error": "timeout"}
+            score = find_metric(result.get("metrics"), rank_by) if result["status"] == "ok" else None
+            scoped.emit("variant", status=result["status"], score=score, total=len(variants))
+            return {"script": script_gs, "params": params, "score": score, **result}
+
+        logger.info(f"Running {len(variants)} variants with {BATCH_WORKERS} workers")
+        progress.phase("running", variants=len(variants))
+        # Decoded once; every variant maps the same read-only Arrow buffer
+        with shared_dataset(manifest["data"], local_data) as shared_env, \
+                ThreadPoolExecutor(max_workers=BATCH_WORKERS) as pool:
+            rows = list(pool.map(run_variant, enumerate(variants)))
+
+        scored = sorted((r for r in rows if r["score"] is not None), key=lambda r: r["score"], reverse=not ascending)
+        rows = scored + [r for r in rows if r["score"] is None]
+        for rank, row in enumerate(rows, 1):
+            row["rank"] = rank
+        result = {"status": "ok", "rank_by": rank_by, "variants": len(rows), "results": rows}
+    except Exception as e:
+        logger.error(f"Batch {batch_gs} failed: {e}", exc_info=True)
+        result = {"status": "error", "error": str(e)}
+    finally:
+        shutil.rmtree(shared_dir, ignore_errors=True)
+
+    try:
+        with open(local_result, "w") as f:
+            json.dump(result, f, default=str)
+        progress.phase("uploading")
+        upload_gs(local_result, result_gs)
+    finally:
+        progress.close(result["status"])
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    notify_done(result_gs)
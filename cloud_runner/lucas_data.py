@@ -0,0 +1,82 @@
+
+'''
+Dataset access for strategy scripts run by the sandbox.
+
+The runner decodes the job's parquet file once into an uncompressed Arrow file on tmpfs and
+points LUCAS_SHARED_DATA at it. Scripts memory-map that file, so every concurrent run reads
+the same pages instead of parsing its own copy. Outside the sandbox (or if the runner could not
+share the data) everything falls back to the parquet file given on the command line.
+
+    from lucas_data import load_data, progress
+    data = load_data(sys.argv[1])
+    progress("signals", done=0, total=len(data))
+'''
+
+import os
+import sys
+import json
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+SHARED_ENV = "LUCAS_SHARED_DATA"
+PROGRESS_MARKER = "LUCAS_PROGRESS "
+
+def shared_path():
+    ''' Path of the runner's shared Arrow file, None when there is none '''
+    path = os.environ.get(SHARED_ENV)
+    return path if path and os.path.exists(path) else None
+
+def load_table(data_path=None):
+    '''
+    The dataset as an Arrow table
+    Args:
+        data_path: parquet file, defaults to sys.argv[1]; only read when no shared copy exists
+    Returns:
+        pyarrow.Table, backed by the shared memory map when available
+    '''
+    path = shared_path()
+    if path is not None:
+        return pa.ipc.open_file(pa.memory_map(path, "r")).read_all()
+    return pq.read_table(data_path or sys.argv[1], memory_map=True)
+
+def load_data(data_path=None, copy=True):
+    '''
+    The dataset as a pandas DataFrame
+    Args:
+        data_path: parquet file, defaults to sys.argv[1]
+        copy: True returns a private writable copy; False keeps numeric columns as read-only views
+              of the shared buffer (no copy per run), writing into them in place raises
+    Returns:
+        pandas DataFrame
+    '''
+    table = load_table(data_path)
+    if copy:
+        return table.to_pandas()
+    return table.to_pandas(split_blocks=True)
+
+def column(name, data_path=None):
+    '''
+    One column as a numpy array, zero-copy for numeric columns without nulls (read-only)
+    '''
+    values = load_table(data_path).column(name)
+    if values.num_chunks == 1:
+        return values.chunk(0).to_numpy(zero_copy_only=False)
+    return values.to_numpy()
+
+def params(default=None):
+    ''' Parameter set of a batch variant (STRATEGY_PARAMS), or default outside a sweep '''
+    raw = os.environ.get("STRATEGY_PARAMS")
+    return json.loads(raw) if raw else dict(default or {})
+
+def progress(phase=None, done=None, total=None, **metrics):
+    '''
+    Reports progress to the runner, which streams it to the user while the script runs
+    Args:
+        phase: current step, e.g. "indicators", "backtest"
+        done, total: bars (or any unit) processed so far and overall
+        metrics: partial results, e.g. equity=..., trades=...
+    '''
+    event = {k: v for k, v in (("phase", phase), ("done", done), ("total", total)) if v is not None}
+    if metrics:
+        event["metrics"] = metrics
+    print(PROGRESS_MARKER + json.dumps(event, default=str), file=sys.stderr, flush=True)
@@ -0,0 +1,261 @@
+
+'''
+Vectorized indicators for strategy scripts run by the sandbox.
+
+Every function takes pandas Series (or numpy arrays) and returns results aligned with the input:
+Series in, Series out with the same index; arrays in, arrays out. Nothing loops over bars in Python.
+
+Signals that depend on later bars (swing points, order blocks) are reported on the bar where they
+become known, so they never look ahead in a backtest.
+
+    from lucas_indicators import rsi, atr, swing_points, fib_levels, order_blocks, in_session
+    swing_high, swing_low = swing_points(data['High'], data['Low'], left=3, right=3)
+'''
+
+import time
+import numpy as np
+import pandas as pd
+
+# Trading sessions in UTC (start, end); end before start wraps past midnight
+SESSIONS = {
+    "sydney": ("21:00", "06:00"),
+    "asia": ("00:00", "09:00"),
+    "london": ("07:00", "16:00"),
+    "new_york": ("12:00", "21:00"),
+}
+FIB_RATIOS = (0.236, 0.382, 0.5, 0.618, 0.786)
+
+def _values(x):
+    return x.to_numpy(dtype=float) if isinstance(x, pd.Series) else np.asarray(x, dtype=float)
+
+def _wrap(values, like, name=None):
+    if isinstance(like, pd.Series):
+        return pd.Series(values, index=like.index, name=name)
+    return values
+
+def _shift(values, periods, fill):
+    out = np.empty_like(values)
+    if periods >= len(values):
+        out[:] = fill
+        return out
+    out[:periods] = fill
+    out[periods:] = values[:len(values) - periods]
+    return out
+
+def _ffill(values):
+    ''' Forward fills NaNs of a float array '''
+    mask = np.isnan(values)
+    idx = np.where(~mask, np.arange(len(values)), 0)
+    np.maximum.accumulate(idx, out=idx)
+    out = values[idx]
+    out[mask & (np.cumsum(~mask) == 0)] = np.nan
+    return out
+
+def _rolling(values, window, how):
+    return getattr(pd.Series(values).rolling(window, min_periods=window), how)().to_numpy(dtype=float, copy=True)
+
+# ------------ Moving Averages / Oscillators ---------------
+
+def sma(close, n=20):
+    ''' Simple moving average '''
+    return _wrap(_rolling(_values(close), n, "mean"), close, f"sma_{n}")
+
+def ema(close, n=20):
+    ''' Exponential moving average (span n, no bias adjustment, as most charting tools) '''
+    values = pd.Series(_values(close)).ewm(span=n, adjust=False).mean().to_numpy()
+    return _wrap(values, close, f"ema_{n}")
+
+def _wilder(values, n):
+    return pd.Series(values).ewm(alpha=1.0 / n, adjust=False).mean().to_numpy(dtype=float, copy=True)
+
+def rsi(close, n=14):
+    ''' Relative strength index with Wilder smoothing, 0-100 '''
+    values = _values(close)
+    diff = np.diff(values, prepend=np.nan)
+    gain = _wilder(np.where(diff > 0, diff, 0.0), n)
+    loss = _wilder(np.where(diff < 0, -diff, 0.0), n)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        out = np.where(loss == 0, 100.0, 100.0 - 100.0 / (1.0 + gain / loss))
+    out[:n] = np.nan
+    return _wrap(out, close, f"rsi_{n}")
+
+def true_range(high, low, close):
+    ''' Greatest of high-low, |high-previous close| and |low-previous close| '''
+    h, l, c = _values(high), _values(low), _values(close)
+    prev = _shift(c, 1, np.nan)
+    tr = np.fmax(h - l, np.fmax(np.abs(h - prev), np.abs(l - prev)))
+    return _wrap(tr, close, "true_range")
+
+def atr(high, low, close, n=14):
+    ''' Average true range with Wilder smoothing '''
+    out = _wilder(_values(true_range(high, low, close)), n)
+    out[:n - 1] = np.nan
+    return _wrap(out, close, f"atr_{n}")
+
+def macd(close, fast=12, slow=26, signal=9):
+    '''
+    Returns:
+        (macd line, signal line, histogram)
+    '''
+    line = _values(ema(close, fast)) - _values(ema(close, slow))
+    signal_line = pd.Series(line).ewm(span=signal, adjust=False).mean().to_numpy()
+    return (_wrap(line, close, "macd"), _wrap(signal_line, close, "macd_signal"),
+            _wrap(line - signal_line, close, "macd_hist"))
+
+# ------------ Market Structure ---------------
+
+def swing_points(high, low, left=2, right=2):
+    '''
+    Swing highs / lows: a bar whose high (low) is the extreme of the `left` bars before and `right` bars after it.
+    A swing is only known `right` bars later, so it is reported on that bar.
+    Returns:
+        (swing_high, swing_low) boolean, True on the bar the swing is confirmed
+    '''
+    h, l = _values(high), _values(low)
+    window = left + right + 1
+    # Extreme over [i - left - right, i]: centred on the candidate bar i - right
+    hmax = _rolling(h, window, "max")
+    lmin = _rolling(l, window, "min")
+    candidate_h = _shift(h, right, np.nan)
+    candidate_l = _shift(l, right, np.nan)
+    return (_wrap(candidate_h == hmax, high, "swing_high"), _wrap(candidate_l == lmin, low, "swing_low"))
+
+def swing_levels(high, low, left=2, right=2):
+    '''
+    Price of the latest confirmed swing high and swing low on every bar
+    Returns:
+        (last_swing_high, last_swing_low), NaN before the first swing
+    '''
+    h, l = _values(high), _values(low)
+    swing_high, swing_low = swing_points(h, l, left, right)
+    last_high = _ffill(np.where(swing_high, _shift(h, right, np.nan), np.nan))
+    last_low = _ffill(np.where(swing_low, _shift(l, right, np.nan), np.nan))
+    return _wrap(last_high, high, "last_swing_high"), _wrap(last_low, low, "last_swing_low")
+
+def fib_levels(high, low, lookback=100, ratios=FIB_RATIOS):
+    '''
+    Fibonacci retracement levels of the range of the last `lookback` bars, measured down from its high
+    Returns:
+        dict ratio -> level series, plus "high" and "low" of the range
+    '''
+    hi = _rolling(_values(high), lookback, "max")
+    lo = _rolling(_values(low), lookback, "min")
+    levels = {ratio: _wrap(hi - (hi - lo) * ratio, high, f"fib_{ratio}") for ratio in ratios}
+    levels["high"] = _wrap(hi, high, "fib_high")
+    levels["low"] = _wrap(lo, low, "fib_low")
+    return levels
+
+def fib_swing_levels(high, low, left=5, right=5, ratios=FIB_RATIOS):
+    ''' Fibonacci retracements between the latest confirmed swing high and swing low '''
+    last_high, last_low = (_values(v) for v in swing_levels(high, low, left, right))
+    return {ratio: _wrap(last_high - (last_high - last_low) * ratio, high, f"fib_{ratio}") for ratio in ratios}
+
+def order_blocks(open_, high, low, close, atr_n=14, displacement=1.5):
+    '''
+    Order blocks: the last opposite candle before a displacement candle, i.e. a candle whose body
+    exceeds `displacement` x ATR and closes beyond the order-block candle's range.
+    Bullish: bearish candle followed by a strong bullish close above its high (bearish mirrored).
+    Reported on the displacement bar; zones carry forward until the next block of the same side.
+    Returns:
+        dict with boolean "bullish" / "bearish" and the latest zones
+        "bull_top", "bull_bottom", "bear_top", "bear_bottom" (NaN before the first block)
+    '''
+    o, h, l, c = _values(open_), _values(high), _values(low), _values(close)
+    body = np.abs(c - o)
+    strong = body > displacement * _values(atr(h, l, c, atr_n))
+    prev_o, prev_h, prev_l, prev_c = (_shift(v, 1, np.nan) for v in (o, h, l, c))
+    bullish = strong & (c > o) & (prev_c < prev_o) & (c > prev_h)
+    bearish = strong & (c < o) & (prev_c > prev_o) & (c < prev_l)
+    like = close
+    return {
+        "bullish": _wrap(bullish, like, "bullish_ob"),
+        "bearish": _wrap(bearish, like, "bearish_ob"),
+        "bull_top": _wrap(_ffill(np.where(bullish, prev_h, np.nan)), like, "bull_ob_top"),
+        "bull_bottom": _wrap(_ffill(np.where(bullish, prev_l, np.nan)), like, "bull_ob_bottom"),
+        "bear_top": _wrap(_ffill(np.where(bearish, prev_h, np.nan)), like, "bear_ob_top"),
+        "bear_bottom": _wrap(_ffill(np.where(bearish, prev_l, np.nan)), like, "bear_ob_bottom"),
+    }
+
+# ------------ Time Filters ---------------
+
+def _minutes(hhmm):
+    hours, minutes = hhmm.split(":")
+    return int(hours) * 60 + int(minutes)
+
+def in_session(index, session="london", start=None, end=None, tz="UTC"):
+    '''
+    Boolean mask of the bars inside a trading session
+    Args:
+        index: DatetimeIndex of the data (naive timestamps are taken as UTC)
+        session: name in SESSIONS, ignored when start and end are given
+        start, end: "HH:MM" bounds in `tz`; end before start wraps past midnight
+    Returns:
+        numpy boolean array
+    '''
+    index = pd.DatetimeIndex(index)
+    if start is None or end is None:
+        start, end = SESSIONS[session]
+        tz = "UTC"
+    index = index.tz_localize("UTC") if index.tz is None else index
+    local = index.tz_convert(tz)
+    minute = np.asarray(local.hour * 60 + local.minute)
+    lo, hi = _minutes(start), _minutes(end)
+    if lo <= hi:
+        return (minute >= lo) & (minute < hi)
+    return (minute >= lo) | (minute < hi)
+
+# ------------ Benchmark ---------------
+
+def _naive_rsi(close, n=14):
+    gains, losses, out = 0.0, 0.0, [np.nan] * len(close)
+    for i in range(1, len(close)):
+        change = close[i] - close[i - 1]
+        gains = gains + (max(change, 0) - gains) / n
+        losses = losses + (max(-change, 0) - losses) / n
+        if i >= n:
+            out[i] = 100.0 if losses == 0 else 100 - 100 / (1 + gains / losses)
+    return out
+
+def _naive_swings(high, low, left=2, right=2):
+    highs, lows = [False] * len(high), [False] * len(high)
+    for i in range(left, len(high) - right):
+        window_h = high[i - left:i + right + 1]
+        window_l = low[i - left:i + right + 1]
+        highs[i + right] = high[i] == max(window_h)
+        lows[i + right] = low[i] == min(window_l)
+    return highs, lows
+
+def _naive_fib(high, low, lookback=100):
+    out = [np.nan] * len(high)
+    for i in range(lookback - 1, len(high)):
+        hi, lo = max(high[i - lookback + 1:i + 1]), min(low[i - lookback + 1:i + 1])
+        out[i] = hi - (hi - lo) * 0.618
+    return out
+
+def benchmark(bars=200_000, seed=7):
+    ''' Vectorized indicators against naive per-bar loops on random-walk prices '''
+    rng = np.random.default_rng(seed)
+    close = 100 + np.cumsum(rng.normal(0, 0.5, bars))
+    high = close + rng.uniform(0, 1, bars)
+    low = close - rng.uniform(0, 1, bars)
+    cases = [
+        ("rsi", lambda: rsi(close), lambda: _naive_rsi(close.tolist())),
+        ("swing_points", lambda: swing_points(high, low), lambda: _naive_swings(high.tolist(), low.tolist())),
+        ("fib_levels", lambda: fib_levels(high, low)[0.618], lambda: _naive_fib(high.tolist(), low.tolist())),
+    ]
+    print(f"{bars} bars")
+    for name, fast, slow in cases:
+        start = time.perf_counter()
+        fast_out = fast()
+        fast_s = time.perf_counter() - start
+        start = time.perf_counter()
+        slow_out = slow()
+        slow_s = time.perf_counter() - start
+        if isinstance(fast_out, tuple):
+            fast_out, slow_out = fast_out[0], slow_out[0]
+        match = np.allclose(np.asarray(fast_out, dtype=float), np.asarray(slow_out, dtype=float), equal_nan=True)
+        print(f"{name:>14}: vectorized {fast_s * 1000:8.1f}ms  naive {slow_s * 1000:9.1f}ms  "
+              f"x{slow_s / max(fast_s, 1e-9):6.1f}  match={match}")
+
+if __name__ == "__main__":
+    benchmark()
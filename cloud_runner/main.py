@@ -2,19 +2,33 @@ import os
 import json
 import subprocess
 import tempfile
+import shutil
+import threading
+import time
+import uuid
 from google.cloud import storage
 import logging
 import sys
 from dotenv import load_dotenv
+from shared_data import shared_dataset, stage_helper
+from progress import ProgressReporter, OutputCollector, pump
+from accounting import limits_preexec, usage_from_rusage, profile_summary, SCRIPT_PROFILE
 
 load_dotenv()
 
-storage_client = storage.Client()
-
 BUCKET = os.environ.get("BUCKET")
 CODE_GS = os.environ.get("CODE_GS")  # e.g. gs://bucket/uploads/scripts/abc.py
 DATA_GS = os.environ.get("DATA_GS")
 RESULT_GS = os.environ.get("RESULT_GS")  # e.g. results/<id>.json
+BATCH_GS = os.environ.get("BATCH_GS") or None  # batch manifest, replaces CODE_GS/DATA_GS when set
+SCRIPT_TIMEOUT = int(os.environ.get("SCRIPT_TIMEOUT", "120"))
+NOTIFY_REDIS_HOST = os.environ.get("NOTIFY_REDIS_HOST")  # MCP server's Redis, for completion notices
+# When set, gs://<bucket>/<path> is read from and written to <OBJECT_STORE_DIR>/<bucket>/<path>
+OBJECT_STORE_DIR = os.environ.get("OBJECT_STORE_DIR")
+# "oneshot" runs the job in the env and exits, "pool" serves queued jobs from pre-warmed workers
+RUNNER_MODE = os.environ.get("RUNNER_MODE", "oneshot")
+
+storage_client = None if OBJECT_STORE_DIR else storage.Client()
 
 logger = logging.getLogger("runner")
 logging.basicConfig(
@@ -25,55 +39,156 @@ logging.basicConfig(
 
 def download_gs(gs_uri, local_path):
     bucket_name, blob_path = gs_uri.replace("gs://", "").split("/", 1)
-    bucket = storage_client.bucket(bucket_name)
-    bucket.blob(blob_path).download_to_filename(local_path)
+    if OBJECT_STORE_DIR:
+        shutil.copyfile(os.path.join(OBJECT_STORE_DIR, bucket_name, blob_path), local_path)
+    else:
+        bucket = storage_client.bucket(bucket_name)
+        bucket.blob(blob_path).download_to_filename(local_path)
     logger.info(f"Downloaded {gs_uri} to {local_path}")
 
 def upload_gs(local_path, gs_uri):
-    bucket = storage_client.bucket(BUCKET)
-    bucket.blob(gs_uri).upload_from_filename(local_path)
+    if OBJECT_STORE_DIR:
+        target = os.path.join(OBJECT_STORE_DIR, BUCKET or "local", gs_uri)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(local_path, f"{target}.tmp")
+        os.replace(f"{target}.tmp", target)
+    else:
+        bucket = storage_client.bucket(BUCKET)
+        bucket.blob(gs_uri).upload_from_filename(local_path)
     logger.info(f"Uploaded {local_path} to {gs_uri}")
 
-def run():
-    tmpdir = tempfile.mkdtemp()
-    local_code = os.path.join(tmpdir, "script.py")
-    local_data = os.path.join(tmpdir, "data.parquet")
-    local_result = os.path.join(tmpdir, "result.json")
-
-    download_gs(CODE_GS, local_code)
-    download_gs(DATA_GS, local_data)
-
-    # Validate the script: require a safe entrypoint signature
-    # e.g., script must have a top-level function `def run_backtest(data_path) -> dict`
-    # For safety, we run in a subprocess and pass the data path as argv
-    try:
-        proc = subprocess.run(
-            ["python", "-I", local_code, local_data],
-            capture_output=True, text=True, timeout=120
-        )
-    except subprocess.TimeoutExpired:
-        result = {"status": "error", "error": "timeout"}
-        with open(local_result, "w") as f:
-            json.dump(result, f)
-        upload_gs(local_result, RESULT_GS)
+def notify_done(result_gs):
+    ''' Tells the waiting MCP server the result is ready, polling covers any failure here '''
+    if not NOTIFY_REDIS_HOST:
         return
+    try:
+        import redis
+        client = redis.Redis(host=NOTIFY_REDIS_HOST, port=int(os.environ.get("REDIS_PORT", "6379")), socket_timeout=5)
+        client.publish(f"sandbox:done:{result_gs}", "done")
+        client.close()
+    except Exception as e:
+        logger.error(f"Failed to publish completion of {result_gs}: {e}")
+
+def run_subprocess(local_code, local_data, env=None, progress=None):
+    '''
+    Runs the script in a fresh interpreter (one-shot mode) under the configured rlimits.
+    -E -s ignore PYTHON* variables and the user site, but unlike -I keep the script's directory
+    on sys.path, which is where the helper modules are staged
+    Args:
+        env: extra environment variables for the script (e.g. STRATEGY_PARAMS)
+        progress: reporter the script's output and progress lines are streamed to while it runs
+    Returns:
+        (returncode, stdout, stderr, usage), raises subprocess.TimeoutExpired on timeout
+    '''
+    profile_path = os.path.join(os.path.dirname(local_code), f"profile_{uuid.uuid4().hex}.prof") if SCRIPT_PROFILE else None
+    profiler = ["-m", "cProfile", "-o", profile_path] if profile_path else []
+    start = time.monotonic()
+    proc = subprocess.Popen(
+        ["python", "-E", "-s", "-u", *profiler, local_code, local_data],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, errors="replace",
+        env={**os.environ, **(env or {})},
+        preexec_fn=limits_preexec(),
+    )
+    stdout = OutputCollector("stdout", progress)
+    stderr = OutputCollector("stderr", progress)
+    readers = [
+        threading.Thread(target=pump, args=(proc.stdout, stdout), daemon=True),
+        threading.Thread(target=pump, args=(proc.stderr, stderr), daemon=True),
+    ]
+    # wait4 rather than wait, it returns the rusage of this script alone
+    exited = {}
+    def reap():
+        _, status, rusage = os.wait4(proc.pid, 0)
+        exited.update(status=status, rusage=rusage, wall=time.monotonic() - start)
+    waiter = threading.Thread(target=reap, daemon=True)
+    for thread in (*readers, waiter):
+        thread.start()
+    waiter.join(SCRIPT_TIMEOUT)
+    timed_out = waiter.is_alive()
+    if timed_out:
+        proc.kill()
+        waiter.join()
+    for reader in readers:
+        reader.join()
+    if timed_out:
+        raise subprocess.TimeoutExpired(local_code, SCRIPT_TIMEOUT)
+    proc.returncode = os.waitstatus_to_exitcode(exited["status"])
+    usage = usage_from_rusage(exited["rusage"], exited["wall"])
+    if profile_path:
+        usage["profile"] = profile_summary(profile_path)
+        if os.path.exists(profile_path):
+            os.remove(profile_path)
+    return proc.returncode, stdout.text(), stderr.text(), usage
 
-    if proc.returncode != 0:
-        result = {"status": "error", "stderr": proc.stderr}
+def build_result(returncode, stdout, stderr, usage=None):
+    ''' Turns the script's exit code, output and resource usage into the result JSON '''
+    if returncode != 0:
+        result = {"status": "error", "stderr": stderr}
     else:
         # Expect the script to print JSON metrics to stdout (or write result file)
         try:
-            metrics = json.loads(proc.stdout)
+            metrics = json.loads(stdout)
         except Exception:
             # fallback: capture stdout as 'raw_output'
-            metrics = {"status": "ok", "raw_output": proc.stdout}
+            metrics = {"status": "ok", "raw_output": stdout}
         result = {"status": "ok", "metrics": metrics}
+    if usage is not None:
+        result["usage"] = usage
+        logger.info(f"Script usage: {json.dumps({k: v for k, v in usage.items() if k != 'profile'})}")
+    return result
 
-    with open(local_result, "w") as f:
-        json.dump(result, f)
+def run_job(code_gs, data_gs, result_gs, execute=run_subprocess):
+    '''
+    Downloads a job's script and data, executes it and uploads the result
+    Args:
+        code_gs: gs:// uri of the strategy script
+        data_gs: gs:// uri of the parquet dataset
+        result_gs: bucket path for the result JSON
+        execute: callable (local_code, local_data, env=None, progress=None) -> (returncode, stdout, stderr, usage)
+    '''
+    tmpdir = tempfile.mkdtemp()
+    local_code = os.path.join(tmpdir, "script.py")
+    local_data = os.path.join(tmpdir, "data.parquet")
+    local_result = os.path.join(tmpdir, "result.json")
+    progress = ProgressReporter(result_gs)
+    status = "error"
 
-    upload_gs(local_result, RESULT_GS)
+    try:
+        progress.phase("downloading")
+        download_gs(code_gs, local_code)
+        download_gs(data_gs, local_data)
+        stage_helper(tmpdir)
+
+        # Validate the script: require a safe entrypoint signature
+        # e.g., script must have a top-level function `def run_backtest(data_path) -> dict`
+        # For safety, we run in a separate process and pass the data path as argv
+        progress.phase("running")
+        try:
+            with shared_dataset(data_gs, local_data) as env:
+                result = build_result(*execute(local_code, local_data, env=env, progress=progress))
+        except subprocess.TimeoutExpired:
+            result = {"status": "error", "error": "timeout"}
+
+        with open(local_result, "w") as f:
+            json.dump(result, f)
+
+        progress.phase("uploading")
+        upload_gs(local_result, result_gs)
+        status = result["status"]
+    finally:
+        progress.close(status)
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    notify_done(result_gs)
+
+def run():
+    if RUNNER_MODE == "pool":
+        from worker_pool import serve
+        serve()
+    elif BATCH_GS:
+        from batch import run_batch
+        run_batch(BATCH_GS, RESULT_GS)
+    else:
+        run_job(CODE_GS, DATA_GS, RESULT_GS)
 
 if __name__ == "__main__":
     run()
-
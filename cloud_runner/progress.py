@@ -0,0 +1,207 @@
+
+import os
+import json
+import time
+import queue
+import logging
+import threading
+import collections
+
+logger = logging.getLogger("runner")
+
+PROGRESS_PREFIX = "sandbox:progress:"
+PROGRESS_MARKER = "LUCAS_PROGRESS "  # stderr lines written by lucas_data.progress()
+PROGRESS_FIELDS = ("phase", "done", "total", "metrics")
+PROGRESS_MAXLEN = int(os.environ.get("PROGRESS_MAXLEN", "1000"))  # events kept per job stream
+PROGRESS_TTL = int(os.environ.get("PROGRESS_TTL", "3600"))
+PROGRESS_BUFFER = int(os.environ.get("PROGRESS_BUFFER", "256"))  # events queued before new ones are dropped
+LOG_CHUNK_BYTES = int(os.environ.get("LOG_CHUNK_BYTES", "4096"))
+LOG_CHUNK_SECONDS = float(os.environ.get("LOG_CHUNK_SECONDS", "1.0"))
+MAX_OUTPUT_BYTES = int(os.environ.get("MAX_OUTPUT_BYTES", str(16 * 1024 * 1024)))  # per stream, tail kept
+
+def stream_name(result_gs):
+    ''' Stream (or local file) holding the progress events of the run writing result_gs '''
+    return f"{PROGRESS_PREFIX}{result_gs}"
+
+# ------------ Channels ---------------
+
+class RedisChannel:
+    ''' Redis stream per job, capped at PROGRESS_MAXLEN events and expired after PROGRESS_TTL '''
+    def __init__(self, host):
+        import redis
+        self.client = redis.Redis(host=host, port=int(os.environ.get("REDIS_PORT", "6379")), socket_timeout=5)
+
+    def send(self, key, events):
+        pipe = self.client.pipeline(transaction=False)
+        for event in events:
+            pipe.xadd(key, {"event": json.dumps(event, default=str)}, maxlen=PROGRESS_MAXLEN, approximate=True)
+        pipe.expire(key, PROGRESS_TTL)
+        pipe.execute()
+
+class FileChannel:
+    ''' JSON lines under <root>/progress, the local stand-in for the Redis stream '''
+    def __init__(self, root):
+        self.root = os.path.join(root, "progress")
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.root, key.replace("/", "_").replace(":", "_") + ".jsonl")
+
+    def send(self, key, events):
+        with open(self.path(key), "a", encoding="utf-8") as f:
+            f.write("".join(json.dumps(event, default=str) + "\n" for event in events))
+
+class NullChannel:
+    ''' No listener configured, events are dropped '''
+    def send(self, key, events):
+        pass
+
+def get_channel():
+    ''' Redis when the MCP server's Redis is known, the local object store directory otherwise '''
+    host = os.environ.get("NOTIFY_REDIS_HOST")
+    if host:
+        return RedisChannel(host)
+    if os.environ.get("OBJECT_STORE_DIR"):
+        return FileChannel(os.environ["OBJECT_STORE_DIR"])
+    return NullChannel()
+
+# ------------ Reporters ---------------
+
+class _Emitter:
+    def phase(self, name, **fields):
+        self.emit("phase", phase=name, **fields)
+
+    def log(self, stream, text):
+        self.emit("log", stream=stream, text=text)
+
+    def scoped(self, **fields):
+        ''' Reporter adding fields to every event, e.g. the variant of a batch '''
+        return _Scoped(self, fields)
+
+class _Scoped(_Emitter):
+    def __init__(self, parent, fields):
+        self.parent = parent
+        self.fields = fields
+
+    def emit(self, kind, **fields):
+        self.parent.emit(kind, **self.fields, **fields)
+
+class ProgressReporter(_Emitter):
+    '''
+    Publishes the events of one job from a background thread.
+    The buffer is bounded: a slow or unreachable channel drops events (counted in `dropped`)
+    instead of stalling the script, only the final "end" event is always kept.
+    '''
+    def __init__(self, result_gs, channel=None):
+        self.key = stream_name(result_gs)
+        self.channel = channel or get_channel()
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=PROGRESS_BUFFER)
+        self._thread = threading.Thread(target=self._publish, daemon=True)
+        self._thread.start()
+
+    def emit(self, kind, **fields):
+        try:
+            self._queue.put_nowait({"type": kind, "ts": time.time(), **fields})
+        except queue.Full:
+            self.dropped += 1
+
+    def _publish(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < 64:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            events = [event for event in batch if event is not None]
+            if events:
+                try:
+                    self.channel.send(self.key, events)
+                except Exception as e:
+                    self.dropped += len(events)
+                    logger.error(f"Failed to publish progress for {self.key}: {e}")
+            if len(events) < len(batch):
+                return
+
+    def close(self, status):
+        ''' Publishes the end event and waits for the buffer to drain '''
+        self._queue.put({"type": "end", "ts": time.time(), "status": status, "dropped": self.dropped})
+        self._queue.put(None)
+        self._thread.join(timeout=10)
+
+# ------------ Script Output ---------------
+
+class OutputCollector:
+    '''
+    Captures one output stream of a script while it runs.
+    Complete lines are forwarded as log chunks (every LOG_CHUNK_BYTES or LOG_CHUNK_SECONDS) and progress lines
+    become progress events; the captured text keeps only the last MAX_OUTPUT_BYTES.
+    '''
+    def __init__(self, name, progress=None, limit=MAX_OUTPUT_BYTES):
+        self.name = name
+        self.progress = progress
+        self.limit = limit
+        self.truncated = 0
+        self._parts = collections.deque()
+        self._size = 0
+        self._pending = ""
+        self._chunk = []
+        self._chunk_size = 0
+        self._chunk_started = 0.0
+
+    def feed(self, text):
+        lines = (self._pending + text).splitlines(keepends=True)
+        self._pending = lines.pop() if lines and not lines[-1].endswith("\n") else ""
+        for line in lines:
+            self._line(line)
+
+    def _line(self, line):
+        if line.startswith(PROGRESS_MARKER):
+            try:
+                event = json.loads(line[len(PROGRESS_MARKER):])
+            except ValueError:
+                event = None
+            if isinstance(event, dict):
+                if self.progress is not None:
+                    self.progress.emit("progress", **{k: v for k, v in event.items() if k in PROGRESS_FIELDS})
+                return
+        self._keep(line)
+        if self.progress is not None:
+            if not self._chunk:
+                self._chunk_started = time.monotonic()
+            self._chunk.append(line)
+            self._chunk_size += len(line)
+            if self._chunk_size >= LOG_CHUNK_BYTES or time.monotonic() - self._chunk_started >= LOG_CHUNK_SECONDS:
+                self._flush_chunk()
+
+    def _keep(self, line):
+        self._parts.append(line)
+        self._size += len(line)
+        while self._size > self.limit and len(self._parts) > 1:
+            dropped = self._parts.popleft()
+            self._size -= len(dropped)
+            self.truncated += len(dropped)
+
+    def _flush_chunk(self):
+        if self._chunk:
+            self.progress.log(self.name, "".join(self._chunk))
+            self._chunk, self._chunk_size = [], 0
+
+    def text(self):
+        ''' Everything captured so far, flushing the last partial line and log chunk '''
+        if self._pending:
+            self._line(self._pending)
+            self._pending = ""
+        if self.progress is not None:
+            self._flush_chunk()
+        text = "".join(self._parts)
+        if self.truncated:
+            text = f"[... {self.truncated} characters truncated ...]\n{text}"
+        return text
+
+def pump(stream, collector):
+    ''' Feeds a pipe into a collector line by line until EOF '''
+    for line in iter(stream.readline, ""):
+        collector.feed(line)
+    stream.close()
@@ -0,0 +1,93 @@
+
+import os
+import uuid
+import shutil
+import logging
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger("runner")
+
+SHARED_ENV = "LUCAS_SHARED_DATA"
+# tmpfs, so the decoded dataset lives in memory shared by every process that maps it
+SHARED_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+# Modules strategy scripts may import, staged next to every script
+HELPERS = [
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), name)
+    for name in ("lucas_data.py", "lucas_indicators.py")
+]
+
+_published = {}  # dataset uri -> {"path", "refs", "lock"}
+_published_lock = threading.Lock()
+
+def to_arrow_file(parquet_path, arrow_path):
+    '''
+    Decodes a parquet file once into an uncompressed, single-chunk Arrow IPC file,
+    which readers memory-map without copying or parsing
+    '''
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(parquet_path).combine_chunks()
+    tmp = f"{arrow_path}.tmp"
+    with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    os.replace(tmp, arrow_path)
+    return os.path.getsize(arrow_path)
+
+def stage_helper(directory):
+    ''' Puts the helper modules next to the scripts, found through the script's directory on sys.path '''
+    for path in HELPERS:
+        shutil.copy(path, os.path.join(directory, os.path.basename(path)))
+
+def _acquire(key, local_parquet):
+    with _published_lock:
+        entry = _published.setdefault(key, {"path": None, "refs": 0, "lock": threading.Lock()})
+        entry["refs"] += 1
+    try:
+        # Concurrent jobs on the same dataset wait for the first decode instead of repeating it
+        with entry["lock"]:
+            if entry["path"] is None:
+                path = os.path.join(SHARED_DIR or os.path.dirname(local_parquet), f"lucas-{uuid.uuid4().hex}.arrow")
+                size = to_arrow_file(local_parquet, path)
+                entry["path"] = path
+                logger.info(f"Shared {key} as {path} ({size} bytes)")
+        return entry["path"]
+    except Exception:
+        _release(key)
+        raise
+
+def _release(key):
+    with _published_lock:
+        entry = _published[key]
+        entry["refs"] -= 1
+        if entry["refs"] > 0:
+            return
+        del _published[key]
+    if entry["path"]:
+        try:
+            os.remove(entry["path"])
+        except FileNotFoundError:
+            pass
+
+@contextmanager
+def shared_dataset(key, local_parquet):
+    '''
+    Publishes a dataset for the scripts of a job as a read-only shared Arrow file
+    Args:
+        key: identity of the dataset (its gs:// uri), jobs running on the same key share one copy
+        local_parquet: downloaded parquet file
+    Yields:
+        environment variables for the scripts, empty if the dataset could not be shared
+        (scripts then read the parquet file themselves)
+    '''
+    try:
+        path = _acquire(key, local_parquet)
+    except Exception as e:
+        logger.error(f"Could not share {key}, scripts will read the parquet file: {e}")
+        yield {}
+        return
+    try:
+        yield {SHARED_ENV: path}
+    finally:
+        _release(key)
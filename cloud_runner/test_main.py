@@ -0,0 +1,46 @@
+import os
+import textwrap
+
+os.environ.setdefault("OBJECT_STORE_DIR", os.path.dirname(os.path.abspath(__file__)))
+
+import pytest
+
+pytest.importorskip("google.cloud.storage")
+pytest.importorskip("dotenv")
+
+from main import run_subprocess
+from shared_data import stage_helper
+
+def test_staged_helpers_import_in_launched_script(tmp_path):
+    ''' The one-shot launcher must find the helpers staged next to the script '''
+    stage_helper(str(tmp_path))
+    script = tmp_path / "script.py"
+    script.write_text(textwrap.dedent('''
+        import importlib.util
+        for name in ("lucas_data", "lucas_indicators"):
+            spec = importlib.util.find_spec(name)
+            assert spec is not None, name
+            print(name, spec.origin)
+    '''))
+    returncode, stdout, stderr, usage = run_subprocess(str(script), str(tmp_path / "data.parquet"))
+    assert returncode == 0, stderr
+    assert str(tmp_path / "lucas_data.py") in stdout
+    assert str(tmp_path / "lucas_indicators.py") in stdout
+
+def test_indicators_run_in_launched_script(tmp_path):
+    ''' lucas_indicators imports and computes under the launcher's interpreter flags '''
+    import subprocess
+    probe = subprocess.run(["python", "-E", "-s", "-c", "import numpy, pandas"], capture_output=True)
+    if probe.returncode != 0:
+        pytest.skip("launcher interpreter has no numpy/pandas")
+    stage_helper(str(tmp_path))
+    script = tmp_path / "script.py"
+    script.write_text(textwrap.dedent('''
+        import pandas as pd
+        from lucas_indicators import rsi
+        values = rsi(pd.Series([float(i % 7) for i in range(50)]))
+        print(len(values))
+    '''))
+    returncode, stdout, stderr, usage = run_subprocess(str(script), str(tmp_path / "data.parquet"))
+    assert returncode == 0, stderr
+    assert stdout.strip() == "50"
@@ -0,0 +1,245 @@
+
+import os
+import sys
+import json
+import time
+import queue
+import runpy
+import types
+import shutil
+import logging
+import tempfile
+import threading
+import traceback
+import subprocess
+import multiprocessing
+
+from main import run_job, run_subprocess, SCRIPT_TIMEOUT, NOTIFY_REDIS_HOST
+from progress import OutputCollector
+from accounting import apply_limits, usage_from_rusage, profile_summary, SCRIPT_PROFILE
+
+logger = logging.getLogger("runner")
+
+POOL_SIZE = int(os.environ.get("RUNNER_POOL_SIZE", str(os.cpu_count() or 2)))
+# Imported once in the fork server, so every job starts with them already loaded
+PRELOAD_MODULES = os.environ.get(
+    "RUNNER_PRELOAD", "numpy,pandas,pyarrow,pyarrow.parquet,vectorbt,backtesting,lucas_data,lucas_indicators"
+).split(",")
+JOB_QUEUE_HOST = os.environ.get("JOB_QUEUE_HOST", NOTIFY_REDIS_HOST)
+JOB_QUEUE = "sandbox:jobs"
+USAGE_FIELDS = ("ru_utime", "ru_stime", "ru_maxrss", "ru_inblock", "ru_oublock")
+CANCEL_PREFIX = "sandbox:cancel:"
+
+_ctx = multiprocessing.get_context("forkserver")
+_ctx.set_forkserver_preload(PRELOAD_MODULES + ["worker_pool"])
+
+# ------------ Worker Side ---------------
+
+def _worker(local_code, local_data, out_path, err_path, usage_path, profile_path, env):
+    '''
+    Runs one script in a process forked from the warm fork server.
+    Mirrors `python script.py data.parquet`: argv, __main__ and stdout/stderr go where the one-shot mode sends them.
+    Its rusage (and cProfile dump when profiling) is written out before exiting.
+    '''
+    import resource
+    apply_limits()
+    os.environ.update(env)
+    for fd, path in ((1, out_path), (2, err_path)):
+        target = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC)
+        os.dup2(target, fd)
+        os.close(target)
+    sys.argv = [local_code, local_data]
+    sys.path[0] = os.path.dirname(local_code)
+    profiler = None
+    if profile_path:
+        import cProfile
+        profiler = cProfile.Profile()
+    code = 0
+    try:
+        if profiler is not None:
+            profiler.runcall(runpy.run_path, local_code, run_name="__main__")
+        else:
+            runpy.run_path(local_code, run_name="__main__")
+    except SystemExit as e:
+        if isinstance(e.code, int) or e.code is None:
+            code = e.code or 0
+        else:
+            print(e.code, file=sys.stderr)
+            code = 1
+    except BaseException:
+        traceback.print_exc()
+        code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        try:
+            if profiler is not None:
+                profiler.dump_stats(profile_path)
+            rusage = resource.getrusage(resource.RUSAGE_SELF)
+            with open(usage_path, "w") as f:
+                json.dump({field: getattr(rusage, field) for field in USAGE_FIELDS}, f)
+        except Exception:
+            traceback.print_exc()
+    os._exit(code)
+
+def _noop():
+    pass
+
+def warm_up():
+    ''' Starts the fork server so the preload imports happen before the first job '''
+    start = time.perf_counter()
+    process = _ctx.Process(target=_noop)
+    process.start()
+    process.join()
+    logger.info(f"Fork server warmed with {PRELOAD_MODULES} in {time.perf_counter() - start:.2f}s")
+
+def _usage(usage_path, profile_path, wall_seconds):
+    ''' Usage the worker recorded, only the wall time if it was killed before writing it '''
+    try:
+        with open(usage_path) as f:
+            usage = usage_from_rusage(types.SimpleNamespace(**json.load(f)), wall_seconds)
+    except (OSError, ValueError):
+        usage = {"wall_seconds": round(wall_seconds, 3)}
+    if profile_path:
+        usage["profile"] = profile_summary(profile_path)
+    return usage
+
+def run_warm(local_code, local_data, env=None, should_cancel=None, progress=None):
+    '''
+    Runs the script in a fresh process forked from the warm fork server, under the configured rlimits
+    Args:
+        env: extra environment variables for the script (e.g. STRATEGY_PARAMS)
+        should_cancel: callable polled every second, kills the run when it returns True
+        progress: reporter the script's output and progress lines are streamed to while it runs
+    Returns:
+        (returncode, stdout, stderr, usage), raises subprocess.TimeoutExpired on timeout.
+        peak_rss_mb includes the pages shared with the fork server (preloaded modules).
+    '''
+    tmpdir = tempfile.mkdtemp()
+    out_path = os.path.join(tmpdir, "stdout")
+    err_path = os.path.join(tmpdir, "stderr")
+    usage_path = os.path.join(tmpdir, "usage.json")
+    profile_path = os.path.join(tmpdir, "profile.prof") if SCRIPT_PROFILE else None
+    stdout = OutputCollector("stdout", progress)
+    stderr = OutputCollector("stderr", progress)
+    try:
+        for path in (out_path, err_path):
+            open(path, "w").close()
+        process = _ctx.Process(
+            target=_worker,
+            args=(local_code, local_data, out_path, err_path, usage_path, profile_path, env or {}),
+        )
+        with open(out_path, errors="replace") as out, open(err_path, errors="replace") as err:
+            start = time.monotonic()
+            process.start()
+            deadline = start + SCRIPT_TIMEOUT
+            while process.is_alive() and time.monotonic() < deadline:
+                process.join(min(1.0, max(deadline - time.monotonic(), 0)))
+                # Tail the output files, so progress is streamed while the script runs
+                stdout.feed(out.read())
+                stderr.feed(err.read())
+                if should_cancel is not None and process.is_alive() and should_cancel():
+                    process.kill()
+                    process.join()
+                    return 1, "", "cancelled", None
+            if process.is_alive():
+                process.kill()
+                process.join()
+                raise subprocess.TimeoutExpired(local_code, SCRIPT_TIMEOUT)
+            wall_seconds = time.monotonic() - start
+            stdout.feed(out.read())
+            stderr.feed(err.read())
+        return process.exitcode, stdout.text(), stderr.text(), _usage(usage_path, profile_path, wall_seconds)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+# ------------ Job Queues ---------------
+
+class RedisJobQueue:
+    ''' Jobs pushed by the MCP server onto a Redis list '''
+    def __init__(self, host=JOB_QUEUE_HOST):
+        import redis
+        self.client = redis.Redis(host=host, port=int(os.environ.get("REDIS_PORT", "6379")), decode_responses=True)
+
+    def get(self):
+        while True:
+            reply = self.client.brpop(JOB_QUEUE, timeout=30)
+            if reply:
+                return json.loads(reply[1])
+
+    def is_cancelled(self, job):
+        return bool(self.client.exists(f"{CANCEL_PREFIX}{job['result_gs']}"))
+
+class LocalJobQueue:
+    ''' In-process queue, for development and the benchmark '''
+    def __init__(self):
+        self._queue = queue.Queue()
+        self.cancelled = set()
+
+    def put(self, job):
+        self._queue.put(job)
+
+    def get(self):
+        return self._queue.get()
+
+    def is_cancelled(self, job):
+        return job["result_gs"] in self.cancelled
+
+def _serve_one(job_queue):
+    while True:
+        job = job_queue.get()
+        if job is None:
+            return
+        if job_queue.is_cancelled(job):
+            logger.info(f"Skipping cancelled job {job['result_gs']}")
+            continue
+        try:
+            if job.get("batch_gs"):
+                from batch import run_batch
+                run_batch(job["batch_gs"], job["result_gs"], execute=run_warm)
+                continue
+            run_job(
+                job["code_gs"], job["data_gs"], job["result_gs"],
+                execute=lambda code, data, env=None, progress=None: run_warm(
+                    code, data, env=env, progress=progress, should_cancel=lambda: job_queue.is_cancelled(job)
+                ),
+            )
+        except Exception as e:
+            logger.error(f"Job {job['result_gs']} failed: {e}", exc_info=True)
+
+def serve(job_queue=None, workers=POOL_SIZE):
+    '''
+    Long-lived runner: warms the fork server, then runs queued jobs with `workers` in parallel.
+    Each job still gets its own process (forked, so imports are already done) with CPU and memory limits.
+    '''
+    job_queue = job_queue or RedisJobQueue()
+    warm_up()
+    threads = [threading.Thread(target=_serve_one, args=(job_queue,), daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    logger.info(f"Runner pool serving {JOB_QUEUE} with {workers} workers")
+    for thread in threads:
+        thread.join()
+
+def benchmark(local_code, local_data, runs=5):
+    ''' Per-job latency of the one-shot interpreter vs the warm pool on local files '''
+    warm_up()
+    timings = {}
+    for name, execute in (("oneshot", run_subprocess), ("pool", run_warm)):
+        samples = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            returncode, _, stderr, _ = execute(local_code, local_data)
+            samples.append(time.perf_counter() - start)
+            if returncode != 0:
+                logger.error(f"{name} run failed: {stderr[-500:]}")
+        timings[name] = samples
+        print(f"{name:>8}: mean {sum(samples) / runs:.3f}s  min {min(samples):.3f}s  max {max(samples):.3f}s")
+    return timings
+
+if __name__ == "__main__":
+    # python worker_pool.py <script.py> <data.parquet> [runs]
+    if len(sys.argv) < 3:
+        print("usage: python worker_pool.py <script.py> <data.parquet> [runs]")
+        sys.exit(1)
+    benchmark(sys.argv[1], sys.argv[2], int(sys.argv[3]) if len(sys.argv) > 3 else 5)
@@ -13,9 +13,11 @@ from google.adk.runners import Runner
 from google.adk.sessions import DatabaseSessionService
 from google.genai import types
 from google.adk.tools.tool_context import ToolContext
-import os, re, uuid, requests,tempfile,json
+import os, re, uuid,tempfile,json,hashlib
 from dotenv import load_dotenv
 from .system_instructions import read_system_instructions
+from .code_analyzer import analyze
+from .tool_client import call_tool
 
 #load_dotenv()
 
@@ -28,12 +30,15 @@ PROJECT = os.environ.get("GOOGLE_CLOUD_PROJECT")
 
 # --- Tool Processess ---
 
-def call_fastapi_tool(tool_name, args):
+async def call_fastapi_tool(tool_name, args, progress_id=None):
     ''' Calls the MCP Server '''
-    resp = requests.post(f"{FASTAPI_URL}/calltool", json={"tool_name": tool_name, "args": args})
-    return resp.json()
+    return await call_tool(tool_name, args, progress_id=progress_id)
 
-def data_retriever(ticker: str,
+def chat_session_id(tool_context):
+    ''' Id of the chat session a tool runs in, the one the frontend follows on /progress/{session_id} '''
+    return tool_context.session.id
+
+async def data_retriever(ticker: str,
     start_period: str,
     end_period: str,
     interval: str) -> str:
@@ -58,20 +63,21 @@ def data_retriever(ticker: str,
         id = uuid.uuid4().hex[:8]
         logger.info(f" Calling Tool: {tool_name}, Args: {tool_args}, Session_id: {id}")
         tool_args['session_id'] = id
-        response = call_fastapi_tool(tool_name, tool_args)
+        response = await call_fastapi_tool(tool_name, tool_args)
         logger.info( f" Tool Called Successfully {response}")
         result = {'Response': response, 'Session Id': id}
         return result
     except Exception as e:
         logger.error(f" An Error Occurred when Calling Tool Data_API: {e}")
 
-def sandbox_runner(gcs_script_path: str, strategy_name: str, session_id: str):
+async def sandbox_runner(gcs_script_path: str, strategy_name: str, session_id: str, tool_context: ToolContext):
     '''
     Executes Generated Strategy Scripts in a Secured Sandbox Environment
     Args:
         gcs_script_path: Path to the saved strategy script 
         strategy_name: Strategy Name that summarizes the strategy in one word (e.g., "OrderblockStrategy")
         session_id: the session id provided during the data retrival
+        tool_context: supplied by the runner, its chat session keys the run's progress stream
     Return:
         Output metrics for strategy in json format
     '''
@@ -83,32 +89,67 @@ def sandbox_runner(gcs_script_path: str, strategy_name: str, session_id: str):
             "session_id": session_id
             }
         logger.info(f" Calling Tool: {tool_name}, Args: {tool_args}")
-        response = call_fastapi_tool(tool_name, tool_args)
+        response = await call_fastapi_tool(tool_name, tool_args, progress_id=chat_session_id(tool_context))
         logger.info( f" Tool Called Successfully {response}")
         return response
     except Exception as e:
         logger.error(f" An Error Occurred when Calling Tool Sandbox_Executor: {e}")
 
+async def sandbox_batch_runner(gcs_script_paths: list[str], strategy_name: str, session_id: str,
+                         tool_context: ToolContext, params: list[dict] = None, rank_by: str = "Sharpe Ratio"):
+    '''
+    Executes several strategy scripts and/or parameter sets in parallel in one sandbox run and ranks them
+    Args:
+        gcs_script_paths: Paths to the saved strategy scripts
+        strategy_name: Strategy Name that summarizes the strategies in one word (e.g., "OrderblockSweep")
+        session_id: the session id provided during the data retrival
+        params: Parameter sets to try (e.g., [{"fast": 10, "slow": 50}, {"fast": 20, "slow": 100}]);
+                each run reads its set with json.loads(os.environ.get("STRATEGY_PARAMS", "{}"))
+        rank_by: Metric to rank the runs by (e.g., "Sharpe Ratio")
+        tool_context: supplied by the runner, its chat session keys the run's progress stream
+    Return:
+        Ranked metrics of every run in json format
+    '''
+    try:
+        tool_name = "Sandbox_Batch_Executor"
+        tool_args = {
+            "script_paths": gcs_script_paths,
+            "strategy_name": strategy_name,
+            "session_id": session_id,
+            "params": params,
+            "rank_by": rank_by
+            }
+        logger.info(f" Calling Tool: {tool_name}, Args: {tool_args}")
+        response = await call_fastapi_tool(tool_name, tool_args, progress_id=chat_session_id(tool_context))
+        logger.info( f" Tool Called Successfully {response}")
+        return response
+    except Exception as e:
+        logger.error(f" An Error Occurred when Calling Tool Sandbox_Batch_Executor: {e}")
+
 def sanitize_filename(name):
     '''Ensures file name doesn't create conflict when saving files with them '''
     return re.sub(r"[^\w\-_.]", "_", name)
 
-def upload_file(local_path, gcs_path):
+def upload_file(local_path, gcs_path, skip_existing=False):
     '''
     Uploads File to GCS BUCKET 
     Args: 
         local_path: path to local python code file
         gcs_path: GCS bucket path to save the file
+        skip_existing: do not upload again if the object already exists (content-addressed paths)
     Returns:
         gcs file path 
     '''
     try:
-        logging.info(f"Uploading {local_path} to {gcs_path} in Progress")
         client = storage.Client(project = PROJECT)
         bucket = client.bucket(BUCKET)
         blob = bucket.blob(gcs_path)
-        blob.upload_from_filename(local_path)
         cloud_path = f"gs://{BUCKET}/{gcs_path}"
+        if skip_existing and blob.exists():
+            logging.info(f" File Already Stored. Path: {cloud_path}")
+            return cloud_path
+        logging.info(f"Uploading {local_path} to {gcs_path} in Progress")
+        blob.upload_from_filename(local_path)
         logging.info(f" File Uploaded Successfully. Path: {cloud_path}")
         return cloud_path
     except Exception as e:
@@ -143,24 +184,35 @@ def code_saver(code: str, ticker:str, interval:str) -> str:
         ticker: Unique ticker for each public financial trading asset (e.g., "BTC/USD","AAPL")
         interval: Timeframe to which the financial trading asset would be retrieved in (e.g., '1day', '1h')
     Return:
-        Saved Path to Strategy Script
+        Saved Path to Strategy Script, or a JSON report of the problems found if the script is rejected
     '''
     try:
         logger.info("Saving File in Progress")
-        uid = uuid.uuid4().hex[:8]
         tmpdir = tempfile.mkdtemp()
         clean_ticker = sanitize_filename(ticker)
-        output_name = f"{clean_ticker}_{interval}_{uid}.py"
-        output_file = os.path.join(tmpdir, output_name)
         code_blocks = re.findall(r"```python(.*?)```", code, re.DOTALL)
         if not code_blocks:
             return "Failed to find code inside markdown ```python ... ```, ensure it is written in that markdown format"
         python_code = "\n".join(code_blocks).strip()
+        # Pre-flight: slow or contract-breaking scripts go back to the builder without a sandbox run
+        report = analyze(python_code)
+        if not report["ok"]:
+            logger.info(f" Script rejected by pre-flight analysis: {[e['rule'] for e in report['errors']]}")
+            return json.dumps({
+                "status": "rejected",
+                "errors": report["errors"],
+                "warnings": report["warnings"],
+                "instruction": "Fix every error listed (line numbers refer to the script) and call code_saver again",
+            })
+        # Name the script after its content so an unchanged script is uploaded only once
+        digest = hashlib.blake2b(python_code.encode("utf-8"), digest_size=20).hexdigest()
+        output_name = f"{clean_ticker}_{interval}_{digest}.py"
+        output_file = os.path.join(tmpdir, output_name)
         os.makedirs(os.path.dirname(output_file), exist_ok=True)
         with open(output_file, "w", encoding="utf-8") as f:
             f.write(python_code)
         logger.info(f" File Saved Successfully: {output_file}")
-        cloud_path = upload_file(output_file,f"scripts/{output_name}")
+        cloud_path = upload_file(output_file,f"scripts/{output_name}", skip_existing=True)
         return cloud_path
     except Exception as e:
         logger.error(f" An Error Occurred while saving file: {e}")
@@ -205,7 +257,7 @@ tester_agent = LLMAgent(
     model=MODEL,
     description="Tests strategy performance and provides structured feedback.",
     instruction=tester_system_instructions,
-    tools=[sandbox_runner, code_veiwer],
+    tools=[sandbox_runner, sandbox_batch_runner, code_veiwer],
     output_key = "tester_response"
 )
 
@@ -227,7 +279,7 @@ tester_agent2 = LLMAgent(
     model=MODEL,
     description="Tests strategy performance and provides structured feedback.",
     instruction=tester_system_instructions,
-    tools=[sandbox_runner, code_veiwer],
+    tools=[sandbox_runner, sandbox_batch_runner, code_veiwer],
     output_key = "tester_response2"
 )
 
@@ -0,0 +1,230 @@
+import logging,sys
+logger = logging.getLogger("runner")
+logging.basicConfig(
+    stream=sys.stdout,
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+)
+import os, ast, time, threading
+
+# Pre-flight checks of generated strategy scripts, run before they are saved for the sandbox.
+# Errors reject the script with feedback for the builder agent, warnings are only reported.
+
+ROW_ITERATORS = {"iterrows", "itertuples", "iteritems"}
+INDEXERS = {"iloc", "loc", "iat", "at"}
+INDICATOR_CALLS = {"rolling", "ewm", "expanding", "rsi", "atr", "macd", "ema", "sma", "bbands", "stoch"}
+INDICATOR_MODULES = {"ta", "talib", "pta", "vbt"}
+JIT_DECORATORS = {"njit", "jit", "vectorize", "guvectorize"}
+BLOCKED_IMPORTS = {"subprocess", "socket", "requests", "urllib", "http", "ftplib", "smtplib", "multiprocessing"}
+ENGINES = {"backtesting", "vectorbt"}
+
+ANALYZER_METRICS = {"analyzed": 0, "rejected": 0, "warned": 0, "total_seconds": 0.0, "max_seconds": 0.0, "rules": {}}
+_metrics_lock = threading.Lock()
+# A summary of the counters is logged every this many analyses, 0 turns it off
+ANALYZER_LOG_EVERY = int(os.environ.get("ANALYZER_LOG_EVERY", "50"))
+
+def _name(node):
+    ''' Dotted name of a Name/Attribute chain, e.g. "pd.concat" '''
+    parts = []
+    while isinstance(node, ast.Attribute):
+        parts.append(node.attr)
+        node = node.value
+    if isinstance(node, ast.Name):
+        parts.append(node.id)
+    return ".".join(reversed(parts))
+
+class _Visitor(ast.NodeVisitor):
+    def __init__(self):
+        self.findings = []
+        self.loops = []       # enclosing loops: (loop variables, whether it walks the bars)
+        self.functions = []   # enclosing function nodes
+        self.strategy_next = False
+        self.imports = set()
+        self.reads_argv = False
+        self.reads_data = False
+        self.has_main = False
+        self.prints = False
+
+    def add(self, severity, rule, node, message):
+        if any(f["rule"] == rule and f["line"] == getattr(node, "lineno", None) for f in self.findings):
+            return
+        self.findings.append({"severity": severity, "rule": rule, "line": getattr(node, "lineno", None), "message": message})
+
+    def _jitted(self):
+        return any(_name(d.func if isinstance(d, ast.Call) else d).split(".")[-1] in JIT_DECORATORS
+                   for f in self.functions for d in f.decorator_list)
+
+    # --- structure ---
+
+    def visit_Import(self, node):
+        for alias in node.names:
+            self.imports.add(alias.name.split(".")[0])
+        self.generic_visit(node)
+
+    def visit_ImportFrom(self, node):
+        if node.module:
+            self.imports.add(node.module.split(".")[0])
+        self.generic_visit(node)
+
+    def visit_FunctionDef(self, node):
+        self.functions.append(node)
+        self.generic_visit(node)
+        self.functions.pop()
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_ClassDef(self, node):
+        is_strategy = any(_name(base).split(".")[-1] == "Strategy" for base in node.bases)
+        for item in node.body:
+            if is_strategy and isinstance(item, ast.FunctionDef) and item.name == "next":
+                self.strategy_next = True
+                self.visit(item)
+                self.strategy_next = False
+            else:
+                self.visit(item)
+
+    def visit_If(self, node):
+        test = node.test
+        if (isinstance(test, ast.Compare) and _name(test.left) == "__name__"
+                and any(isinstance(c, ast.Constant) and c.value == "__main__" for c in test.comparators)):
+            self.has_main = True
+        self.generic_visit(node)
+
+    def visit_Subscript(self, node):
+        if _name(node.value) == "sys.argv" and isinstance(node.slice, ast.Constant) and node.slice.value == 1:
+            self.reads_argv = True
+        if self._in_bar_loop() and _name(node.value).split(".")[-1] in INDEXERS:
+            loop_vars = set().union(*(variables for variables, _ in self.loops))
+            if loop_vars & {n.id for n in ast.walk(node.slice) if isinstance(n, ast.Name)}:
+                self.add("error", "row_loop", node,
+                         "Indexes the data bar by bar inside a loop; use vectorized pandas/numpy/vectorbt operations")
+        self.generic_visit(node)
+
+    # --- loops ---
+
+    def _in_bar_loop(self):
+        return any(bars for _, bars in self.loops) and not self._jitted()
+
+    @staticmethod
+    def _walks_bars(iterator):
+        ''' for ... in range(len(data)) / data.iterrows() / data.index: one iteration per bar '''
+        if isinstance(iterator, ast.Call):
+            func = _name(iterator.func).split(".")[-1]
+            if func in ROW_ITERATORS:
+                return True
+            if func in ("range", "enumerate", "zip"):
+                return any(isinstance(n, ast.Call) and _name(n.func) == "len" for arg in iterator.args for n in ast.walk(arg)) \
+                    or any(_Visitor._walks_bars(arg) for arg in iterator.args)
+        return _name(iterator).endswith(".index") or _name(iterator).endswith(".values")
+
+    def visit_For(self, node):
+        iterator = node.iter
+        if isinstance(iterator, ast.Call) and not self._jitted():
+            func = _name(iterator.func).split(".")[-1]
+            if func in ROW_ITERATORS:
+                self.add("error", "row_loop", node, f"Loops over rows with .{func}(); use vectorized column operations")
+        self.loops.append(({n.id for n in ast.walk(node.target) if isinstance(n, ast.Name)}, self._walks_bars(iterator)))
+        self.generic_visit(node)
+        self.loops.pop()
+
+    def visit_While(self, node):
+        self.loops.append((set(), False))
+        self.generic_visit(node)
+        self.loops.pop()
+
+    # --- calls ---
+
+    def visit_Call(self, node):
+        func = _name(node.func)
+        last = func.split(".")[-1]
+        if func in ("pd.read_parquet", "read_parquet", "load_data", "lucas_data.load_data") or last == "read_parquet":
+            self.reads_data = True
+        if last in ("print", "dumps") or func == "sys.stdout.write":
+            self.prints = True
+        if last == "apply" and any(k.arg == "axis" and isinstance(k.value, ast.Constant) and k.value.value in (1, "columns")
+                                   for k in node.keywords):
+            self.add("error", "row_apply", node, ".apply(axis=1) calls Python once per row; use vectorized column operations")
+        bar_loop = self._in_bar_loop()
+        if self.loops and not self._jitted() and (func in ("pd.concat", "concat") or (last == "append" and self._frame_append(node))):
+            # Quadratic copying; fatal over the bars, tolerable over a handful of items
+            self.add("error" if bar_loop else "warning", "concat_in_loop", node,
+                     "Grows a DataFrame inside a loop; collect rows in a list and build the frame once")
+        if (bar_loop or self.strategy_next) and not self._jitted():
+            module = func.split(".")[0]
+            if last in INDICATOR_CALLS or (module in INDICATOR_MODULES and last == "run"):
+                where = "in Strategy.next()" if self.strategy_next and not bar_loop else "for every bar"
+                self.add("error", "indicator_per_bar", node,
+                         f"Recomputes the indicator {func}() {where}; compute it once over the whole series "
+                         f"(self.I(...) in init() for backtesting, vectorized for vectorbt)")
+        self.generic_visit(node)
+
+    def _frame_append(self, node):
+        # df = df.append(...) is the pandas pattern; list.append(...) as a statement is fine
+        return isinstance(getattr(node, "parent", None), ast.Assign)
+
+def analyze(code: str) -> dict:
+    '''
+    Statically checks a generated strategy script for known slow patterns and the sandbox contract
+    Args:
+        code: python source of the strategy
+    Returns:
+        {"ok": bool, "errors": [...], "warnings": [...], "seconds": float}, each finding being
+        {"severity", "rule", "line", "message"}
+    '''
+    start = time.perf_counter()
+    try:
+        tree = ast.parse(code)
+    except SyntaxError as e:
+        findings = [{"severity": "error", "rule": "syntax", "line": e.lineno, "message": f"Syntax error: {e.msg}"}]
+    else:
+        for parent in ast.walk(tree):
+            for child in ast.iter_child_nodes(parent):
+                child.parent = parent
+        visitor = _Visitor()
+        visitor.visit(tree)
+        findings = visitor.findings
+        contract = [
+            (visitor.imports & ENGINES, "engine", "Use backtesting or vectorbt as the backtesting engine"),
+            (visitor.reads_argv, "entrypoint", "Read the data path from sys.argv[1]"),
+            (visitor.reads_data, "data_loading", "Load the parquet data with load_data(data_path) or pd.read_parquet(data_path)"),
+            (visitor.has_main, "entrypoint", "Run the backtest under if __name__ == '__main__':"),
+            (visitor.prints, "output", "Print the metrics as JSON to stdout"),
+        ]
+        for satisfied, rule, message in contract:
+            if not satisfied:
+                findings.append({"severity": "error", "rule": rule, "line": None, "message": message})
+        for module in sorted(visitor.imports & BLOCKED_IMPORTS):
+            findings.append({"severity": "error", "rule": "blocked_import", "line": None,
+                             "message": f"The sandbox has no network or process access, remove the {module} import"})
+    seconds = time.perf_counter() - start
+    errors = [f for f in findings if f["severity"] == "error"]
+    warnings = [f for f in findings if f["severity"] != "error"]
+    _record(errors, warnings, seconds)
+    return {"ok": not errors, "errors": errors, "warnings": warnings, "seconds": round(seconds, 6)}
+
+def _record(errors, warnings, seconds):
+    with _metrics_lock:
+        ANALYZER_METRICS["analyzed"] += 1
+        ANALYZER_METRICS["rejected"] += bool(errors)
+        ANALYZER_METRICS["warned"] += bool(warnings)
+        ANALYZER_METRICS["total_seconds"] += seconds
+        ANALYZER_METRICS["max_seconds"] = max(ANALYZER_METRICS["max_seconds"], seconds)
+        for finding in errors + warnings:
+            ANALYZER_METRICS["rules"][finding["rule"]] = ANALYZER_METRICS["rules"].get(finding["rule"], 0) + 1
+        analyzed = ANALYZER_METRICS["analyzed"]
+    logger.info(f" Pre-flight analysis: {len(errors)} errors, {len(warnings)} warnings in {seconds * 1000:.2f}ms")
+    if ANALYZER_LOG_EVERY and analyzed % ANALYZER_LOG_EVERY == 0:
+        metrics = analyzer_metrics()
+        logger.info(
+            f" Pre-flight analyzer after {metrics['analyzed']} scripts: rejection rate {metrics['rejection_rate']:.1%}, "
+            f"mean {metrics['mean_ms']:.2f}ms, max {metrics['max_seconds'] * 1000:.2f}ms, rules {metrics['rules']}"
+        )
+
+def analyzer_metrics() -> dict:
+    ''' Counters plus rejection rate and mean latency of the analyses so far '''
+    with _metrics_lock:
+        metrics = {**ANALYZER_METRICS, "rules": dict(ANALYZER_METRICS["rules"])}
+    analyzed = metrics["analyzed"] or 1
+    metrics["rejection_rate"] = metrics["rejected"] / analyzed
+    metrics["mean_ms"] = metrics["total_seconds"] / analyzed * 1000
+    return metrics
@@ -0,0 +1,111 @@
+import asyncio
+import time
+
+import pytest
+
+httpx = pytest.importorskip("httpx")
+
+import tool_client
+from tool_client import CircuitBreaker, ToolClient, ToolUnavailable, TOOL_CLIENT_METRICS
+
+class FakeServer:
+    ''' /calltool stand-in answering with a configurable status, or failing to connect '''
+    def __init__(self):
+        self.status = 200
+        self.refuse = False
+        self.requests = []
+
+    def handle(self, request):
+        if self.refuse:
+            raise httpx.ConnectError("connection refused", request=request)
+        self.requests.append(request)
+        if self.status >= 500:
+            return httpx.Response(self.status, json={"detail": "server error"})
+        return httpx.Response(200, json={"result": "ok"})
+
+def _client(server, failures=3, reset=0.2):
+    client = ToolClient("http://mcp.test", CircuitBreaker(failures=failures, reset=reset))
+    transport = httpx.MockTransport(server.handle)
+    client._http = lambda: httpx.AsyncClient(base_url=client.base_url, transport=transport)
+    return client
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(tool_client, "TOOL_BACKOFF", 0)
+
+def test_breaker_opens_after_consecutive_failures_and_closes_on_a_good_trial():
+    server = FakeServer()
+    client = _client(server)
+
+    async def run():
+        server.status = 500
+        for _ in range(3):
+            assert await client.call("Sandbox_Executor", {}) == {"detail": "server error"}
+        assert client.breaker.state == "open"
+        sent = len(server.requests)
+        with pytest.raises(ToolUnavailable):
+            await client.call("Sandbox_Executor", {})
+        assert len(server.requests) == sent  # short-circuited, the server was not called
+
+        await asyncio.sleep(0.25)
+        assert client.breaker.state == "half-open"
+        server.status = 200
+        assert await client.call("Sandbox_Executor", {}) == {"result": "ok"}
+        assert client.breaker.state == "closed" and client.breaker.failures == 0
+        assert await client.call("Data_API", {}) == {"result": "ok"}
+
+    asyncio.run(run())
+
+def test_failed_trial_opens_the_breaker_again():
+    server = FakeServer()
+    client = _client(server, failures=2)
+
+    async def run():
+        server.refuse = True
+        # Connect errors are retried, until the breaker opens under the retries
+        with pytest.raises(ToolUnavailable):
+            await client.call("Sandbox_Executor", {})
+        assert client.breaker.state == "open"
+        await asyncio.sleep(0.25)
+        # The trial fails, so the retry of the same call is short-circuited
+        with pytest.raises(ToolUnavailable):
+            await client.call("Sandbox_Executor", {})
+        assert client.breaker.state == "open"
+
+    asyncio.run(run())
+
+def test_only_one_trial_while_half_open_and_cancel_frees_it():
+    breaker = CircuitBreaker(failures=1, reset=0.05)
+    breaker.failure()
+    assert not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+    assert not breaker.allow()
+    breaker.release()
+    assert breaker.allow()
+    breaker.success()
+    assert breaker.state == "closed" and breaker.allow()
+
+def test_idempotent_tools_are_retried_on_gateway_errors():
+    server = FakeServer()
+    client = _client(server, failures=10)
+
+    async def run():
+        server.status = 503
+        before = TOOL_CLIENT_METRICS["retries"]
+        assert await client.call("Data_API", {"ticker": "AAPL"}) == {"detail": "server error"}
+        data_calls = len(server.requests)
+        assert await client.call("Sandbox_Executor", {}) == {"detail": "server error"}
+        return data_calls, len(server.requests) - data_calls, TOOL_CLIENT_METRICS["retries"] - before
+
+    data_calls, sandbox_calls, retries = asyncio.run(run())
+    assert data_calls == 1 + tool_client.TOOL_RETRIES
+    assert sandbox_calls == 1
+    assert retries == tool_client.TOOL_RETRIES
+
+def test_progress_id_travels_in_the_body():
+    server = FakeServer()
+    client = _client(server)
+    asyncio.run(client.call("Sandbox_Executor", {"x": 1}, progress_id="chat-1"))
+    body = server.requests[-1].read()
+    assert b'"progress_id":"chat-1"' in body.replace(b" ", b"")
@@ -0,0 +1,246 @@
+import logging,sys
+logger = logging.getLogger("runner")
+logging.basicConfig(
+    stream=sys.stdout,
+    level=logging.INFO,
+    format="%(asctime)s [%(levelname)s] %(message)s",
+)
+import os, time, random, asyncio, threading
+import httpx
+
+# Async client for the MCP tool server's /calltool: pooled keep-alive connections, a timeout per tool,
+# retries with backoff where repeating a call is safe, and a circuit breaker while the server is down.
+
+FASTAPI_URL = os.getenv("MCP")
+TOOL_TIMEOUT = float(os.getenv("TOOL_TIMEOUT", "120"))
+# Sandbox runs wait for the job result, data fetches may go to the vendor
+TOOL_TIMEOUTS = {
+    "Data_API": float(os.getenv("DATA_TOOL_TIMEOUT", "180")),
+    "Sandbox_Executor": float(os.getenv("SANDBOX_TOOL_TIMEOUT", "900")),
+    "Sandbox_Batch_Executor": float(os.getenv("SANDBOX_BATCH_TOOL_TIMEOUT", "1800")),
+}
+# Calls that can be repeated without side effects (Data_API reads through the market data cache).
+# Other tools are only retried when the request never reached the server.
+IDEMPOTENT_TOOLS = {"Data_API"}
+TOOL_RETRIES = int(os.getenv("TOOL_RETRIES", "2"))
+TOOL_BACKOFF = float(os.getenv("TOOL_BACKOFF", "0.5"))
+RETRY_STATUSES = {502, 503, 504}  # retried for idempotent tools; every 5xx counts against the breaker
+TOOL_MAX_CONNECTIONS = int(os.getenv("TOOL_MAX_CONNECTIONS", "20"))
+BREAKER_FAILURES = int(os.getenv("TOOL_BREAKER_FAILURES", "5"))  # consecutive failures that open the breaker
+BREAKER_RESET = float(os.getenv("TOOL_BREAKER_RESET", "30"))  # seconds open before one trial call
+
+TOOL_CLIENT_METRICS = {"calls": 0, "retries": 0, "failures": 0, "short_circuited": 0}
+
+class ToolUnavailable(Exception):
+    ''' The MCP server is unreachable and the circuit breaker is open '''
+
+class CircuitBreaker:
+    '''
+    Closed: calls go through, consecutive failures are counted.
+    Open: calls fail at once for `reset` seconds instead of each waiting for its timeout.
+    Half-open: one trial call; success closes the breaker, failure opens it again.
+    '''
+    def __init__(self, failures=BREAKER_FAILURES, reset=BREAKER_RESET):
+        self.max_failures = failures
+        self.reset = reset
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half-open" if time.monotonic() - self.opened_at >= self.reset else "open"
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "half-open" and not self._trial:
+                self._trial = True
+                return True
+            return False
+
+    def success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def release(self):
+        ''' A call that ended without an outcome (cancelled) gives its trial slot back '''
+        with self._lock:
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial = False
+            if self.failures >= self.max_failures or self.opened_at is not None:
+                if self.opened_at is None:
+                    logger.error(f" MCP server failing, pausing tool calls for {self.reset:.0f}s")
+                self.opened_at = time.monotonic()
+
+class ToolClient:
+    def __init__(self, base_url=FASTAPI_URL, breaker=None):
+        self.base_url = base_url
+        self.breaker = breaker or CircuitBreaker()
+        self._client = None
+        self._loop = None
+
+    def _http(self):
+        # A client's connections belong to the event loop that opened them; the ADK runner may
+        # run each turn on a new loop, so the pool is rebuilt when the loop changes
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._loop is not loop:
+            if self._client is not None:
+                self._close(self._client, self._loop)
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                limits=httpx.Limits(max_connections=TOOL_MAX_CONNECTIONS, max_keepalive_connections=TOOL_MAX_CONNECTIONS),
+            )
+            self._loop = loop
+        return self._client
+
+    @staticmethod
+    def _close(client, loop):
+        ''' Closes the client of a previous loop, on that loop while it still runs '''
+        async def close():
+            try:
+                await client.aclose()
+            except Exception as e:  # a closed loop's transports cannot all be shut down cleanly
+                logger.debug(f" Closing the previous tool client failed: {e}")
+        if loop is not None and loop.is_running() and not loop.is_closed():
+            asyncio.run_coroutine_threadsafe(close(), loop)
+        else:
+            asyncio.get_running_loop().create_task(close())
+
+    async def call(self, tool_name, args, progress_id=None):
+        '''
+        Calls a tool on the MCP server
+        Args:
+            progress_id: chat session the tool's progress notifications are published under
+        Returns:
+            the decoded JSON response, as the server sent it (errors included)
+        Raises:
+            ToolUnavailable when the breaker is open, httpx errors once retries are exhausted
+        '''
+        TOOL_CLIENT_METRICS["calls"] += 1
+        timeout = httpx.Timeout(TOOL_TIMEOUTS.get(tool_name, TOOL_TIMEOUT), connect=5.0)
+        body = {"tool_name": tool_name, "args": args}
+        if progress_id:
+            body["progress_id"] = progress_id
+        attempts = 1 + TOOL_RETRIES
+        for attempt in range(attempts):
+            if not self.breaker.allow():
+                TOOL_CLIENT_METRICS["short_circuited"] += 1
+                raise ToolUnavailable(f"MCP server unavailable, {tool_name} not called")
+            try:
+                resp = await self._http().post("/calltool", json=body, timeout=timeout)
+            except BaseException as e:
+                if not isinstance(e, httpx.TransportError):
+                    # Cancelled or broken before any answer: no verdict on the server, free the trial
+                    self.breaker.release()
+                    raise
+                self.breaker.failure()
+                # Connect errors never reached the server; anything later may have run the tool
+                retryable = isinstance(e, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)) \
+                    or tool_name in IDEMPOTENT_TOOLS
+                if not retryable or attempt == attempts - 1:
+                    TOOL_CLIENT_METRICS["failures"] += 1
+                    raise
+                logger.warning(f" {tool_name} call failed ({type(e).__name__}), retrying")
+            else:
+                if resp.status_code >= 500:
+                    self.breaker.failure()
+                    if resp.status_code not in RETRY_STATUSES or tool_name not in IDEMPOTENT_TOOLS \
+                            or attempt == attempts - 1:
+                        TOOL_CLIENT_METRICS["failures"] += 1
+                        return resp.json() if resp.content else {"detail": f"HTTP {resp.status_code}"}
+                    logger.warning(f" {tool_name} returned {resp.status_code}, retrying")
+                else:
+                    self.breaker.success()
+                    return resp.json()
+            TOOL_CLIENT_METRICS["retries"] += 1
+            await asyncio.sleep(TOOL_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5))
+
+tool_client = ToolClient()
+
+async def call_tool(tool_name, args, progress_id=None):
+    ''' Calls the MCP Server '''
+    return await tool_client.call(tool_name, args, progress_id=progress_id)
+
+# ------------ Benchmark ---------------
+
+def _stub_server(latency):
+    ''' MCP API stand-in: /calltool answers after `latency` seconds '''
+    from fastapi import FastAPI
+    app = FastAPI()
+
+    @app.post("/calltool")
+    async def calltool(request: dict):
+        await asyncio.sleep(latency)
+        return {"result": [{"type": "text", "text": request["tool_name"]}]}
+    return app
+
+def benchmark(calls=300, concurrency=10, latency=0.005):
+    ''' Tool-call latency with a new connection per call (requests.post) against the pooled async client '''
+    import socket, requests, uvicorn
+    from concurrent.futures import ThreadPoolExecutor
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(_stub_server(latency), host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    url = f"http://127.0.0.1:{port}"
+
+    def report(name, latencies, elapsed):
+        latencies.sort()
+        print(f"{name:>16}: p50 {latencies[len(latencies) // 2] * 1000:7.2f}ms  "
+              f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:7.2f}ms  {len(latencies) / elapsed:8.1f} calls/s")
+
+    def blocking_call(_):
+        start = time.perf_counter()
+        requests.post(f"{url}/calltool", json={"tool_name": "Data_API", "args": {}}).json()
+        return time.perf_counter() - start
+
+    print(f"{calls} calls, {concurrency} concurrent, stub latency {latency * 1000:.0f}ms")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        latencies = list(pool.map(blocking_call, range(calls)))
+    report("requests.post", latencies, time.perf_counter() - start)
+
+    async def pooled():
+        client = ToolClient(url)
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one(_):
+            async with semaphore:
+                start = time.perf_counter()
+                await client.call("Data_API", {})
+                return time.perf_counter() - start
+        await client.call("Data_API", {})  # warm the pool
+        start = time.perf_counter()
+        latencies = await asyncio.gather(*(one(i) for i in range(calls)))
+        report("pooled async", list(latencies), time.perf_counter() - start)
+
+        down = ToolClient("http://127.0.0.1:9", CircuitBreaker(failures=3, reset=60))
+        start = time.perf_counter()
+        for _ in range(10):
+            try:
+                await down.call("Sandbox_Executor", {})
+            except (ToolUnavailable, httpx.TransportError):
+                pass
+        print(f"{'server down':>16}: 10 calls failed in {(time.perf_counter() - start) * 1000:.1f}ms, "
+              f"breaker {down.breaker.state}")
+    asyncio.run(pooled())
+    server.should_exit = True
+
+if __name__ == "__main__":
+    benchmark()
@@ -1,35 +1,131 @@
+
 import os
+import threading
+import uuid
 from google.cloud import bigquery
 import logging
 from datetime import datetime
 import pandas as pd
+import numpy as np
 
 logging.basicConfig( level = logging.INFO)
 
 
 PROJECT = os.environ.get("PROJECT")
+MARKET_TABLE = "lucas_data.market_data"
+HTTP_POOL_SIZE = int(os.environ.get("BQ_HTTP_POOL_SIZE", "32"))
+
+# ------------ Client Registry ---------------
+# One long-lived client per project, shared by every request in the process.
+_clients = {}
+_read_clients = {}
+_clients_lock = threading.Lock()
+
+def _pooled_session(credentials):
+    ''' Authorized HTTP session with a connection pool sized for concurrent queries '''
+    import requests
+    from google.auth.transport.requests import AuthorizedSession
+
+    session = AuthorizedSession(credentials)
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=HTTP_POOL_SIZE,
+        pool_maxsize=HTTP_POOL_SIZE,
+        max_retries=3,
+    )
+    session.mount("https://", adapter)
+    return session
+
+def _build_client(project):
+    ''' Builds a BigQuery client (and Storage Read API client if installed) for the project '''
+    import google.auth
+
+    credentials, default_project = google.auth.default(scopes=bigquery.Client.SCOPE)
+    client = bigquery.Client(
+        project=project or default_project,
+        credentials=credentials,
+        _http=_pooled_session(credentials),
+    )
+    try:
+        from google.cloud import bigquery_storage
+        read_client = bigquery_storage.BigQueryReadClient(credentials=credentials)
+    except ImportError:
+        logging.warning("google-cloud-bigquery-storage not installed, Arrow reads fall back to REST")
+        read_client = None
+    return client, read_client
+
+def database_conn(project=None):
+    """Returns the shared BigQuery client for the project, creating it on first use"""
+    project = project or PROJECT
+    client = _clients.get(project)
+    if client is not None:
+        return client
+    with _clients_lock:
+        if project not in _clients:
+            logging.info(f"Creating BigQuery client for project {project}")
+            _clients[project], _read_clients[project] = _build_client(project)
+        return _clients[project]
+
+def read_client(project=None):
+    ''' Returns the shared Storage Read API client for the project (None if unavailable) '''
+    project = project or PROJECT
+    database_conn(project)
+    return _read_clients.get(project)
+
+def register_client(client, read_client=None, project=None):
+    '''
+    Registers a client for a project, replacing any existing one.
+    Used to point the data path at a local fake client during development and tests.
+    Args:
+        client: object exposing the bigquery.Client methods used here (query, load_table_from_dataframe)
+        read_client: optional Storage Read API client
+        project: project the client serves (defaults to PROJECT)
+    '''
+    project = project or PROJECT
+    with _clients_lock:
+        _clients[project] = client
+        _read_clients[project] = read_client
+
+def close_clients():
+    ''' Closes every registered client, called on process shutdown '''
+    with _clients_lock:
+        for client in _clients.values():
+            close = getattr(client, "close", None)
+            if close:
+                close()
+        _clients.clear()
+        _read_clients.clear()
+
+def _to_frame(table, as_arrow, owned=True):
+    ''' Converts an Arrow table to the requested output without extra copies '''
+    if as_arrow:
+        return table
+    # split_blocks + self_destruct let pandas take over the Arrow buffers column by column;
+    # slices share buffers with their parent, so they must not self destruct
+    return table.to_pandas(split_blocks=True, self_destruct=owned)
 
-def database_conn():
-    """Simple database connection helper"""
-    client = bigquery.Client(project = PROJECT)
-    return client
-        
-def fetch_from_db(ticker, interval, start_period, end_period):
-    """Check DB for cached results"""
+def fetch_from_db(ticker, interval, start_period, end_period, as_arrow=False):
+    """Check DB for cached results
+    Args:
+        ticker: Ticker symbol
+        interval: Timeframe of the bars
+        start_period: Start of the window
+        end_period: End of the window
+        as_arrow: return a pyarrow.Table instead of a pandas DataFrame
+    Returns:
+        DataFrame (or pyarrow.Table) of bars, None on failure
+    """
     try:
-        logging.info("Connecting to Database")
         conn = database_conn()
-        logging.info("Connected to Database")
 
-        query = """
+        query = f"""
             SELECT timestamp, open, high, low, close, volume
-            FROM `lucas_data.market_data`
+            FROM `{MARKET_TABLE}`
             WHERE ticker = @ticker
               AND timeframe = @timeframe
               AND timestamp BETWEEN @start_period AND @end_period
             ORDER BY timestamp ASC
         """
-        
+
         job_config = bigquery.QueryJobConfig(
                 use_legacy_sql=False,
                 query_parameters=[
@@ -39,9 +135,10 @@ def fetch_from_db(ticker, interval, start_period, end_period):
                     bigquery.ScalarQueryParameter("end_period", "STRING", end_period),
                     ]
                 )
-                
-        results = conn.query(query, job_config = job_config).to_dataframe()
-        
+
+        table = conn.query(query, job_config = job_config).to_arrow(bqstorage_client = read_client())
+        results = _to_frame(table, as_arrow)
+
         logging.info(f"Data From {ticker}, Rows: {len(results)} Retrived Successfully")
         return results
 
@@ -49,39 +146,131 @@ def fetch_from_db(ticker, interval, start_period, end_period):
         logging.error(f"Database fetch error: {e}")
         return None
 
+def fetch_many(requests, as_arrow=False):
+    '''
+    Fetches several (ticker, interval, start, end) windows in a single query.
+    Args:
+        requests: list of (ticker, interval, start_period, end_period) tuples
+        as_arrow: return pyarrow.Tables instead of pandas DataFrames
+    Returns:
+        dict mapping each request tuple to its bars, None on failure
+    '''
+    requests = list(dict.fromkeys(tuple(r) for r in requests))
+    if not requests:
+        return {}
+    try:
+        conn = database_conn()
+
+        # WITH OFFSET tags every row with the request it answers, so overlapping windows stay separate
+        query = f"""
+            SELECT req_idx, m.timestamp, m.open, m.high, m.low, m.close, m.volume
+            FROM `{MARKET_TABLE}` AS m
+            CROSS JOIN UNNEST(@requests) AS r WITH OFFSET AS req_idx
+            WHERE m.ticker = r.ticker
+              AND m.timeframe = r.timeframe
+              AND m.timestamp BETWEEN r.start_period AND r.end_period
+            ORDER BY req_idx, m.timestamp ASC
+        """
+        structs = [
+            bigquery.StructQueryParameter(
+                None,
+                bigquery.ScalarQueryParameter("ticker", "STRING", ticker),
+                bigquery.ScalarQueryParameter("timeframe", "STRING", interval),
+                bigquery.ScalarQueryParameter("start_period", "STRING", start_period),
+                bigquery.ScalarQueryParameter("end_period", "STRING", end_period),
+            )
+            for ticker, interval, start_period, end_period in requests
+        ]
+        job_config = bigquery.QueryJobConfig(
+                use_legacy_sql=False,
+                query_parameters=[bigquery.ArrayQueryParameter("requests", "STRUCT", structs)]
+                )
+
+        table = conn.query(query, job_config = job_config).to_arrow(bqstorage_client = read_client())
+
+        # Rows are ordered by req_idx, so each request is one contiguous zero-copy slice
+        idx = table.column("req_idx").to_numpy()
+        bounds = idx.searchsorted(np.arange(len(requests) + 1))
+        table = table.drop(["req_idx"])
+        results = {}
+        for i, request in enumerate(requests):
+            part = table.slice(bounds[i], bounds[i + 1] - bounds[i])
+            results[request] = _to_frame(part, as_arrow, owned=False)
+
+        logging.info(f"Batch fetch of {len(requests)} windows, Rows: {table.num_rows} Retrived Successfully")
+        return results
+
+    except Exception as e:
+        logging.error(f"Database batch fetch error: {e}")
+        return None
+
 def store_in_db(ticker, interval, dataframe):
-    """Store fresh data into BigQuery (supports multiple rows)"""
+    """Queue fresh data for BigQuery (supports multiple rows)
+
+    Rows are buffered by the market data writer, deduplicated on
+    (ticker, timeframe, timestamp) and merged into the table in batches.
+    The dataframe is not modified and must not be changed after the call.
+    Returns True once the rows are queued, False when there was nothing to queue or queueing failed.
+    """
     if dataframe is None or dataframe.empty:
         logging.warning(f"No data to insert for {ticker}")
-        return
+        return False
 
     try:
-        logging.info("Connecting to Database")
-        conn = database_conn()
-        logging.info("Connected to Database")
-
-        # Ensure column names match your BigQuery table
-        expected_columns = ["timestamp", "open", "high", "low", "close", "volume"]
-        missing = [col for col in expected_columns if col not in dataframe.columns]
-        if missing:
-            raise ValueError(f"Missing columns in dataframe: {missing}")
-
-        # Add ticker and interval columns to match schema
-        dataframe["ticker"] = ticker
-        dataframe["timeframe"] = interval
+        from market_writer import get_writer
+        get_writer().submit(ticker, interval, dataframe)
+        return True
+    except Exception as e:
+        logging.error(f"Failed to store data for {ticker}: {e}", exc_info=True)
+        return False
 
-        table_id = f"{PROJECT}.lucas_data.market_data"
+def merge_into_db(batch):
+    '''
+    Inserts a batch of bars into market_data, skipping bars the table already holds.
+    The batch is loaded into a per-batch staging table and MERGEd on (ticker, timeframe, timestamp),
+    so writing the same window twice is a no-op. The batch's tickers, timeframes and time range are
+    repeated as constant filters on the target, so BigQuery scans only those rows of market_data.
+    Args:
+        batch: DataFrame with timestamp, open, high, low, close, volume, ticker, timeframe columns
+    Returns:
+        number of rows in the batch
+    '''
+    conn = database_conn()
+    table_id = f"{PROJECT}.{MARKET_TABLE}"
+    staging_id = f"{table_id}_staging_{uuid.uuid4().hex[:12]}"
+    try:
         job = conn.load_table_from_dataframe(
-            dataframe,
-            table_id,
+            batch,
+            staging_id,
             job_config=bigquery.LoadJobConfig(
-                write_disposition="WRITE_APPEND"
+                write_disposition="WRITE_TRUNCATE"
             )
         )
-        job.result()  # Wait for the job to complete
-        logging.info(f"Inserted {len(dataframe)} rows for {ticker} ({interval}) into BigQuery.")
-
-    except Exception as e:
-        logging.error(f"Failed to store data for {ticker}: {e}", exc_info=True)
-
+        job.result()
 
+        query = f"""
+            MERGE `{table_id}` AS t
+            USING `{staging_id}` AS s
+            ON t.ticker = s.ticker
+              AND t.timeframe = s.timeframe
+              AND t.timestamp = s.timestamp
+              AND t.ticker IN UNNEST(@tickers)
+              AND t.timeframe IN UNNEST(@timeframes)
+              AND t.timestamp BETWEEN @start_period AND @end_period
+            WHEN NOT MATCHED THEN
+              INSERT (timestamp, open, high, low, close, volume, ticker, timeframe)
+              VALUES (s.timestamp, s.open, s.high, s.low, s.close, s.volume, s.ticker, s.timeframe)
+        """
+        job_config = bigquery.QueryJobConfig(
+            query_parameters=[
+                bigquery.ArrayQueryParameter("tickers", "STRING", sorted(batch["ticker"].unique())),
+                bigquery.ArrayQueryParameter("timeframes", "STRING", sorted(batch["timeframe"].unique())),
+                bigquery.ScalarQueryParameter("start_period", "TIMESTAMP", batch["timestamp"].min().to_pydatetime()),
+                bigquery.ScalarQueryParameter("end_period", "TIMESTAMP", batch["timestamp"].max().to_pydatetime()),
+            ]
+        )
+        conn.query(query, job_config=job_config).result()
+        logging.info(f"Merged batch of {len(batch)} rows into BigQuery.")
+        return len(batch)
+    finally:
+        conn.delete_table(staging_id, not_found_ok=True)
@@ -0,0 +1,264 @@
+
+import os
+import sys
+import json
+import uuid
+import asyncio
+import logging
+from sandbox_orchestrator import (
+    SCRIPT_TIMEOUT, SCRIPT_PROFILE, OBJECT_STORE_DIR, RESULT_TIMEOUT,
+    BATCH_WORKERS, BATCH_MAX_VARIANTS, result_timeout, trigger_run_job, cancel_run_job, wait_for_result, get_object_store,
+)
+from result_notifier import get_notifier
+from progress_stream import get_progress_reader
+
+logging.basicConfig(level=logging.INFO)
+
+# "cloudrun" dispatches Cloud Run Job executions, "pool" queues jobs for a warm cloud_runner pool
+# (RUNNER_MODE=pool), "local" runs cloud_runner/main.py as a subprocess
+SANDBOX_BACKEND = os.environ.get("SANDBOX_BACKEND", "cloudrun")
+LOCAL_RUNNER_PATH = os.environ.get(
+    "LOCAL_RUNNER_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "cloud_runner", "main.py"),
+)
+
+class JobHandle:
+    '''
+    A submitted sandbox run.
+    status moves through submitted -> running -> succeeded / failed / cancelled.
+    '''
+    def __init__(self, backend, code_gs, data_gs, result_gs, session_id=None, batch_gs=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.backend = backend
+        self.code_gs = code_gs
+        self.data_gs = data_gs
+        self.result_gs = result_gs
+        self.batch_gs = batch_gs
+        self.session_id = session_id
+        self.status = "submitted"
+        self.error = None
+        self._subscription = None
+        self._native = None  # backend object (operation / process)
+        self._result = None
+        self._waiter = None
+        self.timeout = RESULT_TIMEOUT  # result wait, set by submit from the job's limits
+
+    async def result(self, timeout=None):
+        ''' Waits for the run and returns the result JSON, by default for as long as the job may run '''
+        if timeout is None:
+            timeout = self.timeout
+        if self._result is not None:
+            return self._result
+        if self.status == "cancelled":
+            raise RuntimeError(f"Sandbox job {self.id} was cancelled")
+        self._waiter = asyncio.ensure_future(
+            wait_for_result(self.result_gs, timeout=timeout, subscription=self._subscription)
+        )
+        try:
+            result = await self._waiter
+        except asyncio.CancelledError:
+            if self.status == "cancelled":
+                raise RuntimeError(f"Sandbox job {self.id} was cancelled")
+            # The caller gave up on the run, stop paying for it
+            await self.cancel()
+            raise
+        except TimeoutError as e:
+            # Nobody will read a result that comes later, stop the run as the cancel path does
+            try:
+                await self.cancel()
+            except Exception as cancel_error:
+                logging.error(f"Failed to cancel timed out sandbox job {self.id}: {cancel_error}")
+            self.status = "failed"
+            self.error = str(e)
+            raise
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+            raise
+        finally:
+            await self._release()
+        self._result = result
+        self.status = "succeeded" if result.get("status") == "ok" else "failed"
+        return result
+
+    async def progress(self, block=1.0):
+        '''
+        Yields the runner's progress events (phase, progress, log, variant) as they are published,
+        until its end event; yields nothing when no progress channel is configured
+        '''
+        reader = get_progress_reader()
+        if reader is None:
+            return
+        cursor = None
+        while True:
+            finished = self.status in ("succeeded", "failed", "cancelled")
+            try:
+                events, cursor = await reader.read(self.result_gs, cursor, block)
+            except Exception as e:
+                logging.error(f"Failed to read progress of sandbox job {self.id}: {e}")
+                return
+            for event in events:
+                yield event
+                if event.get("type") == "end":
+                    return
+            # One last read after the run finished picks up anything still in flight
+            if finished:
+                return
+
+    async def cancel(self):
+        ''' Stops the run if it is still going '''
+        if self.status in ("succeeded", "failed", "cancelled"):
+            return
+        self.status = "cancelled"
+        if self._waiter is not None and not self._waiter.done():
+            self._waiter.cancel()
+        try:
+            await self.backend.cancel(self)
+        finally:
+            await self._release()
+        logging.info(f"Sandbox job {self.id} cancelled")
+
+    async def _release(self):
+        if self._subscription is not None:
+            subscription, self._subscription = self._subscription, None
+            await subscription.close()
+        _forget(self)
+
+# ------------ Backends ---------------
+
+class CloudRunBackend:
+    ''' Starts Cloud Run Job executions without awaiting the long-running operation '''
+    async def start(self, handle):
+        handle._native = await asyncio.to_thread(
+            trigger_run_job, handle.code_gs, handle.data_gs, handle.result_gs, handle.batch_gs
+        )
+        handle.status = "running"
+
+    async def cancel(self, handle):
+        if handle._native is not None:
+            await asyncio.to_thread(cancel_run_job, handle._native)
+
+class LocalSubprocessBackend:
+    '''
+    Runs cloud_runner/main.py in a subprocess against the local object store,
+    for development and testing without Cloud Run.
+    '''
+    def __init__(self, runner_path=LOCAL_RUNNER_PATH):
+        self.runner_path = runner_path
+
+    async def start(self, handle):
+        env = {
+            **os.environ,
+            "BUCKET": get_object_store().bucket_name,
+            "CODE_GS": handle.code_gs,
+            "DATA_GS": handle.data_gs,
+            "RESULT_GS": handle.result_gs,
+            "BATCH_GS": handle.batch_gs or "",
+            "SCRIPT_TIMEOUT": str(SCRIPT_TIMEOUT),
+            "BATCH_WORKERS": str(BATCH_WORKERS),
+            "BATCH_MAX_VARIANTS": str(BATCH_MAX_VARIANTS),
+            "SCRIPT_PROFILE": SCRIPT_PROFILE,
+            "OBJECT_STORE_DIR": OBJECT_STORE_DIR or "",
+        }
+        handle._native = await asyncio.create_subprocess_exec(
+            sys.executable, self.runner_path,
+            env=env,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        handle.status = "running"
+        asyncio.create_task(self._announce(handle))
+
+    async def _announce(self, handle):
+        ''' Publishes completion when the runner exits, as the Cloud Run runner does through Redis '''
+        await handle._native.wait()
+        await get_notifier().publish(handle.result_gs)
+
+    async def cancel(self, handle):
+        process = handle._native
+        if process is not None and process.returncode is None:
+            process.terminate()
+            try:
+                await asyncio.wait_for(process.wait(), 5)
+            except asyncio.TimeoutError:
+                process.kill()
+
+class QueueBackend:
+    ''' Pushes jobs onto the Redis list served by a long-lived cloud_runner pool '''
+    JOB_QUEUE = "sandbox:jobs"
+    CANCEL_PREFIX = "sandbox:cancel:"
+
+    def __init__(self, client=None):
+        from session_store import redis_client
+        self.client = client or redis_client
+
+    async def start(self, handle):
+        handle._native = json.dumps({
+            "code_gs": handle.code_gs,
+            "data_gs": handle.data_gs,
+            "result_gs": handle.result_gs,
+            "batch_gs": handle.batch_gs,
+        })
+        await self.client.lpush(self.JOB_QUEUE, handle._native)
+        handle.status = "running"
+
+    async def cancel(self, handle):
+        # Drop it if still queued, and flag it so a worker that already took it stops
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.lrem(self.JOB_QUEUE, 0, handle._native)
+            pipe.set(f"{self.CANCEL_PREFIX}{handle.result_gs}", "1", ex=handle.timeout)
+            await pipe.execute()
+
+def get_backend():
+    if SANDBOX_BACKEND == "local":
+        return LocalSubprocessBackend()
+    if SANDBOX_BACKEND == "pool":
+        return QueueBackend()
+    return CloudRunBackend()
+
+# ------------ Dispatch ---------------
+
+_active = {}  # job id -> handle, for status and session cancellation
+
+def _forget(handle):
+    _active.pop(handle.id, None)
+
+async def submit(code_gs, data_gs, result_gs, session_id=None, backend=None, batch_gs=None, variants=None):
+    '''
+    Starts a sandbox run and returns immediately
+    Args:
+        code_gs: gcs path of the strategy script
+        data_gs: gcs path of the dataset
+        result_gs: bucket path the runner writes its result JSON to
+        session_id: session the run belongs to, for cancellation
+        backend: executor backend, defaults to SANDBOX_BACKEND
+        batch_gs: gcs path of a batch manifest (parameter sweep / several scripts)
+        variants: number of variants in the batch manifest, sizes the result wait
+    Returns:
+        JobHandle
+    '''
+    handle = JobHandle(backend or get_backend(), code_gs, data_gs, result_gs, session_id, batch_gs)
+    handle.timeout = result_timeout(variants, queued=isinstance(handle.backend, QueueBackend))
+    # Subscribe before starting so the completion notice cannot be missed
+    handle._subscription = get_notifier().subscribe(result_gs)
+    await handle._subscription.start()
+    _active[handle.id] = handle
+    try:
+        await handle.backend.start(handle)
+    except Exception as e:
+        handle.status = "failed"
+        handle.error = str(e)
+        await handle._release()
+        raise
+    logging.info(f"Sandbox job {handle.id} submitted ({handle.backend.__class__.__name__})")
+    return handle
+
+def active_jobs(session_id=None):
+    ''' Running handles, optionally only those of one session '''
+    return [h for h in _active.values() if session_id is None or h.session_id == session_id]
+
+async def cancel_session_jobs(session_id):
+    ''' Cancels every run of an abandoned session, returns how many were cancelled '''
+    handles = active_jobs(session_id)
+    await asyncio.gather(*(h.cancel() for h in handles), return_exceptions=True)
+    return len(handles)
@@ -0,0 +1,272 @@
+
+import os
+import re
+import json
+import fcntl
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from range_cache import RangeIndex, to_utc
+
+logging.basicConfig(level=logging.INFO)
+
+LOCAL_STORE_DIR = os.environ.get("LOCAL_STORE_DIR", os.path.join(tempfile.gettempdir(), "lucas_store"))
+LOCAL_STORE_MAX_BYTES = int(os.environ.get("LOCAL_STORE_MAX_BYTES", str(2 * 1024 ** 3)))
+EMPTY_PARTITION = pa.schema([
+    ("timestamp", pa.timestamp("ns", tz="UTC")),
+    ("open", pa.float64()), ("high", pa.float64()), ("low", pa.float64()),
+    ("close", pa.float64()), ("volume", pa.float64()),
+])
+ROW_GROUP_SIZE = 4096  # small row groups keep timestamp pushdown selective
+ONE_NS = pd.Timedelta(1, "ns")
+LOCK_FILE = ".lock"
+
+def _safe(name):
+    return re.sub(r"[^\w\-.]", "_", name)
+
+def _atomic_write(path, write):
+    ''' Writes through a temp file in the same directory and renames it into place '''
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    os.close(fd)
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+@contextmanager
+def _flocked(path, blocking=True):
+    ''' Exclusive flock on path across the processes sharing the store, yields False when not blocking and taken '''
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        yield True
+    finally:
+        os.close(fd)  # closing the descriptor releases the lock
+
+class LocalParquetStore:
+    '''
+    On-disk columnar tier for market bars, partitioned as <root>/<ticker>/<timeframe>/<YYYY-MM>.parquet.
+    Each (ticker, timeframe) directory keeps a coverage.json of the spans it holds, partitions are read
+    memory mapped with timestamp filters pushed down, and the least recently used partitions are
+    evicted once the store grows past max_bytes.
+    Every (ticker, timeframe) has its own lock, so neither reads nor writes of one key wait on another.
+    The store is shared by the processes of the MCP pool: the key lock is also an flock on the key
+    directory, coverage.json is re-read under it on every read and write, and a partition that has
+    gone missing (evicted by another process) is a gap. Partition sizes and use order are tracked in
+    memory and re-synced from disk before evicting, so the size budget holds for the whole store.
+    '''
+    def __init__(self, root=LOCAL_STORE_DIR, max_bytes=LOCAL_STORE_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()  # guards the registries below, never held during IO
+        self._evict_lock = threading.Lock()
+        self._key_locks = {}
+        os.makedirs(root, exist_ok=True)
+        self._partitions = self._scan()  # path -> size, least recently used first
+        self._total = sum(self._partitions.values())
+        # Bytes this process wrote since the last sync; other processes' writes only show up on a rescan
+        self._unsynced = 0
+        self._sync_bytes = max(max_bytes // 64, 1)
+
+    def _scan(self):
+        ''' Partitions already on disk, ordered by mtime (the LRU clock across restarts) '''
+        found = []
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith(".parquet"):
+                    path = os.path.join(dirpath, name)
+                    stat = os.stat(path)
+                    found.append((stat.st_mtime, path, stat.st_size))
+        return OrderedDict((path, size) for _, path, size in sorted(found))
+
+    def _dir(self, ticker, interval):
+        return os.path.join(self.root, _safe(ticker), _safe(interval))
+
+    @contextmanager
+    def _key_lock(self, directory):
+        ''' Holds one <ticker>/<timeframe> directory against other threads and other processes '''
+        with self._lock:
+            lock = self._key_locks.setdefault(directory, threading.Lock())
+        with lock:
+            os.makedirs(directory, exist_ok=True)
+            with _flocked(os.path.join(directory, LOCK_FILE)):
+                yield
+
+    def _index(self, directory):
+        ''' Coverage of one <ticker>/<timeframe> directory, read from its coverage.json (call under the key lock) '''
+        index = RangeIndex()
+        path = os.path.join(directory, "coverage.json")
+        if os.path.exists(path):
+            with open(path) as f:
+                for start, end in json.load(f):
+                    index.add(pd.Timestamp(start), pd.Timestamp(end))
+        return index
+
+    def _save_index(self, directory, index):
+        spans = [[s.isoformat(), e.isoformat()] for s, e in index.spans()]
+        def write(tmp):
+            with open(tmp, "w") as f:
+                json.dump(spans, f)
+        _atomic_write(os.path.join(directory, "coverage.json"), write)
+
+    def _used(self, path, size=None):
+        ''' Moves a partition to the most recently used end, recording its new size when given '''
+        with self._lock:
+            if size is not None:
+                self._total += size - self._partitions.get(path, 0)
+                self._unsynced += max(size - self._partitions.get(path, 0), 0)
+                self._partitions[path] = size
+            if path in self._partitions:
+                self._partitions.move_to_end(path)
+
+    @staticmethod
+    def _months(start, end):
+        return pd.period_range(start.tz_localize(None), end.tz_localize(None), freq="M")
+
+    @staticmethod
+    def _month_span(month):
+        ''' Span to remove from coverage to forget every bar of a month partition '''
+        return month.start_time.tz_localize("UTC") - ONE_NS, (month + 1).start_time.tz_localize("UTC")
+
+    def read(self, ticker, interval, start_period, end_period):
+        '''
+        Reads the stored bars of a window.
+        Returns:
+            (DataFrame of stored bars, list of (start, end) spans the store does not hold)
+        '''
+        start, end = to_utc(start_period), to_utc(end_period)
+        directory = self._dir(ticker, interval)
+        with self._key_lock(directory):
+            index = self._index(directory)
+            paths = []
+            for month in self._months(start, end):
+                path = os.path.join(directory, f"{month}.parquet")
+                if os.path.exists(path):
+                    paths.append(path)
+                else:
+                    # Evicted, possibly by another process: fetch the month again
+                    index.remove(*self._month_span(month))
+            missing = index.missing(start, end)
+            if not index.covered(start, end):
+                return None, missing
+            tables = []
+            for path in paths:
+                table = pq.read_table(
+                    path,
+                    memory_map=True,
+                    filters=[("timestamp", ">=", start), ("timestamp", "<=", end)],
+                )
+                if table.num_rows:
+                    tables.append(table)
+                os.utime(path)  # mtime keeps the LRU order across restarts
+                self._used(path)
+        if not tables:
+            return None, missing
+        return pa.concat_tables(tables).to_pandas(split_blocks=True, self_destruct=True), missing
+
+    def write(self, ticker, interval, dataframe, spans):
+        '''
+        Stores bars and marks the spans they were fetched for as covered.
+        Args:
+            ticker: Ticker symbol
+            interval: Timeframe of the bars
+            dataframe: DataFrame with timestamp, open, high, low, close, volume columns (not modified)
+            spans: list of (start, end) the bars answer, empty spans included
+        '''
+        directory = self._dir(ticker, interval)
+        with self._key_lock(directory):
+            if dataframe is not None and not dataframe.empty:
+                frame = dataframe[["timestamp", "open", "high", "low", "close", "volume"]]
+                stamps = pd.to_datetime(frame["timestamp"], utc=True)
+                frame = frame.assign(timestamp=stamps)
+                for month, part in frame.groupby(stamps.dt.tz_localize(None).dt.to_period("M")):
+                    path = os.path.join(directory, f"{month}.parquet")
+                    stored = pq.read_table(path) if os.path.exists(path) else None
+                    if stored is not None and stored.num_rows:
+                        part = pd.concat([stored.to_pandas(), part], ignore_index=True)
+                    part = part.drop_duplicates(subset="timestamp", keep="last").sort_values("timestamp")
+                    table = pa.Table.from_pandas(part, preserve_index=False)
+                    _atomic_write(path, lambda tmp: pq.write_table(table, tmp, row_group_size=ROW_GROUP_SIZE))
+                    self._used(path, os.path.getsize(path))
+            # Coverage goes in only once every partition holding its bars is on disk; months the spans
+            # touch without bars get an empty partition, so a missing one always means evicted
+            index = self._index(directory)
+            for start, end in spans:
+                start, end = to_utc(start), to_utc(end)
+                for month in self._months(start, end):
+                    path = os.path.join(directory, f"{month}.parquet")
+                    if not os.path.exists(path):
+                        _atomic_write(path, lambda tmp: pq.write_table(EMPTY_PARTITION.empty_table(), tmp))
+                        self._used(path, os.path.getsize(path))
+                index.add(start, end)
+            self._save_index(directory, index)
+        if self._total > self.max_bytes or self._unsynced >= self._sync_bytes:
+            self._evict()
+
+    def _evict(self):
+        '''
+        Re-syncs partition sizes and use order with the disk, which holds every process's writes,
+        then deletes least recently used partitions until the store fits in max_bytes
+        '''
+        if not self._evict_lock.acquire(blocking=False):
+            return  # another writer is already evicting
+        try:
+            with _flocked(os.path.join(self.root, LOCK_FILE), blocking=False) as held:
+                if held:  # otherwise another process is evicting
+                    self._evict_locked()
+        finally:
+            self._evict_lock.release()
+
+    def _evict_locked(self):
+        partitions = self._scan()
+        with self._lock:
+            self._partitions = partitions
+            self._total = sum(partitions.values())
+            self._unsynced = 0
+        while True:
+            with self._lock:
+                if self._total <= self.max_bytes or not self._partitions:
+                    return
+                path, size = next(iter(self._partitions.items()))
+            directory, name = os.path.split(path)
+            with self._key_lock(directory):
+                with self._lock:
+                    if next(iter(self._partitions), None) != path:
+                        continue  # used since, look again
+                    size = self._partitions.pop(path)
+                    self._total -= size
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                # Forget the evicted month so the next read fetches it again
+                month = pd.Period(name[:-len(".parquet")], freq="M")
+                index = self._index(directory)
+                index.remove(*self._month_span(month))
+                self._save_index(directory, index)
+            logging.info(f"Evicted local partition {path} ({size} bytes)")
+
+_store = None
+_store_lock = threading.Lock()
+
+def get_local_store():
+    ''' Returns the process-wide local tier, None when disabled with LOCAL_STORE_MAX_BYTES=0 '''
+    global _store
+    if LOCAL_STORE_MAX_BYTES <= 0:
+        return None
+    with _store_lock:
+        if _store is None:
+            _store = LocalParquetStore()
+        return _store
@@ -0,0 +1,240 @@
+
+import os
+import time
+import atexit
+import logging
+import threading
+import numpy as np
+import pandas as pd
+
+logging.basicConfig(level=logging.INFO)
+
+BAR_COLUMNS = ["timestamp", "open", "high", "low", "close", "volume"]
+KEY_COLUMNS = ["ticker", "timeframe", "timestamp"]
+
+MAX_BATCH_ROWS = int(os.environ.get("WRITER_MAX_BATCH_ROWS", "50000"))
+FLUSH_INTERVAL = float(os.environ.get("WRITER_FLUSH_INTERVAL", "5"))
+MAX_RETRIES = int(os.environ.get("WRITER_MAX_RETRIES", "3"))
+
+_drop_listeners = []
+
+def on_dropped(listener):
+    '''
+    Registers listener(ticker, interval, start, end), called from the writer thread for every frame
+    given up on after MAX_RETRIES failed flushes, start/end being the frame's first and last bar
+    '''
+    _drop_listeners.append(listener)
+
+# ------------ Sinks ---------------
+
+class BigQuerySink:
+    ''' Writes batches into market_data through a staging table MERGE '''
+    def write(self, batch):
+        from db_conn import merge_into_db
+        return merge_into_db(batch)
+
+class LocalSink:
+    '''
+    In-memory stand-in for the market_data table, keyed on (ticker, timeframe, timestamp).
+    Used to benchmark the writer and check dedup offline.
+    '''
+    def __init__(self):
+        self.rows = {}
+        self.batches = 0
+
+    def write(self, batch):
+        keys = zip(batch["ticker"], batch["timeframe"], batch["timestamp"])
+        values = batch[BAR_COLUMNS[1:]].itertuples(index=False, name=None)
+        for key, value in zip(keys, values):
+            self.rows.setdefault(key, value)
+        self.batches += 1
+        return len(batch)
+
+# ------------ Writer ---------------
+
+class MarketDataWriter:
+    '''
+    Write-behind buffer for market bars.
+    Frames are queued by reference, coalesced across requests, deduplicated on
+    (ticker, timeframe, timestamp) and flushed by a background thread once the
+    buffer holds max_rows rows or flush_interval seconds have passed.
+    Until a flush succeeds, queued bars are served to readers through pending().
+    '''
+    def __init__(self, sink, max_rows=MAX_BATCH_ROWS, flush_interval=FLUSH_INTERVAL):
+        self.sink = sink
+        self.max_rows = max_rows
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._pending_rows = 0
+        self._flushing = []  # frames taken by the flush in progress
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self.metrics = {
+            "rows_submitted": 0,
+            "rows_written": 0,
+            "duplicates_dropped": 0,
+            "flushes": 0,
+            "failed_flushes": 0,
+            "last_flush_seconds": 0.0,
+        }
+        self._thread = threading.Thread(target=self._run, name="market-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, ticker, interval, dataframe):
+        '''
+        Queues bars for writing. The frame is neither copied nor modified.
+        Args:
+            ticker: Ticker symbol
+            interval: Timeframe of the bars
+            dataframe: DataFrame with timestamp, open, high, low, close, volume columns
+        '''
+        missing = [col for col in BAR_COLUMNS if col not in dataframe.columns]
+        if missing:
+            raise ValueError(f"Missing columns in dataframe: {missing}")
+        if dataframe.empty:
+            return
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Market data writer is closed")
+            self._pending.append((ticker, interval, dataframe, 0))
+            self._pending_rows += len(dataframe)
+            self.metrics["rows_submitted"] += len(dataframe)
+            if self._pending_rows >= self.max_rows:
+                self._cond.notify()
+
+    def pending(self, ticker, interval, start, end):
+        '''
+        Bars of a window that are queued or being flushed, not yet in the sink
+        Returns:
+            list of DataFrames
+        '''
+        with self._cond:
+            frames = [df for t, i, df, _ in (*self._flushing, *self._pending) if t == ticker and i == interval]
+        parts = []
+        for frame in frames:
+            stamps = pd.to_datetime(frame["timestamp"], utc=True)
+            part = frame[(stamps >= start) & (stamps <= end)]
+            if not part.empty:
+                parts.append(part[BAR_COLUMNS])
+        return parts
+
+    def _build_batch(self, pending):
+        ''' Concatenates queued frames into one deduplicated batch '''
+        frames = [df[BAR_COLUMNS] for _, _, df, _ in pending]
+        lengths = [len(df) for df in frames]
+        batch = pd.concat(frames, ignore_index=True)
+        batch["timestamp"] = pd.to_datetime(batch["timestamp"], utc=True)
+        batch["ticker"] = np.repeat([p[0] for p in pending], lengths)
+        batch["timeframe"] = np.repeat([p[1] for p in pending], lengths)
+        deduped = batch.drop_duplicates(subset=KEY_COLUMNS, keep="last", ignore_index=True)
+        self.metrics["duplicates_dropped"] += len(batch) - len(deduped)
+        return deduped
+
+    def flush(self):
+        ''' Writes everything queued so far, returns the number of rows handed to the sink '''
+        with self._flush_lock:
+            with self._cond:
+                pending, self._pending, self._pending_rows = self._pending, [], 0
+                self._flushing = pending
+            if not pending:
+                return 0
+            start = time.perf_counter()
+            try:
+                batch = self._build_batch(pending)
+                written = self.sink.write(batch)
+            except Exception as e:
+                self.metrics["failed_flushes"] += 1
+                logging.error(f"Market data flush failed: {e}", exc_info=True)
+                retry = [(t, i, df, n + 1) for t, i, df, n in pending if n + 1 < MAX_RETRIES]
+                with self._cond:
+                    self._pending[:0] = retry
+                    self._pending_rows += sum(len(p[2]) for p in retry)
+                    self._flushing = []
+                if len(retry) < len(pending):
+                    logging.error(f"Dropping {len(pending) - len(retry)} frames after {MAX_RETRIES} failed flushes")
+                    self._dropped([p for p in pending if p[3] + 1 >= MAX_RETRIES])
+                return 0
+            with self._cond:
+                self._flushing = []
+            self.metrics["flushes"] += 1
+            self.metrics["rows_written"] += written
+            self.metrics["last_flush_seconds"] = time.perf_counter() - start
+            logging.info(f"Flushed {written} market rows in {self.metrics['last_flush_seconds']:.3f}s")
+            return written
+
+    def _dropped(self, frames):
+        ''' Tells the listeners which bars will never reach the sink '''
+        for ticker, interval, df, _ in frames:
+            stamps = pd.to_datetime(df["timestamp"], utc=True)
+            for listener in _drop_listeners:
+                try:
+                    listener(ticker, interval, stamps.min(), stamps.max())
+                except Exception as e:
+                    logging.error(f"Market data drop listener failed: {e}", exc_info=True)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._closed and self._pending_rows < self.max_rows:
+                    self._cond.wait(self.flush_interval)
+                closed = self._closed
+            self.flush()
+            if closed:
+                return
+
+    def close(self):
+        ''' Flushes the remaining rows and stops the background thread '''
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+_writer = None
+_writer_lock = threading.Lock()
+
+def get_writer():
+    ''' Returns the process-wide writer backed by BigQuery '''
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = MarketDataWriter(BigQuerySink())
+            atexit.register(_writer.close)
+        return _writer
+
+def pending_bars(ticker, interval, start, end):
+    ''' Bars of a window queued in the process-wide writer, without starting one '''
+    with _writer_lock:
+        writer = _writer
+    return writer.pending(ticker, interval, start, end) if writer is not None else []
+
+if __name__ == "__main__":
+    # Offline benchmark: overlapping windows for a few tickers into the local sink
+    sink = LocalSink()
+    writer = MarketDataWriter(sink, max_rows=100_000, flush_interval=0.5)
+    bars, windows = 5_000, 200
+    stamps = pd.date_range("2024-01-01", periods=bars * 2, freq="h", tz="UTC")
+    rng = np.random.default_rng(0)
+    frames = []
+    for w in range(windows):
+        offset = rng.integers(0, bars)
+        prices = rng.random(bars)
+        frames.append((f"T{w % 4}", "1h", pd.DataFrame({
+            "timestamp": stamps[offset:offset + bars],
+            "open": prices, "high": prices, "low": prices, "close": prices, "volume": prices,
+        })))
+
+    start = time.perf_counter()
+    for ticker, interval, df in frames:
+        writer.submit(ticker, interval, df)
+    writer.close()
+    elapsed = time.perf_counter() - start
+
+    expected = {(t, i, ts) for t, i, df in frames for ts in pd.to_datetime(df["timestamp"], utc=True)}
+    print(f"Submitted {writer.metrics['rows_submitted']} rows in {elapsed:.2f}s "
+          f"({writer.metrics['rows_submitted'] / elapsed:,.0f} rows/sec)")
+    print(f"Sink rows: {len(sink.rows)}, unique bars: {len(expected)}, "
+          f"duplicates dropped in batches: {writer.metrics['duplicates_dropped']}, flushes: {writer.metrics['flushes']}")
+    assert set(sink.rows) == expected
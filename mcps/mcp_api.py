@@ -1,24 +1,61 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Request
+from fastapi.responses import Response, StreamingResponse
 from pydantic import BaseModel
-from mcp_client import MCPProcess
-import logging, os
+from mcp_client import MCPProcessPool
+from collections import OrderedDict
+import logging, os, json, asyncio
 
 # FastAPI app
 app = FastAPI(title="Lucas MCP SERVER")
 
-# Global MCP process instance
-mcp_process: MCPProcess | None = None
+# Global pool of MCP server processes, tool calls are spread over its children
+mcp_process: MCPProcessPool | None = None
 
 
 class ToolRequest(BaseModel):
     tool_name: str
     args: dict
+    progress_id: str | None = None  # chat session the progress is published under, args' session_id if unset
+
+# ------------ Tool Progress ---------------
+# Progress notifications of running tools (sandbox runs) per chat session, streamed by GET /progress/{session_id}.
+# Every subscriber of a session gets its own bounded queue that drops its oldest events; events published
+# while nobody listens wait in a backlog for the next subscriber. Only the most recent sessions are kept.
+PROGRESS_BUFFER = int(os.getenv("PROGRESS_BUFFER", "200"))
+PROGRESS_SESSIONS = int(os.getenv("PROGRESS_SESSIONS", "1000"))
+PROGRESS_HEARTBEAT = float(os.getenv("PROGRESS_HEARTBEAT", "15"))
+_progress: OrderedDict[str, dict] = OrderedDict()  # session -> {"subscribers": set of queues, "backlog": queue}
+
+def progress_channel(session_id: str) -> dict:
+    channel = _progress.get(session_id)
+    if channel is None:
+        channel = _progress[session_id] = {"subscribers": set(), "backlog": asyncio.Queue(maxsize=PROGRESS_BUFFER)}
+        while len(_progress) > PROGRESS_SESSIONS:
+            _progress.popitem(last=False)
+    _progress.move_to_end(session_id)
+    return channel
+
+def _offer(queue: asyncio.Queue, event):
+    if queue.full():
+        queue.get_nowait()
+    queue.put_nowait(event)
+
+def progress_callback(session_id: str):
+    async def callback(progress: float, total: float | None, message: str | None):
+        try:
+            event = json.loads(message) if message else {"progress": progress, "total": total}
+        except ValueError:
+            event = {"progress": progress, "total": total, "message": message}
+        channel = progress_channel(session_id)
+        for queue in channel["subscribers"] or (channel["backlog"],):
+            _offer(queue, event)
+    return callback
 
 @app.on_event("startup")
 async def startup_event():
     global mcp_process
     if mcp_process is None:
-        mcp_process = MCPProcess("mcp_engine.py")
+        mcp_process = MCPProcessPool("mcp_engine.py")
     try:
         await mcp_process.start()
     except Exception as e:
@@ -27,29 +64,66 @@ async def startup_event():
 
 
 @app.get("/toolslist")
-async def list_tools():
-    if not mcp_process or not mcp_process.session:
-        raise HTTPException(status_code=400, detail="MCP server not running")
+async def list_tools(if_none_match: str | None = Header(None)):
+    ''' Tool catalog served from memory, with an ETag so unchanged catalogs cost a 304 '''
+    if not mcp_process or not mcp_process.running:
+        raise HTTPException(status_code=503, detail="MCP server not running")
     try:
-        tools = await mcp_process.list_tools()
-        logging.info(f" MCP Tools: {tools}")
-        return {"tools": tools}
+        catalog = await mcp_process.tool_catalog()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+    headers = {"ETag": catalog["etag"], "Cache-Control": "no-cache"}
+    if if_none_match and {"*", catalog["etag"]} & {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}:
+        return Response(status_code=304, headers=headers)
+    return Response(content=catalog["body"], media_type="application/json", headers=headers)
 
 
 @app.post("/calltool")
 async def call_tool(request: ToolRequest):
-    if not mcp_process or not mcp_process.session:
-        raise HTTPException(status_code=400, detail="MCP server not running")
+    if not mcp_process or not mcp_process.running:
+        raise HTTPException(status_code=503, detail="MCP server not running")
     try:
-        result = await mcp_process.call_tool(request.tool_name, request.args)
+        progress_id = request.progress_id or request.args.get("session_id")
+        callback = progress_callback(progress_id) if progress_id else None
+        result = await mcp_process.call_tool(request.tool_name, request.args, progress_callback=callback)
         logging.info(f"Called Tool Response: {result}")
         return {"result": result}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/metrics")
+async def pool_metrics():
+    ''' Queue depth, calls in flight and restarts of the MCP server pool '''
+    if not mcp_process:
+        raise HTTPException(status_code=503, detail="MCP server not running")
+    return mcp_process.metrics()
+
+
+@app.get("/progress/{session_id}")
+async def tool_progress(session_id: str, request: Request):
+    ''' Server-sent events of the session's running tools, with a comment line as heartbeat '''
+    channel = progress_channel(session_id)
+    queue = asyncio.Queue(maxsize=PROGRESS_BUFFER)
+    while not channel["backlog"].empty():
+        queue.put_nowait(channel["backlog"].get_nowait())
+    channel["subscribers"].add(queue)
+
+    async def event_stream():
+        try:
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), PROGRESS_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"data: {json.dumps(event)}\n\n"
+        finally:
+            channel["subscribers"].discard(queue)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+
 @app.on_event("shutdown")
 async def stop_server():
     global mcp_process
@@ -1,10 +1,14 @@
 import asyncio
 import subprocess
 import sys
+import time
+import json
+import hashlib
 import logging
+from collections import OrderedDict
 from contextlib import AsyncExitStack
 
-from mcp import ClientSession, StdioServerParameters
+from mcp import ClientSession, StdioServerParameters, types
 from mcp.client.stdio import stdio_client
 import os
 
@@ -12,36 +16,89 @@ logging.basicConfig(level=logging.INFO)
 
 env_vars = os.environ.copy()
 
+MCP_WORKERS = int(os.getenv("MCP_WORKERS", "4"))
+MCP_WORKER_CONCURRENCY = int(os.getenv("MCP_WORKER_CONCURRENCY", "8"))  # calls in flight per child before queueing
+MCP_QUEUE_TIMEOUT = float(os.getenv("MCP_QUEUE_TIMEOUT", "30"))  # longest wait for a free worker
+MCP_HEALTH_INTERVAL = float(os.getenv("MCP_HEALTH_INTERVAL", "10"))
+MCP_HEALTH_TIMEOUT = float(os.getenv("MCP_HEALTH_TIMEOUT", "5"))
+MCP_HEALTH_FAILURES = int(os.getenv("MCP_HEALTH_FAILURES", "3"))  # missed pings before a child is restarted
+MCP_AFFINITY_SESSIONS = int(os.getenv("MCP_AFFINITY_SESSIONS", "10000"))
+
 class MCPProcess:
-    def __init__(self, server_path: str):
+    def __init__(self, server_path: str, on_tools_changed=None):
         self.server_path = server_path
+        self.on_tools_changed = on_tools_changed  # called when the server announces a new tool list
         self.session: ClientSession | None = None
-        self.process = None
-        self.exit_stack = AsyncExitStack()
+        self.exit_stack: AsyncExitStack | None = None
+        self.in_flight = 0
+        self.calls = 0
+        self.errors = 0
+        self.failed_pings = 0
+        self.restarts = 0
+        self._task: asyncio.Task | None = None
+        self._stopping: asyncio.Event | None = None
 
-    async def start(self):
-        """Start the MCP server process and connect the client."""
+    async def _run(self, ready: asyncio.Event):
+        # stdio_client's task group must be entered and left by the same task, so one task owns
+        # the child for its whole life and stop() only asks it to leave
         try:
-            logging.info(f"Starting MCP server: {self.server_path}")
-
             server_params = StdioServerParameters(
                 command=sys.executable,  # use current python
                 args=[self.server_path],
                 env=env_vars
             )
+            async with AsyncExitStack() as self.exit_stack:
+                self.stdio, self.write = await self.exit_stack.enter_async_context(stdio_client(server_params))
+                session = await self.exit_stack.enter_async_context(
+                    ClientSession(self.stdio, self.write, message_handler=self._on_message)
+                )
+                await session.initialize()
+                self.session = session
+                ready.set()
+                await self._stopping.wait()
+        finally:
+            # Leaving the stack closes the pipes and terminates the child
+            self.session = None
+            self.exit_stack = None
+            ready.set()
 
-            stdio = await self.exit_stack.enter_async_context(stdio_client(server_params))
-            self.stdio, self.write = stdio
-            self.session = await self.exit_stack.enter_async_context(
-                ClientSession(self.stdio, self.write)
-            )
+    async def _on_message(self, message):
+        if (isinstance(message, types.ServerNotification)
+                and isinstance(message.root, types.ToolListChangedNotification) and self.on_tools_changed):
+            logging.info(f"MCP server {self.server_path} changed its tool list")
+            self.on_tools_changed()
 
-            await self.session.initialize()
+    async def start(self):
+        """Start the MCP server process and connect the client."""
+        try:
+            logging.info(f"Starting MCP server: {self.server_path}")
+            self._stopping = asyncio.Event()
+            ready = asyncio.Event()
+            self._task = asyncio.create_task(self._run(ready))
+            await ready.wait()
+            if self.session is None:
+                await self._task  # re-raises why it failed
+                raise RuntimeError("MCP server exited during initialization")
+            self.failed_pings = 0
             logging.info("MCP server started and client session initialized")
         except Exception as e:
             logging.error(f"An Error Occurred While Starting Server Process {e}")
             raise
 
+    @property
+    def running(self):
+        return self.session is not None and self._task is not None and not self._task.done()
+
+    async def ping(self, timeout=MCP_HEALTH_TIMEOUT):
+        """True if the server answered a ping within timeout."""
+        if not self.running:
+            return False
+        try:
+            await asyncio.wait_for(self.session.send_ping(), timeout)
+            return True
+        except Exception:
+            return False
+
     async def list_tools(self):
         """Get available tools from the server."""
         try:
@@ -51,22 +108,268 @@ class MCPProcess:
             logging.error(f" An Error Occurred While Getting available tools {e}")
             raise
 
-    async def call_tool(self, tool_name: str, args: dict):
-        """Call a tool on the server."""
+    async def call_tool(self, tool_name: str, args: dict, progress_callback=None):
+        """Call a tool on the server, progress_callback receives its progress notifications."""
+        self.calls += 1
         try:
-            result = await self.session.call_tool(tool_name, args)
+            result = await self.session.call_tool(tool_name, args, progress_callback=progress_callback)
             return result.content
         except Exception as e:
+            self.errors += 1
             logging.error(f" An Error Occurred While Calling Tool {e}")
             raise
 
     async def stop(self):
         """Stop the MCP server process."""
         try:
-            if self.process:
-                self.process.terminate()
-                await self.process.wait()
+            if self._task is not None:
+                self._stopping.set()
+                try:
+                    await self._task
+                except Exception as e:
+                    logging.error(f"MCP server {self.server_path} ended with an error: {e}")
+                self._task = None
             logging.info("MCP server stopped")
         except Exception as e:
             logging.error(f"An Error Occurred While Stopping Server {e}")
 
+    async def restart(self):
+        await self.stop()
+        self.restarts += 1
+        await self.start()
+
+class MCPProcessPool:
+    '''
+    N MCP server children behind one interface, so a slow tool call only occupies one of them.
+    Calls go to the least-loaded running child, up to MCP_WORKER_CONCURRENCY each, and queue when all
+    are full. A session is pinned to the child that served it while that child runs, and its calls
+    wait for room there rather than spill over: sandbox job handles (Sandbox_Cancel), in-flight
+    Data_API coalescing and the in-memory session backend all live in one process.
+    The market data caches are per child too (range_cache coverage indexes, the MarketDataWriter
+    write-behind buffer); only the local Parquet tier is shared, under file locks, so a child sees
+    another's fetch through it. With the tier disabled a child reads the table, which lags the other
+    children's unflushed writes, and may fetch those bars from the vendor again.
+    A background task pings every child and restarts those that crashed or stopped answering.
+    '''
+    def __init__(self, server_path: str, size: int = MCP_WORKERS, concurrency: int = MCP_WORKER_CONCURRENCY):
+        self.workers = [MCPProcess(server_path, on_tools_changed=self._tools_changed) for _ in range(max(1, size))]
+        self.concurrency = concurrency
+        self.waiting = 0
+        self.max_waiting = 0
+        self._available = asyncio.Condition()
+        self._affinity: OrderedDict[str, MCPProcess] = OrderedDict()
+        self._health_task: asyncio.Task | None = None
+        self._wait_seconds = 0.0
+        self._dispatched = 0
+        self._catalog: dict | None = None  # {"etag", "body", "count"}
+        self._catalog_lock = asyncio.Lock()
+
+    async def start(self):
+        """Start every child; the pool runs as long as at least one of them does."""
+        results = await asyncio.gather(*(worker.start() for worker in self.workers), return_exceptions=True)
+        started = sum(not isinstance(result, Exception) for result in results)
+        if not started:
+            raise RuntimeError(f"No MCP server started: {results[0]}")
+        logging.info(f"MCP pool started {started}/{len(self.workers)} servers")
+        try:
+            self._health_task = asyncio.create_task(self._health_loop())
+            await self.tool_catalog()
+        except BaseException:
+            # Do not leave the started children running behind a pool nobody will use
+            await self.stop()
+            raise
+
+    @property
+    def running(self):
+        return any(worker.running for worker in self.workers)
+
+    def _free_worker(self, session_id=None):
+        sticky = self._affinity.get(session_id) if session_id else None
+        if sticky is not None and sticky.running:
+            return sticky if sticky.in_flight < self.concurrency else None
+        candidates = [w for w in self.workers if w.running and w.in_flight < self.concurrency]
+        return min(candidates, key=lambda w: w.in_flight) if candidates else None
+
+    async def _acquire(self, session_id=None):
+        start = time.perf_counter()
+        async with self._available:
+            worker = self._free_worker(session_id)
+            if worker is None:
+                # Every child is at capacity: queue until a call finishes or a child restarts
+                self.waiting += 1
+                self.max_waiting = max(self.max_waiting, self.waiting)
+                try:
+                    deadline = time.monotonic() + MCP_QUEUE_TIMEOUT
+                    while (worker := self._free_worker(session_id)) is None:
+                        if not self.running:
+                            raise RuntimeError("MCP server not running")
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise TimeoutError(f"No MCP server free after {MCP_QUEUE_TIMEOUT:.0f}s")
+                        try:
+                            await asyncio.wait_for(self._available.wait(), remaining)
+                        except asyncio.TimeoutError:
+                            pass
+                finally:
+                    self.waiting -= 1
+            worker.in_flight += 1
+        self._wait_seconds += time.perf_counter() - start
+        self._dispatched += 1
+        if session_id:
+            self._affinity[session_id] = worker
+            self._affinity.move_to_end(session_id)
+            while len(self._affinity) > MCP_AFFINITY_SESSIONS:
+                self._affinity.popitem(last=False)
+        return worker
+
+    async def _release(self, worker):
+        async with self._available:
+            worker.in_flight -= 1
+            # Waiters may be pinned to different children, wake them all to recheck theirs
+            self._available.notify_all()
+
+    async def list_tools(self):
+        worker = await self._acquire()
+        try:
+            return await worker.list_tools()
+        finally:
+            await self._release(worker)
+
+    def _tools_changed(self):
+        # Rebuilt on the next request rather than here, inside the session's message loop
+        self._catalog = None
+
+    async def tool_catalog(self):
+        '''
+        The tool list, fetched once and then served from memory until a server announces a change
+        Returns:
+            {"etag": quoted version hash, "body": JSON bytes of {"tools", "version"}, "count": number of tools}
+        '''
+        catalog = self._catalog
+        if catalog is not None:
+            return catalog
+        async with self._catalog_lock:
+            if self._catalog is None:
+                tools = [tool.model_dump(mode="json") for tool in await self.list_tools()]
+                version = hashlib.sha256(json.dumps(tools, sort_keys=True).encode()).hexdigest()[:16]
+                self._catalog = {
+                    "etag": f'"{version}"',
+                    "body": json.dumps({"tools": tools, "version": version}).encode(),
+                    "count": len(tools),
+                }
+                logging.info(f"Tool catalog loaded: {len(tools)} tools, version {version}")
+            return self._catalog
+
+    async def call_tool(self, tool_name: str, args: dict, progress_callback=None):
+        worker = await self._acquire(args.get("session_id"))
+        try:
+            return await worker.call_tool(tool_name, args, progress_callback=progress_callback)
+        finally:
+            await self._release(worker)
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(MCP_HEALTH_INTERVAL)
+            for worker in self.workers:
+                if await worker.ping():
+                    worker.failed_pings = 0
+                    continue
+                worker.failed_pings += 1
+                # A child whose session ended is replaced at once, a busy one gets a few intervals to answer
+                if worker.running and worker.failed_pings < MCP_HEALTH_FAILURES:
+                    continue
+                logging.warning(f"MCP server {self.workers.index(worker)} is not responding, restarting it")
+                try:
+                    await worker.restart()
+                except Exception as e:
+                    logging.error(f"MCP server {self.workers.index(worker)} failed to restart: {e}")
+                async with self._available:
+                    self._available.notify_all()
+
+    def metrics(self):
+        """Queue depth and per-child load, restarts and errors."""
+        return {
+            "workers": len(self.workers),
+            "running": sum(worker.running for worker in self.workers),
+            "in_flight": sum(worker.in_flight for worker in self.workers),
+            "queue_depth": self.waiting,
+            "max_queue_depth": self.max_waiting,
+            "dispatched": self._dispatched,
+            "mean_wait_ms": round(self._wait_seconds / max(self._dispatched, 1) * 1000, 3),
+            "tool_catalog": self._catalog["etag"] if self._catalog else None,
+            "per_worker": [
+                {"running": w.running, "in_flight": w.in_flight, "calls": w.calls, "errors": w.errors,
+                 "restarts": w.restarts, "failed_pings": w.failed_pings}
+                for w in self.workers
+            ],
+        }
+
+    async def stop(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        await asyncio.gather(*(worker.stop() for worker in self.workers))
+        async with self._available:
+            self._available.notify_all()
+
+# ------------ Benchmark ---------------
+
+STUB_SERVER = '''
+import asyncio, time
+from mcp.server.fastmcp import FastMCP
+mcp = FastMCP("stub")
+
+@mcp.tool()
+async def fetch(seconds: float) -> str:
+    """I/O bound call, e.g. a data vendor request"""
+    await asyncio.sleep(seconds)
+    return "ok"
+
+@mcp.tool()
+def crunch(seconds: float) -> str:
+    """CPU bound call that holds the server's event loop, e.g. a synchronous backtest"""
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+    return "ok"
+
+if __name__ == "__main__":
+    mcp.run(transport="stdio")
+'''
+
+async def _bench(client, calls, concurrency, tool, seconds):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i):
+        async with semaphore:
+            start = time.perf_counter()
+            await client.call_tool(tool, {"seconds": seconds, "session_id": f"s{i}"})
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(calls)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return latencies[len(latencies) // 2] * 1000, latencies[int(len(latencies) * 0.99)] * 1000, calls / elapsed
+
+async def benchmark(calls=200, concurrency=32, workers=MCP_WORKERS):
+    ''' Concurrent tool calls through one MCP child against a pool of them, on a stub server '''
+    import tempfile
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "stub_server.py")
+        with open(path, "w") as f:
+            f.write(STUB_SERVER)
+        print(f"{calls} calls, {concurrency} concurrent, pool of {workers}")
+        for tool, seconds in (("fetch", 0.05), ("crunch", 0.01)):
+            for name, client in (("single", MCPProcess(path)), ("pool", MCPProcessPool(path, workers))):
+                await client.start()
+                try:
+                    p50, p99, rate = await _bench(client, calls, concurrency, tool, seconds)
+                    depth = f"  max queue {client.metrics()['max_queue_depth']}" if name == "pool" else ""
+                    print(f"{tool:>7} {name:>7}: p50 {p50:8.1f}ms  p99 {p99:8.1f}ms  {rate:8.1f} calls/s{depth}")
+                finally:
+                    await client.stop()
+
+if __name__ == "__main__":
+    asyncio.run(benchmark())
@@ -8,16 +8,76 @@ logging.basicConfig(
     format="%(asctime)s [%(levelname)s] %(message)s"
 )
 
+import json
+import asyncio
+from contextlib import asynccontextmanager
 from mcp.server.fastmcp import FastMCP, Context
 from mcp.server.session import ServerSession
 from data_tool import get_data
-from sandbox_tool import sandbox_executor
-from session_store import redis_test, get_redis_client, save_session, get_session_data, redis_client
+from sandbox_tool import sandbox_executor, sandbox_batch_executor, upload_dataset
+from job_dispatch import cancel_session_jobs
+from session_store import redis_test, get_redis_client, save_session, get_session, update_dataset, save_script, save_result, redis_client
+from singleflight import SingleFlight
+from range_cache import to_utc
+from result_cache import RESULT_CACHE_METRICS, RUNNER_VERSION
+from sandbox_orchestrator import upload_metrics
 
-mcp = FastMCP("LucasAI Server")
+@asynccontextmanager
+async def lifespan(server):
+    # testing Redis Server
+    await redis_test()
+    yield
 
-# testing Redis Server
-test = redis_test()
+mcp = FastMCP("LucasAI Server", lifespan=lifespan)
+
+# Identical concurrent Data_API requests (several users, or both builders of a session) share one fetch,
+# and run one after the other across the pool's processes so the later ones read the earlier one's bars
+# from the shared local tier (range indexes and the write buffer are per process, see MCPProcessPool)
+data_flight = SingleFlight("Data_API", cross_process=True)
+_data_contexts = {}  # data key -> contexts of the callers waiting on that fetch
+
+class FanOutContext:
+    '''
+    Context handed to a coalesced fetch: progress and log messages go to every caller currently
+    waiting on it (joiners included), anything else to the first of them
+    '''
+    def __init__(self, key, ctx):
+        self.key = key
+        self.ctx = ctx
+
+    def _contexts(self):
+        return list(_data_contexts.get(self.key, ())) or [self.ctx]
+
+    def _fan_out(self, name):
+        async def send(*args, **kwargs):
+            await asyncio.gather(*(getattr(c, name)(*args, **kwargs) for c in self._contexts()), return_exceptions=True)
+        return send
+
+    def __getattr__(self, name):
+        if name in ("report_progress", "log", "debug", "info", "warning", "error"):
+            return self._fan_out(name)
+        return getattr(self.ctx, name)
+
+def data_key(ticker, interval, start_period, end_period):
+    ''' Normalized identity of a data request, so "msft"/"MSFT" and equivalent date formats coalesce '''
+    def moment(value):
+        try:
+            return to_utc(value).isoformat()
+        except (ValueError, TypeError):
+            return str(value).strip()
+    return (ticker.strip().upper(), interval.strip().lower(), moment(start_period), moment(end_period))
+
+def progress_forwarder(ctx):
+    '''
+    Forwards the sandbox runner's events to the MCP client as progress notifications.
+    Progress counts the events (it must only increase), the message carries the event itself as JSON.
+    '''
+    forwarded = 0
+    async def forward(event):
+        nonlocal forwarded
+        forwarded += 1
+        await ctx.report_progress(progress=forwarded, message=json.dumps(event, default=str))
+    return forward
 
 # ----------- MCP Tools --------------------
 
@@ -40,32 +100,121 @@ async def data_loader(ticker: str,
     Returns:
         str: JSON string of price data (preview)
     '''
-    preview, datapath = await get_data(ticker, start_period, end_period, interval, ctx)
+    key = data_key(ticker, interval, start_period, end_period)
+    contexts = _data_contexts.setdefault(key, [])
+    contexts.append(ctx)
+    try:
+        preview, datapath = await data_flight.do(key, get_data, ticker, start_period, end_period, interval,
+                                                 FanOutContext(key, ctx))
+    finally:
+        contexts.remove(ctx)
+        if not contexts and _data_contexts.get(key) is contexts:
+            del _data_contexts[key]
 
     # Store in Redis
-    await save_session(session_id, datapath)
+    dataset_key = f"{ticker}|{interval}|{start_period}|{end_period}"
+    await save_session(session_id, datapath, dataset_key=dataset_key)
     
     logger.info(f"Preview:{preview}_Session ID:{session_id}_Datapath:{datapath}")
     return preview
 
+@mcp.resource("metrics://data_api")
+def data_api_metrics() -> str:
+    ''' Coalescing counters of Data_API and the requests in flight with their waiter counts '''
+    return json.dumps(data_flight.snapshot())
+
+@mcp.resource("metrics://result_cache")
+def result_cache_metrics() -> str:
+    ''' Hits, misses and stores of the backtest result cache in this process '''
+    return json.dumps({**RESULT_CACHE_METRICS, "runner_version": RUNNER_VERSION})
+
+@mcp.resource("metrics://uploads")
+def uploads_metrics() -> str:
+    ''' Sandbox uploads made and skipped, with the bytes deduplication saved, in this process '''
+    return json.dumps(upload_metrics())
+
 @mcp.tool("Sandbox_Executor", description = "Execute Strategy Script in Sandbox Environment")
-async def sandbox_runner(local_script_path:str, strategy_name:str, session_id: str):
+async def sandbox_runner(local_script_path:str, strategy_name:str, session_id: str,
+    ctx: Context[ServerSession, None]):
     '''
     Runs Generate Strategy Script in Google Cloud Sandbox Environment
     Args:
         local_script_path: path to the backtest code file
         strategy_name: A short name to identify each strategy
         session: Each User instance id
+        ctx: Mcp Server Session, receives the run's progress
     Return:
         Output Metrics of backtest
     '''
-    local_data_path = await get_session_data(session_id)
-    if not local_data_path:
+    session = await get_session(session_id)
+    dataset_key = session["current"]
+    dataset = session["datasets"].get(dataset_key or "")
+    if not dataset:
         raise ValueError("Data path not found for session")
 
-    metrics = await sandbox_executor(local_script_path, local_data_path, strategy_name)
+    # Repeat runs are answered by the result cache, keyed on content and runner version;
+    # the session only records the run
+    result_key = f"{local_script_path}|{dataset_key}"
+
+    # Upload the dataset once per session and reference it thereafter
+    data_gs = dataset.get("gcs_path")
+    if not data_gs:
+        data_gs = await asyncio.to_thread(upload_dataset, dataset["path"])
+        await update_dataset(session_id, dataset_key, gcs_path=data_gs)
+
+    await save_script(session_id, strategy_name, local_script_path)
+    metrics = await sandbox_executor(local_script_path, dataset["path"], strategy_name,
+                                     data_gs=data_gs, session_id=session_id,
+                                     on_progress=progress_forwarder(ctx))
+    if not isinstance(metrics, str) and metrics.get("status") == "ok":
+        await save_result(session_id, result_key, local_script_path, data_gs, metrics)
     return metrics
 
+@mcp.tool("Sandbox_Batch_Executor", description = "Execute several strategy variants in one Sandbox job")
+async def sandbox_batch_runner(script_paths: list[str], strategy_name: str, session_id: str,
+                               ctx: Context[ServerSession, None],
+                               params: list[dict] | dict | None = None, rank_by: str = "Sharpe Ratio"):
+    '''
+    Runs several strategy scripts and/or parameter sets against the session data in parallel
+    Args:
+        script_paths: paths to the backtest code files
+        strategy_name: A short name to identify the batch
+        session_id: Each User instance id
+        params: parameter sets passed to each script as JSON in the STRATEGY_PARAMS environment
+                variable; a list of dicts, or a dict of lists expanded to every combination
+        rank_by: metric the runs are ranked by
+        ctx: Mcp Server Session, receives the progress of every variant
+    Return:
+        Ranked metrics table of every run
+    '''
+    session = await get_session(session_id)
+    dataset_key = session["current"]
+    dataset = session["datasets"].get(dataset_key or "")
+    if not dataset:
+        raise ValueError("Data path not found for session")
+
+    data_gs = dataset.get("gcs_path")
+    if not data_gs:
+        data_gs = await asyncio.to_thread(upload_dataset, dataset["path"])
+        await update_dataset(session_id, dataset_key, gcs_path=data_gs)
+
+    return await sandbox_batch_executor(script_paths, dataset["path"], strategy_name, params=params,
+                                        rank_by=rank_by, data_gs=data_gs, session_id=session_id,
+                                        on_progress=progress_forwarder(ctx))
+
+@mcp.tool("Sandbox_Cancel", description = "Cancel running sandbox jobs of a session")
+async def sandbox_cancel(session_id: str):
+    '''
+    Cancels every sandbox run still going for a session, called when the session is abandoned
+    Args:
+        session_id: Each User instance id
+    Return:
+        Number of cancelled runs
+    '''
+    cancelled = await cancel_session_jobs(session_id)
+    logger.info(f"Cancelled {cancelled} sandbox jobs for session {session_id}")
+    return {"cancelled": cancelled}
+
 if __name__ == "__main__":
     mcp.run(transport="stdio")
 
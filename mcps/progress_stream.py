@@ -0,0 +1,72 @@
+
+import os
+import json
+import asyncio
+import logging
+from sandbox_orchestrator import OBJECT_STORE_DIR
+from session_store import SESSION_BACKEND, redis_client
+
+logging.basicConfig(level=logging.INFO)
+
+PROGRESS_PREFIX = "sandbox:progress:"
+
+def stream_name(result_path):
+    ''' Stream cloud_runner publishes the progress events of the run writing result_path to '''
+    return f"{PROGRESS_PREFIX}{result_path}"
+
+class RedisProgressReader:
+    ''' Reads the runner's Redis stream of a job (XREAD, blocking up to `block` seconds) '''
+    def __init__(self, client):
+        self._client = client
+
+    async def read(self, result_path, cursor=None, block=1.0):
+        '''
+        Returns:
+            (events, cursor) - decoded events after cursor, and the cursor to continue from
+        '''
+        key = stream_name(result_path)
+        reply = await self._client.xread({key: cursor or "0-0"}, count=100, block=int(block * 1000))
+        events = []
+        for _, entries in reply or ():
+            for entry_id, fields in entries:
+                cursor = entry_id
+                events.append(json.loads(fields["event"]))
+        return events, cursor
+
+class FileProgressReader:
+    ''' Tails the JSON lines cloud_runner writes under <OBJECT_STORE_DIR>/progress, the local stand-in '''
+    def __init__(self, root=OBJECT_STORE_DIR):
+        self.root = os.path.join(root, "progress")
+
+    def path(self, result_path):
+        return os.path.join(self.root, stream_name(result_path).replace("/", "_").replace(":", "_") + ".jsonl")
+
+    def _read_from(self, path, offset):
+        try:
+            with open(path, "rb") as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return [], offset
+        # Only whole lines, the runner may be halfway through writing the last one
+        end = data.rfind(b"\n") + 1
+        lines = data[:end].decode("utf-8").splitlines()
+        return [json.loads(line) for line in lines if line], offset + end
+
+    async def read(self, result_path, cursor=None, block=1.0):
+        events, cursor = await asyncio.to_thread(self._read_from, self.path(result_path), cursor or 0)
+        if not events:
+            await asyncio.sleep(block)
+        return events, cursor
+
+_reader = None
+
+def get_progress_reader():
+    ''' Returns the reader matching where the runner publishes, None when progress is not available '''
+    global _reader
+    if _reader is None:
+        if SESSION_BACKEND != "memory":
+            _reader = RedisProgressReader(redis_client)
+        elif OBJECT_STORE_DIR:
+            _reader = FileProgressReader()
+    return _reader
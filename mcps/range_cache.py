@@ -0,0 +1,296 @@
+
+import asyncio
+import bisect
+import inspect
+import logging
+import threading
+import numpy as np
+import pandas as pd
+from db_conn import fetch_many, store_in_db
+from market_writer import on_dropped, pending_bars
+
+logging.basicConfig(level=logging.INFO)
+
+DB_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+ONE_NS = pd.Timedelta(1, "ns")
+
+INTERVAL_STEPS = {
+    "1min": pd.Timedelta(minutes=1), "5min": pd.Timedelta(minutes=5), "15min": pd.Timedelta(minutes=15),
+    "30min": pd.Timedelta(minutes=30), "45min": pd.Timedelta(minutes=45), "1h": pd.Timedelta(hours=1),
+    "2h": pd.Timedelta(hours=2), "4h": pd.Timedelta(hours=4), "8h": pd.Timedelta(hours=8),
+    "1day": pd.Timedelta(days=1), "1week": pd.Timedelta(weeks=1), "1month": pd.Timedelta(days=31),
+}
+
+WEEK = pd.Timedelta(weeks=1)
+WEEK_MINUTES = 7 * 24 * 60
+HOUR_MINUTES = 60
+
+def _week_minutes(stamps):
+    ''' Minute of the week (Monday 00:00 UTC is 0) of each stamp '''
+    return stamps.dayofweek * 1440 + stamps.hour * 60 + stamps.minute
+
+def _trading_slots(stamps, step):
+    '''
+    Minutes of the week the market trades at, as seen in a series.
+    Intraday slots only count when their neighbours on either side traded too, so the hour a
+    daylight saving shift moves the open or close by does not turn every night into a hole.
+    '''
+    seen = set(_week_minutes(stamps).tolist())
+    if step >= pd.Timedelta(days=1):
+        return seen
+    reach = max(int(step / pd.Timedelta(minutes=1)), HOUR_MINUTES)
+    interior = {m for m in seen
+                if (m - reach) % WEEK_MINUTES in seen and (m + reach) % WEEK_MINUTES in seen}
+    return interior or seen
+
+def contiguous_runs(stamps, interval):
+    '''
+    Spans of consecutive bars: a new run starts wherever two bars are more than one interval apart,
+    unless the bars in between would all fall in the market's closures (nights, weekends).
+    Closures are learnt from the series itself once it spans a week: a time of the week the market
+    never traded at is a closure, a missing bar at a time it did trade at is a hole.
+    Returns:
+        list of (start, end), empty for an unknown interval as holes cannot be told apart then
+    '''
+    step = INTERVAL_STEPS.get(interval)
+    if step is None or len(stamps) == 0:
+        return []
+    stamps = pd.DatetimeIndex(stamps).unique().sort_values()
+    breaks = (stamps[1:] - stamps[:-1] > step).nonzero()[0]
+    if len(breaks) and step < WEEK and stamps[-1] - stamps[0] >= WEEK:
+        slots = _trading_slots(stamps, step)
+        holes = []
+        for i in breaks:
+            expected = pd.date_range(stamps[i] + step, stamps[i + 1] - step, freq=step)
+            if any(m in slots for m in _week_minutes(expected).tolist()):
+                holes.append(i)
+        breaks = np.asarray(holes, dtype=int)
+    starts = [stamps[0], *stamps[breaks + 1]]
+    ends = [*stamps[breaks], stamps[-1]]
+    return list(zip(starts, ends))
+
+def to_utc(value):
+    ''' Normalizes a date string / datetime to a tz-aware UTC pandas Timestamp '''
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is None:
+        return ts.tz_localize("UTC")
+    return ts.tz_convert("UTC")
+
+class RangeIndex:
+    '''
+    Sorted, non-overlapping spans [start, end] of bars already stored for one (ticker, timeframe).
+    Overlapping or touching spans are merged on insert.
+    '''
+    def __init__(self, spans=None):
+        self._starts = []
+        self._ends = []
+        self.known = False  # False until the store has been consulted once for this key
+        for start, end in spans or []:
+            self.add(start, end)
+
+    def __len__(self):
+        return len(self._starts)
+
+    def spans(self):
+        return list(zip(self._starts, self._ends))
+
+    def add(self, start, end):
+        ''' Marks [start, end] as stored '''
+        if end < start:
+            return
+        # First span that could touch the new one, and the first one strictly after it
+        lo = bisect.bisect_left(self._ends, start)
+        hi = bisect.bisect_right(self._starts, end)
+        if lo < hi:
+            start = min(start, self._starts[lo])
+            end = max(end, self._ends[hi - 1])
+        self._starts[lo:hi] = [start]
+        self._ends[lo:hi] = [end]
+
+    def remove(self, start, end):
+        ''' Marks [start, end] as no longer stored '''
+        spans = []
+        for s, e in self.spans():
+            if e < start or s > end:
+                spans.append((s, e))
+                continue
+            if s < start:
+                spans.append((s, start))
+            if e > end:
+                spans.append((end, e))
+        self._starts = [s for s, _ in spans]
+        self._ends = [e for _, e in spans]
+
+    def covered(self, start, end):
+        ''' Parts of [start, end] that are already stored '''
+        lo = bisect.bisect_left(self._ends, start)
+        hi = bisect.bisect_right(self._starts, end)
+        return [(max(start, s), min(end, e)) for s, e in zip(self._starts[lo:hi], self._ends[lo:hi])]
+
+    def missing(self, start, end):
+        ''' Parts of [start, end] that still have to be fetched '''
+        gaps = []
+        cursor = start
+        for s, e in self.covered(start, end):
+            if s > cursor:
+                gaps.append((cursor, s))
+            cursor = max(cursor, e)
+        if cursor < end:
+            gaps.append((cursor, end))
+        return gaps
+
+# ------------ Coverage Registry ---------------
+# Per process: each child of the MCP pool learns coverage on its own. What one child fetched reaches
+# the others through the shared local tier, or through the table once its write-behind buffer flushed
+_indexes = {}
+_indexes_lock = threading.Lock()
+_fetch_locks = {}  # (ticker, timeframe) -> asyncio.Lock, one gap fetch per key at a time
+
+def get_index(ticker, interval):
+    ''' Returns the coverage index of a (ticker, timeframe), creating an empty one on first use '''
+    key = (ticker, interval)
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = RangeIndex()
+        return _indexes[key]
+
+def _fetch_lock(ticker, interval):
+    return _fetch_locks.setdefault((ticker, interval), asyncio.Lock())
+
+_drop_loop = None
+
+def _watch_drops():
+    ''' Uncovers bars the market data writer gives up on, once per process on the serving loop '''
+    global _drop_loop
+    if _drop_loop is not None:
+        return
+    _drop_loop = asyncio.get_running_loop()
+
+    def uncover(ticker, interval, start, end):
+        get_index(ticker, interval).remove(start - ONE_NS, end + ONE_NS)
+        logging.warning(f"Range cache: {ticker} ({interval}) {start}..{end} was not stored, fetching it again next time")
+    on_dropped(lambda *span: _drop_loop.call_soon_threadsafe(uncover, *span))
+
+def _merge(frames):
+    ''' Concatenates bar frames, keeping one bar per timestamp in time order '''
+    frames = [f for f in frames if f is not None and not f.empty]
+    if not frames:
+        return pd.DataFrame(columns=["timestamp", "open", "high", "low", "close", "volume"])
+    merged = pd.concat(frames, ignore_index=True)
+    merged["timestamp"] = pd.to_datetime(merged["timestamp"], utc=True)
+    merged = merged.drop_duplicates(subset="timestamp", keep="first")
+    return merged.sort_values("timestamp", ignore_index=True)
+
+async def _call(fn, *args):
+    ''' Runs a sync or async fetcher without blocking the event loop '''
+    if inspect.iscoroutinefunction(fn):
+        return await fn(*args)
+    result = await asyncio.to_thread(fn, *args)
+    if inspect.isawaitable(result):
+        result = await result
+    return result
+
+def _local_tier():
+    ''' The on-disk tier in front of BigQuery, imported lazily as it builds on RangeIndex '''
+    from local_store import get_local_store
+    return get_local_store()
+
+async def _fetch_span(ticker, interval, start, end, vendor_fetch):
+    '''
+    Fetches one span through the table and the vendor.
+    Overlapping calls for the same key wait for each other, so the second one finds the first one's
+    spans covered instead of fetching the same gaps again.
+    Returns:
+        (list of bar frames, list of spans now known to be covered, rows fetched from the vendor)
+    '''
+    async with _fetch_lock(ticker, interval):
+        return await _fetch_span_locked(ticker, interval, start, end, vendor_fetch)
+
+async def _fetch_span_locked(ticker, interval, start, end, vendor_fetch):
+    _watch_drops()
+    index = get_index(ticker, interval)
+    frames = []
+
+    if not index.known:
+        # First request for this key in the process: learn what the table already holds
+        window = (ticker, interval, start.strftime(DB_TIME_FORMAT), end.strftime(DB_TIME_FORMAT))
+        stored = (await asyncio.to_thread(fetch_many, [window]) or {}).get(window)
+        if stored is not None and not stored.empty:
+            # Only runs of consecutive bars count, a hole inside the stored rows is still missing
+            for run in contiguous_runs(pd.to_datetime(stored["timestamp"], utc=True), interval):
+                index.add(*run)
+            frames.append(stored)
+        index.known = read = stored is not None
+    else:
+        windows = [
+            (ticker, interval, s.strftime(DB_TIME_FORMAT), e.strftime(DB_TIME_FORMAT))
+            for s, e in index.covered(start, end)
+        ]
+        stored = await asyncio.to_thread(fetch_many, windows) if windows else {}
+        read = stored is not None
+        frames.extend((stored or {}).values())
+    # Covered bars still waiting in the write-behind buffer are not in the table yet
+    frames.extend(pending_bars(ticker, interval, start, end))
+
+    # Spans whose rows could not be read are left out, the local tier would record them as held
+    covered = index.covered(start, end) if read else []
+    now = pd.Timestamp.now(tz="UTC")
+    fetched_rows = 0
+    for gap_start, gap_end in index.missing(start, end):
+        fresh = await _call(vendor_fetch, ticker, interval, gap_start, gap_end)
+        if fresh is None:
+            # The vendor call failed, the gap stays missing so the next request tries again
+            continue
+        if not fresh.empty:
+            # Gap edges that touch a stored span are already in the table, write back only the delta
+            edges = [t for t in (gap_start, gap_end) if t not in (start, end)]
+            stamps = pd.to_datetime(fresh["timestamp"], utc=True)
+            delta = fresh[~stamps.isin(edges)] if edges else fresh
+            frames.append(delta)
+            fetched_rows += len(delta)
+            # A chunked fetcher may already have streamed its chunks into the store
+            if not delta.empty and not getattr(vendor_fetch, "stores_chunks", False):
+                if not await asyncio.to_thread(store_in_db, ticker, interval, delta):
+                    continue
+        # Never mark the future as covered, those bars do not exist yet
+        span = (gap_start, min(gap_end, now))
+        index.add(*span)
+        covered.append(span)
+    return frames, covered, fetched_rows
+
+async def cached_fetch(ticker, interval, start_period, end_period, vendor_fetch):
+    '''
+    Returns bars for a window, pulling from the vendor only the spans not already stored.
+    The local tier is consulted first, then the market_data table, then the vendor.
+    Args:
+        ticker: Ticker symbol
+        interval: Timeframe of the bars
+        start_period: Start of the window
+        end_period: End of the window
+        vendor_fetch: callable (ticker, interval, start, end) -> DataFrame of bars, sync or async
+    Returns:
+        DataFrame of bars for the window, sorted by timestamp
+    '''
+    start, end = to_utc(start_period), to_utc(end_period)
+    frames = []
+    tier = _local_tier()
+    if tier is not None:
+        local, gaps = await asyncio.to_thread(tier.read, ticker, interval, start, end)
+        frames.append(local)
+    else:
+        gaps = [(start, end)]
+
+    fetched_rows = 0
+    for gap_start, gap_end in gaps:
+        fresh, covered, rows = await _fetch_span(ticker, interval, gap_start, gap_end, vendor_fetch)
+        fetched_rows += rows
+        frames.extend(fresh)
+        if tier is not None and covered:
+            await asyncio.to_thread(tier.write, ticker, interval, _merge(fresh), covered)
+
+    result = _merge(frames)
+    logging.info(
+        f"Range cache {ticker} ({interval}): {len(result)} rows, "
+        f"{len(gaps)} spans missing locally, {fetched_rows} rows fetched from vendor"
+    )
+    return result
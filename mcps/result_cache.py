@@ -0,0 +1,110 @@
+
+import os
+import re
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from sandbox_orchestrator import get_object_store, object_path
+
+logging.basicConfig(level=logging.INFO)
+
+# Bump when the runner image changes in a way that can change results
+RUNNER_VERSION = os.environ.get("RUNNER_VERSION", "1")
+RESULT_CACHE_SIZE = int(os.environ.get("RESULT_CACHE_SIZE", "512"))
+RESULT_CACHE_TTL = int(os.environ.get("RESULT_CACHE_TTL", str(7 * 24 * 3600)))
+# Content-addressed uploads carry their digest in the name, no lookup needed
+_DIGEST_NAME = re.compile(r"([0-9a-f]{40})\.\w+$")
+
+RESULT_CACHE_METRICS = {"hits": 0, "misses": 0, "stores": 0}
+
+def object_digest(uri):
+    ''' Content hash of a stored script or dataset '''
+    match = _DIGEST_NAME.search(uri)
+    if match:
+        return match.group(1)
+    return get_object_store().digest(object_path(uri))
+
+async def result_key(code_gs, data_gs):
+    '''
+    Cache key of a backtest: script content + dataset content + runner version
+    Args:
+        code_gs: gcs path of the strategy script
+        data_gs: gcs path of the dataset
+    Returns:
+        hex key
+    '''
+    script_hash, data_hash = await asyncio.gather(
+        asyncio.to_thread(object_digest, code_gs),
+        asyncio.to_thread(object_digest, data_gs),
+    )
+    raw = f"{script_hash}|{data_hash}|{RUNNER_VERSION}".encode()
+    return hashlib.blake2b(raw, digest_size=20).hexdigest()
+
+class ResultCache:
+    '''
+    Memoized backtest metrics.
+    A bounded in-process LRU sits in front of an optional shared backend
+    (the session store's Redis client), entries expire after ttl seconds.
+    '''
+    def __init__(self, backend=None, max_entries=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL):
+        self.backend = backend
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _local_get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, metrics = entry
+            if time.time() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return metrics
+
+    def _local_put(self, key, metrics):
+        with self._lock:
+            self._entries[key] = (time.time(), metrics)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def get(self, key):
+        metrics = self._local_get(key)
+        if metrics is None and self.backend is not None:
+            try:
+                raw = await self.backend.get(f"result:{key}")
+            except Exception as e:
+                logging.error(f"Result cache lookup failed: {e}")
+                raw = None
+            if raw:
+                metrics = json.loads(raw)
+                self._local_put(key, metrics)
+        RESULT_CACHE_METRICS["hits" if metrics is not None else "misses"] += 1
+        return metrics
+
+    async def put(self, key, metrics):
+        self._local_put(key, metrics)
+        RESULT_CACHE_METRICS["stores"] += 1
+        if self.backend is not None:
+            try:
+                await self.backend.set(f"result:{key}", json.dumps(metrics, default=str), ex=self.ttl)
+            except Exception as e:
+                logging.error(f"Result cache store failed: {e}")
+
+_cache = None
+
+def get_result_cache():
+    ''' Returns the process-wide result cache, shared through the session store backend '''
+    global _cache
+    if _cache is None:
+        from session_store import redis_client
+        _cache = ResultCache(backend=redis_client)
+    return _cache
@@ -0,0 +1,124 @@
+
+import asyncio
+import logging
+from session_store import SESSION_BACKEND, redis_client
+
+logging.basicConfig(level=logging.INFO)
+
+CHANNEL_PREFIX = "sandbox:done:"
+
+def channel_name(result_path):
+    ''' Channel the runner publishes to once the result object is written '''
+    return f"{CHANNEL_PREFIX}{result_path}"
+
+# ------------ Subscriptions ---------------
+
+class Subscription:
+    ''' One waiter on a result channel, woken by its notifier's dispatch '''
+    def __init__(self, notifier, channel):
+        self._notifier = notifier
+        self.channel = channel
+        self._event = asyncio.Event()
+
+    async def start(self):
+        self._notifier._subscribers.setdefault(self.channel, set()).add(self)
+        await self._notifier._listening()
+
+    async def wait(self, timeout):
+        ''' Waits up to timeout seconds, True if a notification arrived '''
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+            self._event.clear()
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def close(self):
+        subscribers = self._notifier._subscribers.get(self.channel, set())
+        subscribers.discard(self)
+        if not subscribers:
+            self._notifier._subscribers.pop(self.channel, None)
+
+def _dispatch(subscribers, channel):
+    for subscription in list(subscribers.get(channel, ())):
+        subscription._event.set()
+
+# ------------ In-process Notifier ---------------
+
+class LocalNotifier:
+    ''' Pub/sub stand-in for runs executed in this process (local backends and tests) '''
+    def __init__(self):
+        self._subscribers = {}
+
+    async def _listening(self):
+        pass
+
+    def subscribe(self, result_path):
+        return Subscription(self, channel_name(result_path))
+
+    async def publish(self, result_path):
+        _dispatch(self._subscribers, channel_name(result_path))
+
+# ------------ Redis Notifier ---------------
+
+class RedisNotifier:
+    '''
+    Redis pub/sub channel that cloud_runner publishes to after uploading a result.
+    One pattern subscription per process, on a single connection, receives every result notice and
+    wakes the waiters of that channel, so waiting jobs do not each hold a connection of the pool.
+    If the connection drops, waiters fall back to polling until the next subscribe reopens it.
+    '''
+    def __init__(self, client):
+        self._client = client
+        self._subscribers = {}
+        self._listener: asyncio.Task | None = None
+        self._start_lock = asyncio.Lock()
+
+    async def _listening(self):
+        ''' Starts the shared subscription unless it is running, returns once it is confirmed '''
+        if self._listener is not None and not self._listener.done():
+            return
+        async with self._start_lock:
+            if self._listener is not None and not self._listener.done():
+                return
+            pubsub = self._client.pubsub()
+            try:
+                await pubsub.psubscribe(f"{CHANNEL_PREFIX}*")
+            except Exception:
+                await pubsub.aclose()
+                raise
+            self._listener = asyncio.create_task(self._listen(pubsub))
+
+    async def _listen(self, pubsub):
+        try:
+            async for message in pubsub.listen():
+                if message["type"] != "pmessage":
+                    continue
+                channel = message["channel"]
+                if isinstance(channel, bytes):
+                    channel = channel.decode()
+                _dispatch(self._subscribers, channel)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Result notice subscription lost: {e}")
+        finally:
+            try:
+                await pubsub.aclose()
+            except Exception:
+                pass
+
+    def subscribe(self, result_path):
+        return Subscription(self, channel_name(result_path))
+
+    async def publish(self, result_path):
+        await self._client.publish(channel_name(result_path), "done")
+
+_notifier = None
+
+def get_notifier():
+    ''' Returns the process-wide notifier, matching the session store backend '''
+    global _notifier
+    if _notifier is None:
+        _notifier = LocalNotifier() if SESSION_BACKEND == "memory" else RedisNotifier(redis_client)
+    return _notifier
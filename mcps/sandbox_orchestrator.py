@@ -1,4 +1,9 @@
-import uuid, time, json
+
+import uuid, json
+import asyncio, random
+import hashlib, shutil, threading
+import math
+from collections import OrderedDict
 from google.cloud import storage
 from google.cloud import run_v2
 import os, logging
@@ -9,35 +14,218 @@ BUCKET = os.environ.get("BUCKET")
 REGION = os.environ.get("REGION")
 JOB_NAME = os.environ.get("JOB_NAME")
 PROJECT = os.environ.get("PROJECT")
+# When set, objects live under this directory instead of GCS (local development and tests)
+OBJECT_STORE_DIR = os.environ.get("OBJECT_STORE_DIR")
+# Limits handed to the runner; result waits are derived from them
+SCRIPT_TIMEOUT = int(os.environ.get("SANDBOX_SCRIPT_TIMEOUT", "120"))
+JOB_STARTUP_MARGIN = int(os.environ.get("SANDBOX_STARTUP_MARGIN", "90"))
+RESULT_TIMEOUT = SCRIPT_TIMEOUT + JOB_STARTUP_MARGIN
+# Batch variants run BATCH_WORKERS at a time on the runner, at most BATCH_MAX_VARIANTS per manifest
+BATCH_WORKERS = int(os.environ.get("SANDBOX_BATCH_WORKERS", "2"))
+BATCH_MAX_VARIANTS = int(os.environ.get("SANDBOX_BATCH_MAX_VARIANTS", "64"))
+# Time a queued job may wait for a free pool worker before it starts
+QUEUE_WAIT_MARGIN = int(os.environ.get("SANDBOX_QUEUE_MARGIN", "300"))
+# "1" has the runner profile scripts and attach their hottest functions to the result's usage
+SCRIPT_PROFILE = os.environ.get("SANDBOX_PROFILE", "0")
 
 logging.info(f"Project: {PROJECT}, BUCKET: {BUCKET}, JOB_NAME: {JOB_NAME}, PROJECT: {PROJECT}")
 
+# ------------ Object Stores ---------------
+
+class GCSObjectStore:
+    ''' Objects in the GCS bucket, through one shared storage client '''
+    def __init__(self, bucket=BUCKET):
+        self.bucket_name = bucket
+        self.bucket = storage.Client(project = PROJECT).bucket(bucket)
+
+    def uri(self, path):
+        return f"gs://{self.bucket_name}/{path}"
+
+    def exists(self, path):
+        return self.bucket.blob(path).exists()
+
+    def upload(self, local_path, path):
+        self.bucket.blob(path).upload_from_filename(local_path)
+
+    def download_text(self, path):
+        return self.bucket.blob(path).download_as_text()
+
+    def digest(self, path):
+        ''' Content hash GCS already keeps for the object (no download) '''
+        blob = self.bucket.get_blob(path)
+        if blob is None:
+            raise FileNotFoundError(self.uri(path))
+        return blob.md5_hash or blob.crc32c
+
+class LocalObjectStore:
+    ''' Stand-in for the bucket on the local filesystem, gs://<bucket>/<path> lives at <root>/<bucket>/<path> '''
+    def __init__(self, root=OBJECT_STORE_DIR, bucket=BUCKET):
+        self.bucket_name = bucket or "local"
+        self.root = os.path.join(root, self.bucket_name)
+
+    def uri(self, path):
+        return f"gs://{self.bucket_name}/{path}"
+
+    def _local(self, path):
+        return os.path.join(self.root, path)
+
+    def exists(self, path):
+        return os.path.exists(self._local(path))
+
+    def upload(self, local_path, path):
+        target = self._local(path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp = f"{target}.{uuid.uuid4().hex}.tmp"
+        shutil.copyfile(local_path, tmp)
+        os.replace(tmp, target)
+
+    def download_text(self, path):
+        with open(self._local(path), encoding="utf-8") as f:
+            return f.read()
+
+    def digest(self, path):
+        return file_digest(self._local(path))
+
+_object_store = None
+
+def get_object_store():
+    ''' Returns the process-wide object store, local when OBJECT_STORE_DIR is set '''
+    global _object_store
+    if _object_store is None:
+        _object_store = LocalObjectStore() if OBJECT_STORE_DIR else GCSObjectStore()
+    return _object_store
+
+def batch_variants(scripts, params=None):
+    ''' Number of variants the runner expands a batch manifest to (scripts x parameter sets) '''
+    if not params:
+        sets = 1
+    elif isinstance(params, dict):
+        sets = math.prod(len(v) if isinstance(v, list) else 1 for v in params.values())
+    else:
+        sets = len(params)
+    return len(scripts) * sets
+
+def result_timeout(variants=None, queued=False):
+    '''
+    Seconds to wait for a run's result, derived from the limits the runner enforces
+    Args:
+        variants: number of batch variants, None for a single script
+        queued: the job waits in the pool queue before a worker starts it
+    '''
+    timeout = RESULT_TIMEOUT
+    if variants:
+        rounds = math.ceil(min(variants, BATCH_MAX_VARIANTS) / max(BATCH_WORKERS, 1))
+        timeout = rounds * SCRIPT_TIMEOUT + JOB_STARTUP_MARGIN
+    if queued:
+        timeout += QUEUE_WAIT_MARGIN
+    return timeout
+
+def object_path(uri):
+    ''' Path inside the bucket of a gs://<bucket>/<path> uri '''
+    return uri.replace("gs://", "").split("/", 1)[1] if uri.startswith("gs://") else uri
+
+# ------------ Uploads ---------------
+
+UPLOAD_METRICS = {"uploads": 0, "dedup_hits": 0, "bytes_uploaded": 0, "bytes_saved": 0}
+DIGEST_CACHE_SIZE = int(os.getenv("DIGEST_CACHE_SIZE", "4096"))
+_digests = OrderedDict()  # (path, size, mtime) -> digest, least recently used first, so unchanged files are hashed once
+_uploaded = set()  # object paths known to exist in the store
+_upload_lock = threading.Lock()
+
+def file_digest(local_path):
+    ''' BLAKE2b digest of a file, cached on (path, size, mtime) '''
+    stat = os.stat(local_path)
+    key = (os.path.abspath(local_path), stat.st_size, stat.st_mtime_ns)
+    with _upload_lock:
+        digest = _digests.get(key)
+        if digest is not None:
+            _digests.move_to_end(key)
+            return digest
+    h = hashlib.blake2b(digest_size=20)
+    with open(local_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    with _upload_lock:
+        _digests[key] = digest
+        while len(_digests) > DIGEST_CACHE_SIZE:
+            _digests.popitem(last=False)
+    return digest
+
+def upload_metrics():
+    ''' Upload counters, with the share of uploaded bytes deduplication avoided '''
+    with _upload_lock:
+        metrics = dict(UPLOAD_METRICS)
+    offered = metrics["bytes_uploaded"] + metrics["bytes_saved"]
+    metrics["saved_ratio"] = metrics["bytes_saved"] / offered if offered else 0.0
+    return metrics
+
 def upload_file(local_path, gcs_path):
     '''
-    Uploads File to GCS BUCKET 
-    Args: 
+    Uploads File to GCS BUCKET
+    Args:
         local_path: path to local python code file
         gcs_path: GCS bucket path to save the file
     Returns:
-        gcs file path 
+        gcs file path
     '''
     try:
         logging.info(f"Uploading {local_path} to {gcs_path} in Progress")
-        client = storage.Client(project = PROJECT)
-        bucket = client.bucket(BUCKET)
-        blob = bucket.blob(gcs_path)
-        blob.upload_from_filename(local_path)
-        cloud_path = f"gs://{BUCKET}/{gcs_path}"
+        store = get_object_store()
+        store.upload(local_path, gcs_path)
+        cloud_path = store.uri(gcs_path)
+        with _upload_lock:
+            UPLOAD_METRICS["uploads"] += 1
+            UPLOAD_METRICS["bytes_uploaded"] += os.path.getsize(local_path)
         logging.info(f" File Uploaded Successfully. Path: {cloud_path}")
         return cloud_path
     except Exception as e:
         logging.error(f" Failed to Upload File: {e}")
         raise
-        
-def trigger_run_job(code_gs_path, data_gs_path, result_gs_path):
+
+def upload_content_addressed(local_path, prefix):
+    '''
+    Uploads a file under a name derived from its content, skipping the upload if it is already stored
+    Args:
+        local_path: path to the local file
+        prefix: folder in the bucket (e.g. "data", "scripts")
+    Returns:
+        gcs file path
+    '''
+    ext = os.path.splitext(local_path)[1]
+    gcs_path = f"{prefix}/{file_digest(local_path)}{ext}"
+    store = get_object_store()
+    if gcs_path in _uploaded or store.exists(gcs_path):
+        with _upload_lock:
+            _uploaded.add(gcs_path)
+            UPLOAD_METRICS["dedup_hits"] += 1
+            UPLOAD_METRICS["bytes_saved"] += os.path.getsize(local_path)
+        logging.info(f" Reusing stored copy of {local_path}: {store.uri(gcs_path)}")
+        return store.uri(gcs_path)
+    cloud_path = upload_file(local_path, gcs_path)
+    with _upload_lock:
+        _uploaded.add(gcs_path)
+    return cloud_path
+
+_jobs_client = None
+
+def _get_jobs_client():
+    global _jobs_client
+    if _jobs_client is None:
+        _jobs_client = run_v2.JobsClient()
+    return _jobs_client
+
+def trigger_run_job(code_gs_path, data_gs_path, result_gs_path, batch_gs_path=None):
+    '''
+    Starts a Cloud Run Job execution for a backtest without waiting for it to finish
+    Args:
+        batch_gs_path: batch manifest, runs every variant in it instead of code/data
+    Returns:
+        the long-running operation of the execution
+    '''
     try:
         logging.info(" Run Job Process Initialized")
-        client = run_v2.JobsClient()
+        client = _get_jobs_client()
         parent = f"projects/{PROJECT}/locations/{REGION}"
         job_name = f"{parent}/jobs/{JOB_NAME}"
 
@@ -51,33 +239,68 @@ def trigger_run_job(code_gs_path, data_gs_path, result_gs_path):
                                 {"name": "BUCKET", "value": BUCKET},
                                 {"name": "CODE_GS", "value": code_gs_path},
                                 {"name": "DATA_GS", "value": data_gs_path},
-                                {"name": "RESULT_GS", "value": result_gs_path}
+                                {"name": "RESULT_GS", "value": result_gs_path},
+                                {"name": "SCRIPT_TIMEOUT", "value": str(SCRIPT_TIMEOUT)},
+                                {"name": "BATCH_WORKERS", "value": str(BATCH_WORKERS)},
+                                {"name": "BATCH_MAX_VARIANTS", "value": str(BATCH_MAX_VARIANTS)},
+                                {"name": "NOTIFY_REDIS_HOST", "value": os.environ.get("HOST", "")},
+                                {"name": "BATCH_GS", "value": batch_gs_path or ""},
+                                {"name": "SCRIPT_PROFILE", "value": SCRIPT_PROFILE},
                             ]
                         }
                     ]
                 },
             }
         )
-        # job_execution is a long-running operation; poll until it reaches RUNNING/COMPLETED
-        logging.info(" Run Job Process Completed")
-        return job_execution.result()
+        # job_execution is a long-running operation; completion is observed through the result object
+        logging.info(" Run Job Process Started")
+        return job_execution
     except Exception as e:
         logging.error(f" Failed to Trigger Run Job: {e}")
         raise
 
-def wait_for_result(result_blob_path, timeout=10):
+def cancel_run_job(job_execution):
+    ''' Cancels a running Cloud Run Job execution started by trigger_run_job '''
+    try:
+        execution_name = job_execution.metadata.name
+        run_v2.ExecutionsClient().cancel_execution(name=execution_name)
+        logging.info(f" Cancelled Execution {execution_name}")
+    except Exception as e:
+        logging.error(f" Failed to Cancel Run Job: {e}")
+        raise
+
+async def wait_for_result(result_blob_path, timeout=RESULT_TIMEOUT, subscription=None,
+                          initial_delay=0.5, max_delay=8.0):
+    '''
+    Waits for the runner's result object without blocking the event loop.
+    Polls with exponential backoff and jitter; a subscription to the runner's completion
+    channel cuts each wait short as soon as the result is announced.
+    Args:
+        result_blob_path: bucket path of the result JSON
+        timeout: seconds before giving up, defaults to the script timeout plus job startup margin
+        subscription: started notifier subscription for the result (optional)
+    Returns:
+        decoded result JSON
+    '''
     try:
         logging.info("Retrieving Results In Progress")
-        client = storage.Client()
-        bucket = client.bucket(BUCKET)
-        blob = bucket.blob(result_blob_path)
-        start = time.time()
-        while time.time() - start < timeout:
-            if blob.exists():
-                return json.loads(blob.download_as_text())
-            time.sleep(2)
-        raise TimeoutError("Job result not found")
+        store = get_object_store()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        delay = initial_delay
+        while True:
+            if await asyncio.to_thread(store.exists, result_blob_path):
+                text = await asyncio.to_thread(store.download_text, result_blob_path)
+                return json.loads(text)
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                raise TimeoutError(f"Job result not found after {timeout}s")
+            pause = min(delay * random.uniform(0.5, 1.0), remaining)
+            if subscription is not None:
+                await subscription.wait(pause)
+            else:
+                await asyncio.sleep(pause)
+            delay = min(delay * 2, max_delay)
     except Exception as e:
         logging.error(f" Failed to Retrive Sandbox Results {e}")
         raise
-
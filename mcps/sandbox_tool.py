@@ -1,23 +1,124 @@
-import uuid
-from sandbox_orchestrator import upload_file, trigger_run_job, wait_for_result
+import os, uuid, asyncio, tempfile
+from sandbox_orchestrator import upload_content_addressed, batch_variants
+from job_dispatch import submit
 import logging, json
+from result_cache import get_result_cache, result_key
 
 logging.basicConfig(level=logging.INFO)
 
-async def sandbox_executor(local_script_path, local_data_path, strategy_name):
+async def _forward_progress(handle, on_progress):
+    ''' Hands every progress event of the run to on_progress, a failing callback only stops the forwarding '''
+    try:
+        async for event in handle.progress():
+            await on_progress(event)
+    except Exception as e:
+        logging.error(f"Progress forwarding for job {handle.id} stopped: {e}")
+
+async def _await_result(handle, on_progress=None):
+    ''' Waits for the run's result, streaming its progress to on_progress meanwhile '''
+    if on_progress is None:
+        return await handle.result()
+    forwarder = asyncio.create_task(_forward_progress(handle, on_progress))
+    try:
+        return await handle.result()
+    finally:
+        # The runner publishes its end event before announcing the result, give it a moment to drain
+        try:
+            await asyncio.wait_for(forwarder, 2)
+        except asyncio.TimeoutError:
+            pass
+
+def upload_dataset(local_data_path):
+    ''' Uploads a local parquet dataset for the sandbox (once per content), returns its gcs path '''
+    return upload_content_addressed(local_data_path, "data")
+
+async def sandbox_executor(local_script_path, local_data_path, strategy_name, data_gs=None, session_id=None,
+                           on_progress=None):
+    '''
+    Runs a strategy script against a dataset in the sandbox
+    Args:
+        local_script_path: gcs path of the strategy script
+        local_data_path: local path of the parquet dataset
+        strategy_name: A short name to identify each strategy
+        data_gs: gcs path of an already uploaded copy of the dataset, skips the upload
+        session_id: session the run belongs to, so it can be cancelled with the session
+        on_progress: async callable receiving the runner's progress events while the script runs
+    Returns:
+        Output metrics of the backtest
+    '''
     try:
         uid = uuid.uuid4().hex[:8]
         code_gs = local_script_path
-        data_gs = upload_file(local_data_path, f"data/{strategy_name}_{uid}.parquet")
+        if data_gs is None:
+            data_gs = await asyncio.to_thread(upload_dataset, local_data_path)
         result_gs = f"results/{strategy_name}_{uid}.json"
 
-        # Trigger job and pass env overrides
-        trigger_run_job(code_gs, data_gs, result_gs)
+        # Unchanged script on unchanged data: return the earlier metrics without a job
+        cache = get_result_cache()
+        key = await result_key(code_gs, data_gs)
+        cached = await cache.get(key)
+        if cached is not None:
+            logging.info(f"Result cache hit for {strategy_name} ({key})")
+            return cached
+
+        # Dispatch without blocking, other sessions' runs proceed concurrently
+        handle = await submit(code_gs, data_gs, result_gs, session_id=session_id)
+        metrics = await _await_result(handle, on_progress)
 
-        metrics = wait_for_result(result_gs, timeout=10)
+        if isinstance(metrics, dict) and metrics.get("status") == "ok":
+            await cache.put(key, metrics)
         return metrics
     except Exception as e:
         logging.error(f"Error Executing Sandbox: {e}")
         return json.dumps({"error": f"Sandbox error: {str(e)}"})
 
+async def sandbox_batch_executor(script_paths, local_data_path, strategy_name, params=None,
+                                 rank_by="Sharpe Ratio", data_gs=None, session_id=None, on_progress=None):
+    '''
+    Runs several scripts and/or parameter sets against one dataset in a single sandbox job
+    Args:
+        script_paths: gcs paths of the strategy scripts
+        local_data_path: local path of the parquet dataset
+        strategy_name: A short name to identify the batch
+        params: list of parameter dicts, or a dict of lists expanded to every combination;
+                each run receives its set as JSON in the STRATEGY_PARAMS environment variable
+        rank_by: metric used to rank the runs
+        data_gs: gcs path of an already uploaded copy of the dataset, skips the upload
+        session_id: session the run belongs to, so it can be cancelled with the session
+        on_progress: async callable receiving the runner's progress events while the variants run
+    Returns:
+        Ranked metrics table of the runs
+    '''
+    try:
+        uid = uuid.uuid4().hex[:8]
+        if data_gs is None:
+            data_gs = await asyncio.to_thread(upload_dataset, local_data_path)
+        manifest = {"data": data_gs, "scripts": list(script_paths), "params": params, "rank_by": rank_by}
+        fd, manifest_path = tempfile.mkstemp(suffix=".json")
+        with os.fdopen(fd, "w") as f:
+            json.dump(manifest, f, sort_keys=True)
+        try:
+            batch_gs = await asyncio.to_thread(upload_content_addressed, manifest_path, "batches")
+        finally:
+            os.remove(manifest_path)
+        result_gs = f"results/{strategy_name}_batch_{uid}.json"
+
+        # The manifest is content-addressed, so the same sweep on the same data hits the cache
+        cache = get_result_cache()
+        key = await result_key(batch_gs, data_gs)
+        cached = await cache.get(key)
+        if cached is not None:
+            logging.info(f"Result cache hit for batch {strategy_name} ({key})")
+            return cached
 
+        # The wait covers every round of variants, not the single-script limit
+        handle = await submit("", data_gs, result_gs, session_id=session_id, batch_gs=batch_gs,
+                              variants=batch_variants(manifest["scripts"], params))
+        results = await _await_result(handle, on_progress)
+
+        if isinstance(results, dict) and results.get("status") == "ok":
+            await cache.put(key, results)
+        return results
+    except Exception as e:
+        logging.error(f"Error Executing Sandbox Batch: {e}")
+        return json.dumps({"error": f"Sandbox error: {str(e)}"})
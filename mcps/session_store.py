@@ -1,3 +1,4 @@
+
 import logging, sys
 
 logger = logging.getLogger("runner")
@@ -8,46 +9,256 @@ logging.basicConfig(
 )
 
 import os
-import redis
 import json
-from datetime import timedelta
+import time
+import hashlib
+import redis
+import redis.asyncio as aioredis
 
-    
-# ------- Testing Redis connection ---------
-def redis_test():
-    try:
-        redis_client.ping()
-        logger.info("Redis connected successfully.")
-    except redis.exceptions.ConnectionError:
-        logger.error("Redis connection failed — check REDIS_HOST/PORT")
+SESSION_TTL = int(os.getenv("SESSION_TTL", "3600"))  # auto-clean after 1 hour
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "50"))
+REDIS_PORT = int(os.getenv("REDIS_PORT", "6379"))
+# "memory" keeps sessions in process, for local development and tests
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "redis" if os.getenv("HOST") else "memory")
+
+# ------------ In-process Backend ---------------
+class MemoryBackend:
+    ''' Dict with per-key TTL exposing the subset of the redis.asyncio API used here '''
+    def __init__(self):
+        self._data = {}
+        self._expiry = {}
+
+    def _alive(self, key):
+        deadline = self._expiry.get(key)
+        if deadline is not None and deadline <= time.monotonic():
+            self._data.pop(key, None)
+            self._expiry.pop(key, None)
+        return key in self._data
+
+    async def ping(self):
+        return True
+
+    async def set(self, key, value, ex=None):
+        self._data[key] = value
+        self._expiry.pop(key, None)
+        if ex is not None:
+            await self.expire(key, ex)
+        return True
+
+    async def get(self, key):
+        return self._data.get(key) if self._alive(key) else None
+
+    async def mget(self, keys):
+        return [await self.get(key) for key in keys]
+
+    async def expire(self, key, seconds):
+        if not self._alive(key):
+            return False
+        seconds = seconds.total_seconds() if hasattr(seconds, "total_seconds") else seconds
+        self._expiry[key] = time.monotonic() + seconds
+        return True
+
+    async def hset(self, key, field=None, value=None, mapping=None):
+        if not self._alive(key):
+            self._data[key] = {}
+        fields = dict(mapping or {})
+        if field is not None:
+            fields[field] = value
+        self._data[key].update(fields)
+        return len(fields)
+
+    async def hget(self, key, field):
+        return self._data[key].get(field) if self._alive(key) else None
+
+    async def hgetall(self, key):
+        return dict(self._data[key]) if self._alive(key) else {}
+
+    async def delete(self, *keys):
+        removed = 0
+        for key in keys:
+            removed += self._alive(key)
+            self._data.pop(key, None)
+            self._expiry.pop(key, None)
+        return removed
+
+    def pipeline(self, transaction=False):
+        return MemoryPipeline(self)
+
+    async def aclose(self):
+        self._data.clear()
+        self._expiry.clear()
+
+class MemoryPipeline:
+    ''' Queues commands and runs them on execute(), mirroring redis pipelines '''
+    def __init__(self, backend):
+        self._backend = backend
+        self._commands = []
+
+    def __getattr__(self, name):
+        method = getattr(self._backend, name)
+        def queue(*args, **kwargs):
+            self._commands.append((method, args, kwargs))
+            return self
+        return queue
+
+    async def execute(self):
+        commands, self._commands = self._commands, []
+        return [await method(*args, **kwargs) for method, args, kwargs in commands]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self._commands = []
 
 # ------------ Redis Server Side ---------------
 _redis_pool = None
+_memory_backend = None
 
 def get_redis_client():
-    ''' Function for connecting to redis server '''
-    global _redis_pool
+    ''' Function for connecting to redis server (or the in-process backend) '''
+    global _redis_pool, _memory_backend
+    if SESSION_BACKEND == "memory":
+        if _memory_backend is None:
+            _memory_backend = MemoryBackend()
+        return _memory_backend
     if not _redis_pool:
-        _redis_pool = redis.ConnectionPool(
+        _redis_pool = aioredis.ConnectionPool(
             host=os.getenv("HOST"),
-            port=6379,
+            port=REDIS_PORT,
             decode_responses=True,
-            max_connections=3,
+            max_connections=REDIS_MAX_CONNECTIONS,
         )
-    return redis.Redis(connection_pool=_redis_pool)
+    return aioredis.Redis(connection_pool=_redis_pool)
 
 redis_client = get_redis_client()
 
+# ------- Testing Redis connection ---------
+async def redis_test():
+    try:
+        await redis_client.ping()
+        logger.info(f"Session store connected successfully ({SESSION_BACKEND} backend).")
+    except redis.exceptions.ConnectionError:
+        logger.error("Redis connection failed — check REDIS_HOST/PORT")
+
+# ------------ Session State ---------------
+# Each session is a hash "session:<id>" holding:
+#   current          -> key of the dataset the session is working on
+#   dataset:<key>    -> JSON {path, rows, gcs_path, stored_at}
+#   script:<name>    -> JSON {path, hash, saved_at}
+#   result:<key>     -> JSON {script, data, result_hash, metrics, ran_at}
+#   updated_at       -> unix time of the last write
+# Every read and write slides the TTL forward.
+
+def _session_key(session_id):
+    return f"session:{session_id}"
+
+async def _write(session_id, fields):
+    ''' Writes hash fields and refreshes the TTL in one pipelined round trip '''
+    key = _session_key(session_id)
+    fields = {**fields, "updated_at": str(time.time())}
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.hset(key, mapping=fields)
+        pipe.expire(key, SESSION_TTL)
+        await pipe.execute()
+
+async def _read(session_id):
+    ''' Reads the whole session hash and refreshes the TTL '''
+    key = _session_key(session_id)
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.hgetall(key)
+        pipe.expire(key, SESSION_TTL)
+        raw, _ = await pipe.execute()
+    return raw or {}
+
+def _parse(raw):
+    ''' Groups the flat hash fields into datasets, scripts and results '''
+    session = {"current": raw.get("current"), "updated_at": raw.get("updated_at"),
+               "datasets": {}, "scripts": {}, "results": {}}
+    for field, value in raw.items():
+        kind, _, name = field.partition(":")
+        group = {"dataset": "datasets", "script": "scripts", "result": "results"}.get(kind)
+        if group and name:
+            session[group][name] = json.loads(value)
+    return session
+
+async def get_session(session_id: str):
+    ''' Retrieve the full session state '''
+    return _parse(await _read(session_id))
+
+async def save_dataset(session_id: str, dataset_key: str, data_path: str, rows: int = None, **extra):
+    '''
+    Records a dataset for the session and makes it the current one.
+    Args:
+        session_id: Each User instance id
+        dataset_key: identifies the dataset, e.g. "BTC/USD|1h|2024-01-01|2024-06-01"
+        data_path: local path of the stored parquet file
+        rows: number of bars in the dataset
+        extra: any other fields to keep with the dataset (e.g. gcs_path)
+    '''
+    entry = {"path": data_path, "rows": rows, "stored_at": time.time(), **extra}
+    await _write(session_id, {f"dataset:{dataset_key}": json.dumps(entry), "current": dataset_key})
+    logger.info(f"Session {session_id} saved dataset {dataset_key} with path: {data_path}")
+
+async def update_dataset(session_id: str, dataset_key: str, **fields):
+    ''' Adds fields (e.g. the uploaded gcs_path) to an existing dataset entry '''
+    session = await get_session(session_id)
+    entry = session["datasets"].get(dataset_key, {})
+    entry.update(fields)
+    await _write(session_id, {f"dataset:{dataset_key}": json.dumps(entry)})
+
+async def save_script(session_id: str, name: str, path: str, content_hash: str = None):
+    ''' Records a strategy script used by the session '''
+    entry = {"path": path, "hash": content_hash, "saved_at": time.time()}
+    await _write(session_id, {f"script:{name}": json.dumps(entry)})
+
+async def save_result(session_id: str, result_key: str, script: str, data: str, metrics):
+    ''' Records a backtest result of the session, reruns are answered by the result cache '''
+    payload = json.dumps(metrics, sort_keys=True, default=str)
+    entry = {
+        "script": script,
+        "data": data,
+        "result_hash": hashlib.blake2b(payload.encode(), digest_size=16).hexdigest(),
+        "metrics": metrics,
+        "ran_at": time.time(),
+    }
+    await _write(session_id, {f"result:{result_key}": json.dumps(entry, default=str)})
+
 # Using Redis to store session state
-async def save_session(session_id: str, data_path: str):
+async def save_session(session_id: str, data_path: str, dataset_key: str = "default", rows: int = None):
     """Stores session data in Redis."""
-    redis_client.set(session_id, data_path)
-    redis_client.expire(session_id, timedelta(hours=1))  # auto-clean after 1 hour
-    logger.info(f"Session {session_id} saved in Redis with path: {data_path}")
+    await save_dataset(session_id, dataset_key, data_path, rows)
 
 async def get_session_data(session_id: str):
-    ''' Retrieve session info '''
-    data = redis_client.get(session_id)
-    return data
+    ''' Retrieve the data path of the session's current dataset '''
+    session = await get_session(session_id)
+    dataset = session["datasets"].get(session["current"] or "")
+    return dataset["path"] if dataset else None
 
+async def save_sessions(sessions: dict):
+    ''' Stores several session_id -> data_path entries in one pipelined round trip '''
+    now = str(time.time())
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for session_id, data_path in sessions.items():
+            entry = {"path": data_path, "rows": None, "stored_at": float(now)}
+            pipe.hset(_session_key(session_id), mapping={
+                "dataset:default": json.dumps(entry), "current": "default", "updated_at": now,
+            })
+            pipe.expire(_session_key(session_id), SESSION_TTL)
+        await pipe.execute()
 
+async def get_sessions_data(session_ids: list):
+    ''' Retrieve the current data path of several sessions at once, None for unknown ids '''
+    if not session_ids:
+        return {}
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for session_id in session_ids:
+            pipe.hgetall(_session_key(session_id))
+            pipe.expire(_session_key(session_id), SESSION_TTL)
+        replies = await pipe.execute()
+    paths = {}
+    for session_id, raw in zip(session_ids, replies[::2]):
+        session = _parse(raw or {})
+        dataset = session["datasets"].get(session["current"] or "")
+        paths[session_id] = dataset["path"] if dataset else None
+    return paths
@@ -0,0 +1,119 @@
+
+import os
+import time
+import fcntl
+import asyncio
+import hashlib
+import logging
+import tempfile
+
+logging.basicConfig(level=logging.INFO)
+
+# Lock files shared by the MCP server processes of one host, a fixed set so they never pile up
+FLIGHT_LOCK_DIR = os.getenv("FLIGHT_LOCK_DIR", os.path.join(tempfile.gettempdir(), "lucas_flights"))
+FLIGHT_LOCK_STRIPES = int(os.getenv("FLIGHT_LOCK_STRIPES", "1024"))
+FLIGHT_LOCK_TIMEOUT = float(os.getenv("FLIGHT_LOCK_TIMEOUT", "300"))  # then run without the lock
+FLIGHT_LOCK_POLL = 0.05
+
+class ProcessLock:
+    '''
+    Exclusive flock on one of FLIGHT_LOCK_STRIPES files, so calls with equal keys in different
+    processes of the pool run one after the other: the later one then finds the earlier one's
+    result in the caches below instead of fetching it again.
+    Polled without blocking, so a caller that gives up is not left holding a thread.
+    '''
+    def __init__(self, name, key):
+        digest = int(hashlib.sha256(repr((name, key)).encode()).hexdigest(), 16)
+        self.path = os.path.join(FLIGHT_LOCK_DIR, f"{name}-{digest % FLIGHT_LOCK_STRIPES}.lock")
+        self.waited = False
+        self._fd = None
+
+    async def __aenter__(self):
+        os.makedirs(FLIGHT_LOCK_DIR, exist_ok=True)
+        self._fd = os.open(self.path, os.O_CREAT | os.O_RDWR, 0o600)
+        deadline = time.monotonic() + FLIGHT_LOCK_TIMEOUT
+        while True:
+            try:
+                fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return self
+            except BlockingIOError:
+                self.waited = True
+                if time.monotonic() >= deadline:
+                    logging.warning(f"Gave up waiting for {self.path}, running without it")
+                    return self
+                await asyncio.sleep(FLIGHT_LOCK_POLL)
+            except BaseException:
+                os.close(self._fd)
+                raise
+
+    async def __aexit__(self, *exc):
+        os.close(self._fd)  # closing the descriptor releases the lock
+
+class SingleFlight:
+    '''
+    Coalesces concurrent calls with the same key: the first caller starts the work, callers arriving
+    while it runs wait for the same result (or exception) instead of repeating it.
+    The work runs in its own task, so a caller that gives up does not cancel it for the others.
+    Results are not kept once the call finishes, caching is left to the layers below.
+    With cross_process, executions of equal keys are also serialized across the processes of the
+    MCP pool through a ProcessLock, relying on a cache the processes share (the local tier) to
+    answer the later ones.
+    '''
+    def __init__(self, name, cross_process=False):
+        self.name = name
+        self.cross_process = cross_process
+        self._calls = {}  # key -> {"task", "waiters"}
+        self.metrics = {"calls": 0, "executed": 0, "coalesced": 0, "max_waiters": 0, "process_waits": 0}
+
+    async def do(self, key, fn, *args, **kwargs):
+        '''
+        Args:
+            key: hashable identity of the work, callers with equal keys share one execution
+            fn: coroutine function run once per key at a time
+        Returns:
+            fn's result
+        '''
+        self.metrics["calls"] += 1
+        call = self._calls.get(key)
+        if call is None:
+            self.metrics["executed"] += 1
+            work = self._locked(key, fn, *args, **kwargs) if self.cross_process else fn(*args, **kwargs)
+            task = asyncio.ensure_future(work)
+            call = self._calls[key] = {"task": task, "waiters": 0}
+            task.add_done_callback(lambda _: self._finished(key, task))
+        else:
+            self.metrics["coalesced"] += 1
+            logging.info(f"{self.name}: joining the in-flight call for {key} ({call['waiters']} already waiting)")
+        call["waiters"] += 1
+        self.metrics["max_waiters"] = max(self.metrics["max_waiters"], call["waiters"])
+        try:
+            return await asyncio.shield(call["task"])
+        finally:
+            call["waiters"] -= 1
+
+    async def _locked(self, key, fn, *args, **kwargs):
+        async with ProcessLock(self.name, key) as lock:
+            if lock.waited:
+                self.metrics["process_waits"] += 1
+                logging.info(f"{self.name}: {key} was in flight in another process, running after it")
+            return await fn(*args, **kwargs)
+
+    def _finished(self, key, task):
+        call = self._calls.get(key)
+        if call is not None and call["task"] is task:
+            del self._calls[key]
+        if not task.cancelled():
+            task.exception()  # retrieved here in case every caller gave up waiting
+
+    def in_flight(self):
+        ''' Keys being worked on and how many callers wait on each '''
+        return {str(key): call["waiters"] for key, call in self._calls.items()}
+
+    def snapshot(self):
+        calls = self.metrics["calls"] or 1
+        return {
+            "name": self.name,
+            **self.metrics,
+            "coalesced_rate": self.metrics["coalesced"] / calls,
+            "in_flight": self.in_flight(),
+        }
@@ -0,0 +1,83 @@
+import pandas as pd
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+pytest.importorskip("google.cloud.bigquery")
+
+import db_conn
+from db_conn import fetch_many, register_client
+
+class FakeQuery:
+    def __init__(self, table):
+        self.table = table
+
+    def to_arrow(self, bqstorage_client=None):
+        return self.table
+
+class FakeClient:
+    '''
+    Answers fetch_many's query from an in-memory market_data frame, tagging rows with the offset of
+    the request they answer as the UNNEST ... WITH OFFSET join does
+    '''
+    def __init__(self, bars):
+        self.bars = bars
+        self.queries = 0
+
+    def query(self, query, job_config=None):
+        self.queries += 1
+        rows = []
+        for req_idx, struct in enumerate(job_config.query_parameters[0].values):
+            request = struct.struct_values
+            match = self.bars[
+                (self.bars["ticker"] == request["ticker"])
+                & (self.bars["timeframe"] == request["timeframe"])
+                & (self.bars["timestamp"] >= pd.Timestamp(request["start_period"], tz="UTC"))
+                & (self.bars["timestamp"] <= pd.Timestamp(request["end_period"], tz="UTC"))
+            ]
+            rows.append(match.drop(columns=["ticker", "timeframe"]).assign(req_idx=req_idx))
+        frame = pd.concat(rows, ignore_index=True)
+        frame = frame[["req_idx", "timestamp", "open", "high", "low", "close", "volume"]]
+        return FakeQuery(pa.Table.from_pandas(frame, preserve_index=False))
+
+def _bars(ticker, timeframe, start, periods, freq):
+    stamps = pd.date_range(start, periods=periods, freq=freq, tz="UTC")
+    return pd.DataFrame({"ticker": ticker, "timeframe": timeframe, "timestamp": stamps,
+                         "open": 1.0, "high": 2.0, "low": 0.5, "close": 1.5, "volume": range(periods)})
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(db_conn, "_clients", {})
+    monkeypatch.setattr(db_conn, "_read_clients", {})
+    fake = FakeClient(pd.concat([
+        _bars("AAPL", "1h", "2024-01-01", 48, "1h"),
+        _bars("MSFT", "1h", "2024-01-01", 48, "1h"),
+        _bars("AAPL", "1day", "2024-01-01", 10, "1D"),
+    ], ignore_index=True))
+    register_client(fake)
+    return fake
+
+def test_each_request_gets_its_own_slice(client):
+    aapl = ("AAPL", "1h", "2024-01-01 00:00:00", "2024-01-01 23:00:00")
+    overlap = ("AAPL", "1h", "2024-01-01 12:00:00", "2024-01-02 05:00:00")
+    nothing = ("TSLA", "1h", "2024-01-01 00:00:00", "2024-01-02 00:00:00")
+    daily = ("AAPL", "1day", "2024-01-03 00:00:00", "2024-01-05 00:00:00")
+    results = fetch_many([aapl, overlap, nothing, daily, aapl])
+
+    assert client.queries == 1
+    assert list(results) == [aapl, overlap, nothing, daily]
+    assert len(results[aapl]) == 24 and list(results[aapl]["volume"]) == list(range(24))
+    assert len(results[overlap]) == 18 and results[overlap]["volume"].iloc[0] == 12
+    assert results[nothing].empty and list(results[nothing].columns) == list(results[aapl].columns)
+    assert list(results[daily]["timestamp"].dt.day) == [3, 4, 5]
+    assert "req_idx" not in results[aapl].columns
+
+def test_arrow_slices_share_the_result(client):
+    first = ("MSFT", "1h", "2024-01-01 00:00:00", "2024-01-01 05:00:00")
+    last = ("MSFT", "1h", "2024-01-02 18:00:00", "2024-01-02 23:00:00")
+    results = fetch_many([first, last], as_arrow=True)
+    assert results[first].num_rows == 6 and results[last].num_rows == 6
+    assert results[last].column("volume").to_pylist() == list(range(42, 48))
+
+def test_no_requests_no_query(client):
+    assert fetch_many([]) == {}
+    assert client.queries == 0
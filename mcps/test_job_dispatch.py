@@ -0,0 +1,80 @@
+import os
+import json
+import asyncio
+import tempfile
+
+os.environ.setdefault("OBJECT_STORE_DIR", tempfile.mkdtemp())
+os.environ.setdefault("SESSION_BACKEND", "memory")
+
+import pytest
+
+pytest.importorskip("google.cloud.storage")
+pytest.importorskip("google.cloud.run_v2")
+pytest.importorskip("redis")
+
+import sandbox_orchestrator
+from sandbox_orchestrator import batch_variants, get_object_store
+from result_notifier import get_notifier
+from job_dispatch import submit
+
+class SlowBatchBackend:
+    ''' Writes the batch result after every round of variants has run, as the runner would '''
+    def __init__(self, tmp_path, seconds):
+        self.tmp_path = tmp_path
+        self.seconds = seconds
+        self.cancelled = False
+
+    async def start(self, handle):
+        handle.status = "running"
+        asyncio.create_task(self._finish(handle))
+
+    async def _finish(self, handle):
+        await asyncio.sleep(self.seconds)
+        if self.cancelled:
+            return
+        local = self.tmp_path / "result.json"
+        local.write_text(json.dumps({"status": "ok", "variants": 6, "results": []}))
+        get_object_store().upload(str(local), handle.result_gs)
+        await get_notifier().publish(handle.result_gs)
+
+    async def cancel(self, handle):
+        self.cancelled = True
+
+@pytest.fixture
+def short_limits(monkeypatch):
+    monkeypatch.setattr(sandbox_orchestrator, "SCRIPT_TIMEOUT", 1)
+    monkeypatch.setattr(sandbox_orchestrator, "JOB_STARTUP_MARGIN", 0)
+    monkeypatch.setattr(sandbox_orchestrator, "RESULT_TIMEOUT", 1)
+    monkeypatch.setattr(sandbox_orchestrator, "BATCH_WORKERS", 2)
+
+def test_batch_variants_mirror_runner_expansion():
+    assert batch_variants(["a.py"]) == 1
+    assert batch_variants(["a.py", "b.py"], {"fast": [5, 10, 20], "slow": [50, 100]}) == 12
+    assert batch_variants(["a.py", "b.py"], {"fast": 5}) == 2
+    assert batch_variants(["a.py"], [{"fast": 5}, {"fast": 10}]) == 2
+
+def test_slow_batch_outlives_single_script_wait(tmp_path, short_limits):
+    ''' Three rounds of variants take longer than one script may, the wait must cover them all '''
+    async def run():
+        backend = SlowBatchBackend(tmp_path, 1.8)
+        handle = await submit("", "gs://local/data/x.parquet", "results/slow_batch.json",
+                              backend=backend, batch_gs="gs://local/batches/x.json", variants=6)
+        assert handle.timeout == 3
+        return await handle.result(), backend
+
+    result, backend = asyncio.run(run())
+    assert result["status"] == "ok"
+    assert not backend.cancelled
+
+def test_single_script_wait_times_out_and_cancels(tmp_path, short_limits):
+    async def run():
+        backend = SlowBatchBackend(tmp_path, 1.8)
+        handle = await submit("gs://local/scripts/x.py", "gs://local/data/x.parquet",
+                              "results/slow_single.json", backend=backend)
+        with pytest.raises(TimeoutError):
+            await handle.result()
+        return handle, backend
+
+    handle, backend = asyncio.run(run())
+    assert backend.cancelled
+    assert handle.status == "failed"
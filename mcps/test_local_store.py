@@ -0,0 +1,76 @@
+import multiprocessing
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("pyarrow")
+pytest.importorskip("google.cloud.bigquery")
+
+from local_store import LocalParquetStore
+
+def _bars(start, end, freq="1h"):
+    stamps = pd.date_range(start, end, freq=freq, tz="UTC")
+    return pd.DataFrame({
+        "timestamp": stamps, "open": 1.0, "high": 2.0, "low": 0.5, "close": 1.5, "volume": 10.0,
+    })
+
+def test_eviction_by_one_process_is_a_gap_for_the_others(tmp_path):
+    ''' Two stores on one directory stand in for two children of the MCP pool '''
+    first = LocalParquetStore(str(tmp_path), max_bytes=10 ** 9)
+    second = LocalParquetStore(str(tmp_path), max_bytes=10 ** 9)
+    first.write("AAPL", "1h", _bars("2024-01-01", "2024-02-29 23:00"), [("2024-01-01", "2024-02-29 23:00")])
+
+    bars, missing = second.read("AAPL", "1h", "2024-01-10", "2024-02-10")
+    assert missing == [] and len(bars) == len(_bars("2024-01-10", "2024-02-10"))
+
+    # The first store evicts January, the second must not serve February alone as the whole window
+    first.max_bytes = first._partitions[str(tmp_path / "AAPL" / "1h" / "2024-02.parquet")]
+    first._evict()
+    bars, missing = second.read("AAPL", "1h", "2024-01-10", "2024-02-10")
+    assert bars["timestamp"].min() >= pd.Timestamp("2024-02-01", tz="UTC")
+    assert missing[0][0] == pd.Timestamp("2024-01-10", tz="UTC")
+    assert missing[-1][1] >= pd.Timestamp("2024-01-31 23:00", tz="UTC")
+
+    # Nor may its next write bring January's coverage back without the bars
+    second.write("AAPL", "1h", _bars("2024-02-11", "2024-02-12"), [("2024-02-11", "2024-02-12")])
+    _, missing = first.read("AAPL", "1h", "2024-01-10", "2024-01-20")
+    assert missing
+
+def test_spans_without_bars_stay_covered(tmp_path):
+    store = LocalParquetStore(str(tmp_path), max_bytes=10 ** 9)
+    store.write("AAPL", "1day", _bars("2024-03-01", "2024-03-29", "1D"), [("2024-03-01", "2024-04-07")])
+    bars, missing = store.read("AAPL", "1day", "2024-03-25", "2024-04-07")
+    assert missing == []
+    assert bars["timestamp"].max() == pd.Timestamp("2024-03-29", tz="UTC")
+
+def _write_month(root, month):
+    store = LocalParquetStore(root, max_bytes=10 ** 9)
+    start = pd.Period(month, freq="M").start_time
+    end = start + pd.offsets.MonthEnd(0) + pd.Timedelta(hours=23)
+    store.write("AAPL", "1h", _bars(start, end), [(start, end + pd.Timedelta(hours=1))])
+
+def test_processes_share_coverage_and_budget(tmp_path):
+    root = str(tmp_path)
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=_write_month, args=(root, m)) for m in ("2024-01", "2024-02", "2024-03")]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(60)
+        assert worker.exitcode == 0
+
+    # Written by other processes, so both coverage and sizes come from disk
+    store = LocalParquetStore(root, max_bytes=10 ** 9)
+    bars, missing = store.read("AAPL", "1h", "2024-01-01", "2024-03-31 23:00")
+    assert missing == [] and len(bars) == len(_bars("2024-01-01", "2024-03-31 23:00"))
+
+    # The budget counts every process's partitions, not only the ones this store wrote
+    partition = store._partitions[str(tmp_path / "AAPL" / "1h" / "2024-02.parquet")]
+    store.max_bytes = 2 * partition
+    before = len(store._scan())
+    store._partitions.clear()
+    store._total = 0
+    store._evict()
+    on_disk = store._scan()
+    assert sum(on_disk.values()) <= store.max_bytes
+    assert len(on_disk) < before
@@ -0,0 +1,69 @@
+import pandas as pd
+import pytest
+
+import market_writer
+from market_writer import LocalSink, MarketDataWriter
+
+def _bars(start, periods, close=1.5):
+    stamps = pd.date_range(start, periods=periods, freq="1h", tz="UTC")
+    return pd.DataFrame({"timestamp": stamps, "open": 1.0, "high": 2.0, "low": 0.5, "close": close, "volume": 10.0})
+
+class FailingSink:
+    def __init__(self):
+        self.attempts = 0
+
+    def write(self, batch):
+        self.attempts += 1
+        raise RuntimeError("table unavailable")
+
+@pytest.fixture
+def writer_factory():
+    writers = []
+
+    def make(sink):
+        # Flushed by hand: the background thread only wakes up at close
+        writer = MarketDataWriter(sink, max_rows=10 ** 9, flush_interval=3600)
+        writers.append(writer)
+        return writer
+    yield make
+    for writer in writers:
+        writer.close()
+
+def test_overlapping_frames_are_written_once(writer_factory):
+    sink = LocalSink()
+    writer = writer_factory(sink)
+    writer.submit("AAPL", "1h", _bars("2024-01-01", 24))
+    writer.submit("AAPL", "1h", _bars("2024-01-01 12:00", 24, close=1.6))
+    writer.submit("MSFT", "1h", _bars("2024-01-01", 24))
+    assert writer.flush() == 24 + 12 + 24
+    assert sink.batches == 1
+    assert writer.metrics["duplicates_dropped"] == 12
+    # The later frame wins on overlap
+    assert sink.rows[("AAPL", "1h", pd.Timestamp("2024-01-01 12:00", tz="UTC"))][3] == 1.6
+    assert writer.flush() == 0
+
+def test_queued_bars_are_served_until_flushed(writer_factory):
+    writer = writer_factory(LocalSink())
+    writer.submit("AAPL", "1h", _bars("2024-01-01", 48))
+    start, end = pd.Timestamp("2024-01-01 10:00", tz="UTC"), pd.Timestamp("2024-01-01 19:00", tz="UTC")
+    parts = writer.pending("AAPL", "1h", start, end)
+    assert len(parts) == 1 and len(parts[0]) == 10
+    assert writer.pending("AAPL", "1day", start, end) == []
+    writer.flush()
+    assert writer.pending("AAPL", "1h", start, end) == []
+
+def test_frames_are_retried_then_reported_dropped(writer_factory, monkeypatch):
+    dropped = []
+    monkeypatch.setattr(market_writer, "_drop_listeners", [lambda *span: dropped.append(span)])
+    sink = FailingSink()
+    writer = writer_factory(sink)
+    frame = _bars("2024-01-01", 5)
+    writer.submit("AAPL", "1h", frame)
+    for attempt in range(market_writer.MAX_RETRIES - 1):
+        assert writer.flush() == 0
+        assert dropped == []
+        assert len(writer.pending("AAPL", "1h", frame["timestamp"].min(), frame["timestamp"].max())) == 1
+    assert writer.flush() == 0
+    assert sink.attempts == market_writer.MAX_RETRIES
+    assert dropped == [("AAPL", "1h", frame["timestamp"].min(), frame["timestamp"].max())]
+    assert writer.pending("AAPL", "1h", frame["timestamp"].min(), frame["timestamp"].max()) == []
@@ -0,0 +1,75 @@
+import os
+import json
+import asyncio
+import tempfile
+
+os.environ.setdefault("OBJECT_STORE_DIR", tempfile.mkdtemp())
+os.environ.setdefault("SESSION_BACKEND", "memory")
+
+import pytest
+
+pytest.importorskip("google.cloud.storage")
+pytest.importorskip("google.cloud.run_v2")
+pytest.importorskip("redis")
+
+from progress_stream import FileProgressReader
+from job_dispatch import JobHandle
+
+def _append(reader, result_path, text):
+    path = reader.path(result_path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(text)
+
+def test_reader_only_returns_whole_lines(tmp_path):
+    reader = FileProgressReader(str(tmp_path))
+
+    async def run():
+        events, cursor = await reader.read("results/a.json", block=0)
+        assert events == [] and cursor == 0
+        _append(reader, "results/a.json", json.dumps({"type": "phase", "phase": "running"}) + "\n" + '{"type": "pro')
+        first, cursor = await reader.read("results/a.json", cursor, block=0)
+        _append(reader, "results/a.json", 'gress", "done": 5}\n')
+        second, cursor = await reader.read("results/a.json", cursor, block=0)
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == [{"type": "phase", "phase": "running"}]
+    assert second == [{"type": "progress", "done": 5}]
+
+def test_handle_streams_events_until_the_end_event(tmp_path, monkeypatch):
+    reader = FileProgressReader(str(tmp_path))
+    monkeypatch.setattr("job_dispatch.get_progress_reader", lambda: reader)
+    handle = JobHandle(backend=None, code_gs="gs://b/s.py", data_gs="gs://b/d.parquet", result_gs="results/b.json")
+    events = [
+        {"type": "phase", "phase": "running"},
+        {"type": "progress", "done": 50, "total": 100},
+        {"type": "log", "stream": "stdout", "text": "half way\n"},
+        {"type": "end", "status": "ok"},
+        {"type": "log", "stream": "stdout", "text": "after the end\n"},
+    ]
+
+    async def run():
+        async def publish():
+            for event in events:
+                _append(reader, "results/b.json", json.dumps(event) + "\n")
+                await asyncio.sleep(0.02)
+        publisher = asyncio.create_task(publish())
+        seen = [event async for event in handle.progress(block=0.01)]
+        await publisher
+        return seen
+
+    assert asyncio.run(run()) == events[:4]
+
+def test_finished_handle_drains_what_is_left(tmp_path, monkeypatch):
+    ''' A run that ended without an end event still yields the events already published '''
+    reader = FileProgressReader(str(tmp_path))
+    monkeypatch.setattr("job_dispatch.get_progress_reader", lambda: reader)
+    handle = JobHandle(backend=None, code_gs="gs://b/s.py", data_gs="gs://b/d.parquet", result_gs="results/c.json")
+    _append(reader, "results/c.json", json.dumps({"type": "phase", "phase": "running"}) + "\n")
+    handle.status = "failed"
+
+    async def run():
+        return [event async for event in handle.progress(block=0.01)]
+
+    assert asyncio.run(run()) == [{"type": "phase", "phase": "running"}]
@@ -0,0 +1,125 @@
+import os
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("google.cloud.bigquery")
+
+import range_cache
+from range_cache import RangeIndex, contiguous_runs
+
+def _t(day, hour=0):
+    return pd.Timestamp(f"2024-01-{day:02d} {hour:02d}:00", tz="UTC")
+
+def test_index_merges_overlapping_and_touching_spans():
+    index = RangeIndex([(_t(5), _t(8)), (_t(1), _t(3))])
+    assert index.spans() == [(_t(1), _t(3)), (_t(5), _t(8))]
+    index.add(_t(3), _t(5))
+    assert index.spans() == [(_t(1), _t(8))]
+    index.add(_t(10), _t(12))
+    index.add(_t(2), _t(4))
+    index.add(_t(9), _t(8))  # empty span
+    assert index.spans() == [(_t(1), _t(8)), (_t(10), _t(12))]
+
+def test_index_missing_and_covered():
+    index = RangeIndex([(_t(2), _t(4)), (_t(6), _t(8))])
+    assert index.missing(_t(1), _t(10)) == [(_t(1), _t(2)), (_t(4), _t(6)), (_t(8), _t(10))]
+    assert index.covered(_t(3), _t(7)) == [(_t(3), _t(4)), (_t(6), _t(7))]
+    assert index.missing(_t(2), _t(4)) == []
+    assert index.missing(_t(5), _t(5, 12)) == [(_t(5), _t(5, 12))]
+    assert RangeIndex().missing(_t(1), _t(2)) == [(_t(1), _t(2))]
+
+def test_index_remove_splits_and_drops_spans():
+    index = RangeIndex([(_t(1), _t(10)), (_t(12), _t(14)), (_t(20), _t(22))])
+    index.remove(_t(4), _t(6))
+    assert index.spans() == [(_t(1), _t(4)), (_t(6), _t(10)), (_t(12), _t(14)), (_t(20), _t(22))]
+    index.remove(_t(9), _t(21))
+    assert index.spans() == [(_t(1), _t(4)), (_t(6), _t(9)), (_t(21), _t(22))]
+    assert index.missing(_t(3), _t(7)) == [(_t(4), _t(6))]
+    index.remove(_t(1), _t(30))
+    assert len(index) == 0
+
+def _session_bars(first_day, last_day, freq="15min", drop=()):
+    ''' Weekday-only bars of a US equity session, which opens an hour earlier in UTC after the DST switch '''
+    stamps = []
+    for day in pd.bdate_range(first_day, last_day):
+        if str(day.date()) in drop:
+            continue
+        opens = day + (pd.Timedelta("13:30:00") if day >= pd.Timestamp("2024-03-10") else pd.Timedelta("14:30:00"))
+        stamps.extend(pd.date_range(opens, opens + pd.Timedelta(hours=6, minutes=15), freq=freq))
+    return pd.DatetimeIndex(stamps).tz_localize("UTC")
+
+def test_nights_and_weekends_are_not_holes():
+    stamps = _session_bars("2024-03-04", "2024-03-22")
+    assert contiguous_runs(stamps, "15min") == [(stamps[0], stamps[-1])]
+
+def test_a_missing_session_is_a_hole():
+    stamps = _session_bars("2024-03-04", "2024-03-22", drop=("2024-03-13",))
+    runs = contiguous_runs(stamps, "15min")
+    assert len(runs) == 2
+    assert runs[0][1].date() == pd.Timestamp("2024-03-12").date()
+    assert runs[1][0].date() == pd.Timestamp("2024-03-14").date()
+
+def test_weekday_daily_bars():
+    days = pd.bdate_range("2024-01-01", "2024-03-29", tz="UTC")
+    assert contiguous_runs(days, "1day") == [(days[0], days[-1])]
+    runs = contiguous_runs(days.delete(30), "1day")
+    assert len(runs) == 2 and runs[0][1] == days[29] and runs[1][0] == days[31]
+
+def test_short_series_keeps_every_gap():
+    ''' Under a week of bars says nothing about closures, so overnight gaps stay gaps '''
+    stamps = _session_bars("2024-03-04", "2024-03-06")
+    assert len(contiguous_runs(stamps, "15min")) == 3
+
+def test_seeding_from_the_table_skips_closures(monkeypatch):
+    stamps = _session_bars("2024-03-04", "2024-03-22")
+    stored = pd.DataFrame({"timestamp": stamps, "open": 1.0, "high": 1.0, "low": 1.0, "close": 1.0, "volume": 1.0})
+    monkeypatch.setattr(range_cache, "fetch_many", lambda windows: {w: stored for w in windows})
+    monkeypatch.setattr(range_cache, "_indexes", {})
+    monkeypatch.setattr(range_cache, "_fetch_locks", {})
+    monkeypatch.setattr(range_cache, "_watch_drops", lambda: None)
+    monkeypatch.setattr(range_cache, "pending_bars", lambda *args: [])
+    calls = []
+
+    def vendor(ticker, interval, start, end):
+        calls.append((start, end))
+        return pd.DataFrame(columns=stored.columns)
+
+    frames, covered, rows = asyncio.run(range_cache._fetch_span("SPY", "15min", stamps[0], stamps[-1], vendor))
+    assert calls == []
+    assert covered == [(stamps[0], stamps[-1])]
+
+def _child_fetch(store_dir, start, end):
+    ''' One MCP pool child serving a window, the table and writer faked, the local tier real '''
+    os.environ["LOCAL_STORE_DIR"] = store_dir
+    import range_cache as child_cache
+    empty = pd.DataFrame(columns=["timestamp", "open", "high", "low", "close", "volume"])
+    child_cache.fetch_many = lambda windows: {w: empty for w in windows}
+    child_cache.store_in_db = lambda *args: True
+    child_cache.pending_bars = lambda *args: []
+    calls = []
+
+    def vendor(ticker, interval, gap_start, gap_end):
+        calls.append((gap_start, gap_end))
+        stamps = pd.date_range(gap_start.ceil("1h"), gap_end, freq="1h")
+        return pd.DataFrame({"timestamp": stamps, "open": 1.0, "high": 1.0, "low": 1.0, "close": 1.0, "volume": 1.0})
+
+    bars = asyncio.run(child_cache.cached_fetch("BTC/USD", "1h", start, end, vendor))
+    return len(bars), len(calls)
+
+def test_children_share_the_local_tier_not_their_indexes(tmp_path):
+    '''
+    Range indexes and the write-behind buffer are per child, the local tier is what a later child
+    reads the earlier one's fetch from, even when its own index was seeded before that fetch
+    '''
+    pytest.importorskip("pyarrow")
+    context = multiprocessing.get_context("spawn")
+    store = str(tmp_path)
+    with ProcessPoolExecutor(1, mp_context=context) as first, ProcessPoolExecutor(1, mp_context=context) as second:
+        assert second.submit(_child_fetch, store, "2024-01-01", "2024-01-10").result(60) == (217, 1)
+        assert first.submit(_child_fetch, store, "2024-01-10", "2024-01-20").result(60) == (241, 1)
+        rows, calls = second.submit(_child_fetch, store, "2024-01-01", "2024-01-20").result(60)
+    assert (rows, calls) == (457, 0)
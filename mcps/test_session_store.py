@@ -0,0 +1,85 @@
+import os
+import asyncio
+
+os.environ.setdefault("SESSION_BACKEND", "memory")
+
+import pytest
+
+pytest.importorskip("redis")
+
+import session_store
+from session_store import (
+    MemoryBackend, get_session, get_session_data, get_sessions_data, save_dataset, save_result,
+    save_script, save_session, save_sessions, update_dataset,
+)
+
+@pytest.fixture(autouse=True)
+def backend(monkeypatch):
+    fresh = MemoryBackend()
+    monkeypatch.setattr(session_store, "redis_client", fresh)
+    return fresh
+
+def test_session_state_round_trip():
+    async def run():
+        await save_dataset("s1", "AAPL|1h|2024-01-01|2024-02-01", "/data/aapl.parquet", rows=500)
+        await update_dataset("s1", "AAPL|1h|2024-01-01|2024-02-01", gcs_path="gs://bucket/data/abc.parquet")
+        await save_script("s1", "momentum", "gs://bucket/scripts/m.py", content_hash="abc")
+        await save_result("s1", "gs://bucket/scripts/m.py|AAPL", "gs://bucket/scripts/m.py",
+                          "gs://bucket/data/abc.parquet", {"status": "ok", "Sharpe Ratio": 1.2})
+        return await get_session("s1")
+
+    session = asyncio.run(run())
+    assert session["current"] == "AAPL|1h|2024-01-01|2024-02-01"
+    dataset = session["datasets"]["AAPL|1h|2024-01-01|2024-02-01"]
+    assert dataset["path"] == "/data/aapl.parquet" and dataset["rows"] == 500
+    assert dataset["gcs_path"] == "gs://bucket/data/abc.parquet"
+    assert session["scripts"]["momentum"]["hash"] == "abc"
+    result = session["results"]["gs://bucket/scripts/m.py|AAPL"]
+    assert result["metrics"] == {"status": "ok", "Sharpe Ratio": 1.2} and len(result["result_hash"]) == 32
+
+def test_current_dataset_follows_the_latest_save():
+    async def run():
+        await save_session("s1", "/data/first.parquet", dataset_key="first")
+        await save_session("s1", "/data/second.parquet", dataset_key="second")
+        session = await get_session("s1")
+        return session, await get_session_data("s1"), await get_session_data("unknown")
+
+    session, path, unknown = asyncio.run(run())
+    assert set(session["datasets"]) == {"first", "second"}
+    assert path == "/data/second.parquet"
+    assert unknown is None
+
+def test_pipelined_batch_round_trip():
+    async def run():
+        await save_sessions({"a": "/data/a.parquet", "b": "/data/b.parquet"})
+        return await get_sessions_data(["a", "b", "c"])
+
+    assert asyncio.run(run()) == {"a": "/data/a.parquet", "b": "/data/b.parquet", "c": None}
+    assert asyncio.run(get_sessions_data([])) == {}
+
+def test_reads_slide_the_ttl_and_expired_sessions_are_gone(backend, monkeypatch):
+    async def run():
+        await save_session("s1", "/data/a.parquet")
+        first = backend._expiry["session:s1"]
+        await asyncio.sleep(0.01)
+        await get_session("s1")
+        slid = backend._expiry["session:s1"] > first
+        monkeypatch.setattr(session_store, "SESSION_TTL", 0)
+        await get_session("s1")
+        return slid, await get_session("s1")
+
+    slid, expired = asyncio.run(run())
+    assert slid
+    assert expired["current"] is None and expired["datasets"] == {}
+
+def test_memory_pipeline_returns_replies_in_order(backend):
+    async def run():
+        async with backend.pipeline() as pipe:
+            pipe.set("k", "v", ex=60)
+            pipe.get("k")
+            pipe.hset("h", mapping={"x": "1"})
+            pipe.hget("h", "x")
+            pipe.delete("k", "missing")
+            return await pipe.execute()
+
+    assert asyncio.run(run()) == [True, "v", 1, "1", 1]
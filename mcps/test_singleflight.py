@@ -0,0 +1,95 @@
+import asyncio
+import multiprocessing
+import time
+
+import pytest
+
+import singleflight
+from singleflight import SingleFlight
+
+def test_concurrent_equal_keys_share_one_execution():
+    flight = SingleFlight("test")
+    runs = []
+
+    async def work(value):
+        runs.append(value)
+        await asyncio.sleep(0.05)
+        return value * 2
+
+    async def run():
+        results = await asyncio.gather(
+            *(flight.do("a", work, 1) for _ in range(5)),
+            flight.do("b", work, 10),
+        )
+        return results, flight.in_flight()
+
+    results, in_flight = asyncio.run(run())
+    assert results == [2, 2, 2, 2, 2, 20]
+    assert runs == [1, 10]
+    assert flight.metrics["executed"] == 2 and flight.metrics["coalesced"] == 4
+    assert flight.metrics["max_waiters"] == 5
+    assert in_flight == {}
+
+def test_every_waiter_gets_the_exception_and_the_next_call_runs_again():
+    flight = SingleFlight("test")
+    runs = []
+
+    async def work():
+        runs.append(1)
+        await asyncio.sleep(0.02)
+        raise ValueError("vendor down")
+
+    async def run():
+        first = await asyncio.gather(*(flight.do("k", work) for _ in range(3)), return_exceptions=True)
+        with pytest.raises(ValueError):
+            await flight.do("k", work)
+        return first
+
+    first = asyncio.run(run())
+    assert all(isinstance(e, ValueError) for e in first)
+    assert len(runs) == 2
+
+def test_a_caller_giving_up_does_not_cancel_the_others():
+    flight = SingleFlight("test")
+
+    async def work():
+        await asyncio.sleep(0.05)
+        return "bars"
+
+    async def run():
+        impatient = asyncio.ensure_future(flight.do("k", work))
+        patient = asyncio.ensure_future(flight.do("k", work))
+        await asyncio.sleep(0.01)
+        impatient.cancel()
+        return await patient, impatient.cancelled()
+
+    assert asyncio.run(run()) == ("bars", True)
+
+def _locked_run(lock_dir, log_path, started):
+    singleflight.FLIGHT_LOCK_DIR = lock_dir
+    flight = SingleFlight("test", cross_process=True)
+
+    async def work():
+        with open(log_path, "a") as f:
+            f.write(f"start {time.monotonic()}\n")
+        await asyncio.sleep(0.3)
+        with open(log_path, "a") as f:
+            f.write(f"end {time.monotonic()}\n")
+
+    started.set()
+    asyncio.run(flight.do("AAPL|1h", work))
+    return flight.metrics["process_waits"]
+
+def test_equal_keys_run_one_after_the_other_across_processes(tmp_path):
+    context = multiprocessing.get_context("spawn")
+    log_path = str(tmp_path / "runs.log")
+    with context.Manager() as manager, context.Pool(2) as pool:
+        started = manager.Event()
+        first = pool.apply_async(_locked_run, (str(tmp_path), log_path, started))
+        started.wait(30)
+        time.sleep(0.1)
+        second = pool.apply_async(_locked_run, (str(tmp_path), log_path, started))
+        waits = first.get(60) + second.get(60)
+    events = [line.split()[0] for line in open(log_path)]
+    assert events == ["start", "end", "start", "end"]
+    assert waits == 1
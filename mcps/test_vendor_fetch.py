@@ -0,0 +1,28 @@
+import asyncio
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("google.cloud.bigquery")
+
+from vendor_fetch import ChunkedFetcher, FakeVendor, TokenBucket, split_range
+
+def _fetcher(vendor, max_bars):
+    return ChunkedFetcher("twelvedata", vendor, max_bars=max_bars, bucket=TokenBucket(1e6, 1e6))
+
+def test_off_grid_start_keeps_every_bar():
+    start, end = pd.Timestamp("2024-01-01 00:07", tz="UTC"), pd.Timestamp("2024-01-03 09:00", tz="UTC")
+    chunks = split_range(start, end, "15min", 50)
+    assert chunks[0][0] == start and chunks[-1][1] == end
+    assert all(prev[1] == nxt[0] for prev, nxt in zip(chunks, chunks[1:]))
+
+    vendor = FakeVendor(max_bars=50, per_second=1e6, latency=0)
+    bars = asyncio.run(_fetcher(vendor, 50).fetch("TEST", "15min", start, end))
+    expected = pd.date_range(start.ceil("15min"), end, freq="15min")
+    assert list(bars["timestamp"]) == list(expected)
+
+def test_deterministic_errors_are_not_retried():
+    vendor = FakeVendor(max_bars=10, per_second=1e6, latency=0)
+    with pytest.raises(ValueError):
+        asyncio.run(_fetcher(vendor, 100).fetch("TEST", "1h", "2024-01-01", "2024-01-03"))
+    assert vendor.requests == 1
@@ -0,0 +1,359 @@
+
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+import pandas as pd
+from range_cache import to_utc, INTERVAL_STEPS
+
+logging.basicConfig(level=logging.INFO)
+
+BAR_COLUMNS = ["timestamp", "open", "high", "low", "close", "volume"]
+
+# Per-request bar caps and request rates of each vendor's plan, per API key
+VENDOR_LIMITS = {
+    "twelvedata": {
+        "max_bars": int(os.getenv("TWELVEDATA_MAX_BARS", "5000")),
+        "per_minute": float(os.getenv("TWELVEDATA_RPM", "8")),
+        "burst": int(os.getenv("TWELVEDATA_BURST", "8")),
+    },
+    "polygon": {
+        "max_bars": int(os.getenv("POLYGON_MAX_BARS", "50000")),
+        "per_minute": float(os.getenv("POLYGON_RPM", "5")),
+        "burst": int(os.getenv("POLYGON_BURST", "5")),
+    },
+}
+FETCH_CONCURRENCY = int(os.getenv("VENDOR_FETCH_CONCURRENCY", "4"))  # chunks in flight per fetch
+FETCH_RETRIES = int(os.getenv("VENDOR_FETCH_RETRIES", "5"))
+FETCH_BACKOFF = float(os.getenv("VENDOR_FETCH_BACKOFF", "2"))
+
+class RateLimited(Exception):
+    ''' The vendor refused a request for exceeding the rate limit '''
+    def __init__(self, message="rate limited", retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+def is_rate_limited(error):
+    ''' 429s as raised by the twelvedata and polygon SDKs (or RateLimited) '''
+    if isinstance(error, RateLimited):
+        return True
+    status = getattr(error, "status", None) or getattr(getattr(error, "response", None), "status_code", None)
+    text = str(error).lower()
+    return status == 429 or "429" in text or "rate limit" in text or "api credits" in text
+
+def is_transient(error):
+    ''' Failures worth another attempt: 429s, 5xx answers, timeouts and dropped connections '''
+    if is_rate_limited(error) or isinstance(error, OSError):  # ConnectionError, TimeoutError, requests errors
+        return True
+    status = getattr(error, "status", None) or getattr(getattr(error, "response", None), "status_code", None)
+    text = type(error).__name__.lower()
+    return (isinstance(status, int) and status >= 500) or "timeout" in text or "connection" in text
+
+# ------------ Token Bucket ---------------
+
+class TokenBucket:
+    '''
+    Allows `rate` requests per second with bursts up to `capacity`.
+    pause() holds every caller back after the vendor answered 429.
+    '''
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self):
+        ''' Takes a token, returns how long the caller must wait before using it '''
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+            return max(wait, self.paused_until - now)
+
+    async def acquire(self):
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        return wait
+
+    def pause(self, seconds):
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            # The vendor's window is spent: start refilling from empty
+            self.tokens = min(self.tokens, 0.0)
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+def get_bucket(vendor, api_key=None):
+    ''' One bucket per vendor and API key, shared by every fetch in the process '''
+    key = (vendor, api_key)
+    with _buckets_lock:
+        if key not in _buckets:
+            limits = VENDOR_LIMITS[vendor]
+            _buckets[key] = TokenBucket(limits["per_minute"] / 60.0, limits["burst"])
+        return _buckets[key]
+
+# ------------ Chunking ---------------
+
+def split_range(start, end, interval, max_bars):
+    '''
+    Splits [start, end] into consecutive windows of at most max_bars bars of `interval`.
+    Each window starts where the previous one ended, so no bar is skipped when start is off the
+    interval grid; a bar on a shared boundary comes back twice and is deduplicated by the caller.
+    Returns:
+        list of (start, end) UTC timestamps; calendar time, so sessions with gaps give fewer bars
+    '''
+    start, end = to_utc(start), to_utc(end)
+    step = INTERVAL_STEPS.get(interval)
+    if step is None or end <= start:
+        return [(start, end)]
+    width = step * max(1, max_bars - 1)
+    chunks = []
+    cursor = start
+    while cursor < end:
+        chunk_end = min(cursor + width, end)
+        chunks.append((cursor, chunk_end))
+        cursor = chunk_end
+    return chunks
+
+def _bars(frame):
+    ''' Vendor frame to the bar columns, timestamps in UTC '''
+    if frame is None or len(frame) == 0:
+        return pd.DataFrame(columns=BAR_COLUMNS)
+    frame = frame.copy()
+    frame["timestamp"] = pd.to_datetime(frame["timestamp"], utc=True)
+    for column in ("open", "high", "low", "close", "volume"):
+        if column not in frame:
+            frame[column] = 0.0
+    return frame[BAR_COLUMNS]
+
+# ------------ Fetcher ---------------
+
+class ChunkedFetcher:
+    '''
+    Fetches a window from one vendor in chunks the vendor accepts, FETCH_CONCURRENCY chunks at a time,
+    each request taking a token from the vendor/key bucket. 429s pause the bucket and are retried with
+    backoff. Every chunk is handed to on_chunk as soon as it arrives (the market data writer), so a
+    long fetch that fails halfway keeps what it already got.
+    Usable as the vendor_fetch of range_cache.cached_fetch.
+    '''
+    def __init__(self, vendor, fetch_chunk, api_key=None, on_chunk=None, concurrency=FETCH_CONCURRENCY,
+                 max_bars=None, bucket=None):
+        '''
+        Args:
+            vendor: key of VENDOR_LIMITS
+            fetch_chunk: sync callable (ticker, interval, start, end) -> DataFrame with a timestamp column
+            on_chunk: callable (ticker, interval, bars) run for every chunk, e.g. db_conn.store_in_db
+        '''
+        self.vendor = vendor
+        self.fetch_chunk = fetch_chunk
+        self.on_chunk = on_chunk
+        self.concurrency = concurrency
+        self.max_bars = max_bars or VENDOR_LIMITS[vendor]["max_bars"]
+        self.bucket = bucket or get_bucket(vendor, api_key)
+        # range_cache writes the vendor rows itself unless the fetcher already streamed them
+        self.stores_chunks = on_chunk is not None
+        self.metrics = {"fetches": 0, "chunks": 0, "rate_limited": 0, "retries": 0, "throttled_seconds": 0.0, "rows": 0}
+
+    async def _chunk(self, ticker, interval, start, end):
+        for attempt in range(FETCH_RETRIES + 1):
+            self.metrics["throttled_seconds"] += await self.bucket.acquire()
+            try:
+                frame = await asyncio.to_thread(self.fetch_chunk, ticker, interval, start, end)
+            except Exception as e:
+                # Bad symbols, intervals or oversized requests fail the same way every time
+                if attempt == FETCH_RETRIES or not is_transient(e):
+                    raise
+                delay = FETCH_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5)
+                if is_rate_limited(e):
+                    self.metrics["rate_limited"] += 1
+                    delay = getattr(e, "retry_after", None) or delay
+                    self.bucket.pause(delay)
+                    logging.warning(f"{self.vendor} rate limited on {ticker} {start}..{end}, retrying in {delay:.1f}s")
+                else:
+                    logging.warning(f"{self.vendor} fetch of {ticker} {start}..{end} failed ({e}), retrying in {delay:.1f}s")
+                self.metrics["retries"] += 1
+                await asyncio.sleep(delay)
+                continue
+            bars = _bars(frame)
+            self.metrics["chunks"] += 1
+            self.metrics["rows"] += len(bars)
+            if self.on_chunk is not None and not bars.empty:
+                await asyncio.to_thread(self.on_chunk, ticker, interval, bars)
+            return bars
+
+    async def fetch(self, ticker, interval, start, end):
+        '''
+        Returns:
+            DataFrame of the window's bars, one per timestamp in time order
+        '''
+        self.metrics["fetches"] += 1
+        chunks = split_range(start, end, interval, self.max_bars)
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def limited(chunk_start, chunk_end):
+            async with semaphore:
+                return await self._chunk(ticker, interval, chunk_start, chunk_end)
+
+        frames = await asyncio.gather(*(limited(s, e) for s, e in chunks))
+        frames = [f for f in frames if not f.empty]
+        if not frames:
+            return pd.DataFrame(columns=BAR_COLUMNS)
+        bars = pd.concat(frames, ignore_index=True).drop_duplicates(subset="timestamp")
+        logging.info(f"{self.vendor}: {ticker} ({interval}) {len(bars)} bars in {len(chunks)} chunks")
+        return bars.sort_values("timestamp", ignore_index=True)
+
+    async def __call__(self, ticker, interval, start, end):
+        return await self.fetch(ticker, interval, start, end)
+
+# ------------ Vendors ---------------
+
+CRYPTO_BASES = {"BTC", "ETH", "SOL", "XRP", "LTC", "BNB", "ADA", "DOGE", "DOT", "AVAX", "USDT", "USDC"}
+POLYGON_SPANS = {
+    "1min": (1, "minute"), "5min": (5, "minute"), "15min": (15, "minute"), "30min": (30, "minute"),
+    "45min": (45, "minute"), "1h": (1, "hour"), "2h": (2, "hour"), "4h": (4, "hour"), "8h": (8, "hour"),
+    "1day": (1, "day"), "1week": (1, "week"), "1month": (1, "month"),
+}
+
+def twelvedata_chunk(api_key):
+    from twelvedata import TDClient
+    client = TDClient(apikey=api_key)
+    fmt = "%Y-%m-%d %H:%M:%S"
+
+    def fetch(ticker, interval, start, end):
+        frame = client.time_series(
+            symbol=ticker, interval=interval, outputsize=VENDOR_LIMITS["twelvedata"]["max_bars"],
+            start_date=start.strftime(fmt), end_date=end.strftime(fmt), timezone="UTC",
+        ).as_pandas()
+        return frame.rename_axis("timestamp").reset_index()
+    return fetch
+
+def polygon_ticker(ticker):
+    ''' "EUR/USD" -> "C:EURUSD", "BTC/USD" -> "X:BTCUSD", stocks unchanged '''
+    if "/" not in ticker:
+        return ticker
+    base, quote = ticker.upper().split("/", 1)
+    return f"{'X' if base in CRYPTO_BASES else 'C'}:{base}{quote}"
+
+def polygon_chunk(api_key):
+    from polygon import RESTClient
+    client = RESTClient(api_key)
+
+    def fetch(ticker, interval, start, end):
+        multiplier, timespan = POLYGON_SPANS[interval]
+        aggs = client.get_aggs(
+            polygon_ticker(ticker), multiplier, timespan,
+            int(start.timestamp() * 1000), int(end.timestamp() * 1000),
+            limit=VENDOR_LIMITS["polygon"]["max_bars"],
+        )
+        return pd.DataFrame({
+            "timestamp": pd.to_datetime([a.timestamp for a in aggs], unit="ms", utc=True),
+            "open": [a.open for a in aggs], "high": [a.high for a in aggs], "low": [a.low for a in aggs],
+            "close": [a.close for a in aggs], "volume": [a.volume for a in aggs],
+        })
+    return fetch
+
+VENDOR_CLIENTS = {
+    "twelvedata": (twelvedata_chunk, "TWELVEDATA_API_KEY"),
+    "polygon": (polygon_chunk, "POLYGON_API_KEY"),
+}
+
+def make_vendor_fetch(vendor=None, api_key=None, store=True):
+    '''
+    The chunked, rate-limited fetcher of a vendor, to pass as cached_fetch's vendor_fetch
+    Args:
+        vendor: "twelvedata" or "polygon", MARKET_DATA_VENDOR by default
+        api_key: the vendor's key, read from its environment variable by default
+        store: stream every chunk into market_data as it arrives
+    '''
+    vendor = vendor or os.getenv("MARKET_DATA_VENDOR", "twelvedata")
+    build, key_env = VENDOR_CLIENTS[vendor]
+    api_key = api_key or os.getenv(key_env)
+    on_chunk = None
+    if store:
+        from db_conn import store_in_db
+        on_chunk = store_in_db
+    return ChunkedFetcher(vendor, build(api_key), api_key=api_key, on_chunk=on_chunk)
+
+# ------------ Fake Vendor ---------------
+
+class FakeVendor:
+    '''
+    Local vendor that enforces a bar cap per request and a request rate, for tests and benchmarks.
+    Bars sit on the interval grid like a real vendor's and are a deterministic random walk,
+    so chunked and one-shot fetches can be compared.
+    '''
+    def __init__(self, max_bars=500, per_second=20.0, latency=0.02):
+        self.max_bars = max_bars
+        self.per_second = per_second
+        self.latency = latency
+        self.requests = 0
+        self.rejected = 0
+        self.too_large = 0
+        self._recent = []
+        self._lock = threading.Lock()
+
+    def __call__(self, ticker, interval, start, end):
+        with self._lock:
+            now = time.monotonic()
+            self._recent = [t for t in self._recent if now - t < 1.0]
+            if len(self._recent) >= self.per_second:
+                self.rejected += 1
+                raise RateLimited("429 Too Many Requests", retry_after=1.0 - (now - self._recent[0]))
+            self._recent.append(now)
+            self.requests += 1
+        time.sleep(self.latency)
+        step = INTERVAL_STEPS[interval]
+        stamps = pd.date_range(to_utc(start).ceil(step), to_utc(end), freq=step)
+        if len(stamps) > self.max_bars:
+            with self._lock:
+                self.too_large += 1
+            raise ValueError(f"{len(stamps)} bars requested, at most {self.max_bars} per request")
+        walk = 100 + (stamps.asi8 // 10 ** 9 % 997) / 100.0
+        return pd.DataFrame({"timestamp": stamps, "open": walk, "high": walk + 0.5, "low": walk - 0.5,
+                             "close": walk, "volume": 1000.0})
+
+def benchmark(days=365, interval="15min", max_bars=500, per_second=20.0):
+    ''' One-shot fetch against sequential and concurrent chunked fetches on a fake vendor '''
+    global FETCH_BACKOFF
+    FETCH_BACKOFF = 0.05
+    start, end = to_utc("2024-01-01"), to_utc("2024-01-01") + pd.Timedelta(days=days)
+    expected = len(pd.date_range(start, end, freq=INTERVAL_STEPS[interval]))
+    print(f"{days} days of {interval} ({expected} bars), vendor allows {max_bars} bars/request, {per_second:.0f} requests/s")
+
+    vendor = FakeVendor(max_bars, per_second)
+    try:
+        vendor("TEST", interval, start, end)
+        print("     one request: ok")
+    except ValueError as e:
+        print(f"     one request: refused ({e})")
+
+    cases = [
+        ("sequential, unthrottled", 1, TokenBucket(1e6, 1e6)),
+        ("concurrent, unthrottled", 16, TokenBucket(1e6, 1e6)),
+        ("concurrent, bucket", 16, TokenBucket(per_second * 0.9, 4)),
+    ]
+    for name, concurrency, bucket in cases:
+        vendor = FakeVendor(max_bars, per_second)
+        streamed = []
+        fetcher = ChunkedFetcher("twelvedata", vendor, max_bars=max_bars, concurrency=concurrency, bucket=bucket,
+                                 on_chunk=lambda ticker, interval, bars: streamed.append(len(bars)))
+        begin = time.perf_counter()
+        try:
+            bars = asyncio.run(fetcher.fetch("TEST", interval, start, end))
+            outcome = f"{len(bars)} bars ok={len(bars) == expected}"
+        except RateLimited:
+            outcome = f"failed, 429s after {FETCH_RETRIES} retries"
+        elapsed = time.perf_counter() - begin
+        print(f"{name:>24}: {outcome} in {elapsed:6.2f}s  "
+              f"requests {vendor.requests}  429s {vendor.rejected}  chunks streamed {len(streamed)}")
+
+if __name__ == "__main__":
+    benchmark()